@@ -1,13 +1,73 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import base64
+import json
+import queue
+import threading
 import numpy as np
-from matching_algo.matching import match_tracks_to_clusters
+from matching_algo.matching import (
+    match_tracks_to_clusters, DEFAULT_TAG_WEIGHTING, DEFAULT_SVD_COMPONENTS, DEFAULT_TAG_SPACE
+)
+from matching_algo.tag_embedding import TAG_EMBEDDING
+from matching_algo.track_index import TrackIndexStore, lookup_track_vector, DEFAULT_NEIGHBOURS
+from matching_algo.k_selection import DEFAULT_K_MIN, DEFAULT_K_MAX
+from matching_algo.metrics import DEFAULT_METRICS_SAMPLE_SIZE
+from matching_algo.streaming import match_library_streaming, iter_chunks
+from matching_algo.jobs import JobManager, JobQueueFullError
+from matching_algo.batch import cluster_playlists_batch
+from matching_algo.playlist_model import update_playlist_clusters, DEFAULT_DRIFT_THRESHOLD
+from matching_algo.serialization import RESPONSE_FORMATS, compact_result, encode_result
+from matching_algo.instrumentation import REGISTRY
+from matching_algo.result_cache import playlist_fingerprint, rebind_tracks, result_cache_from_env
+from matching_algo.matching_visualizer import (
+    MatchingVisualizer, RenderCache, IMAGE_FORMATS, PLOTS, PROJECTION_METHODS
+)
 
 app = Flask(__name__)
+job_manager = JobManager()
+render_cache = RenderCache()
+result_cache = result_cache_from_env()
+track_indexes = TrackIndexStore()
+visualizer = None  # Created on first use so the app starts without a Last.fm key
 
 @app.route('/')
 def home():
     return "Classify Clustering"
 
+def clustering_options(data):
+    """Read the optional match_tracks_to_clusters settings from a request body"""
+    return dict(
+        max_workers=data.get('max_workers'),
+        requests_per_second=data.get('requests_per_second'),
+        n_clusters=data.get('n_clusters'),  # None lets the k sweep decide
+        k_min=data.get('k_min', DEFAULT_K_MIN),
+        k_max=data.get('k_max', DEFAULT_K_MAX),
+        k_criterion=data.get('k_criterion', 'silhouette'),
+        metrics_mode=data.get('metrics', 'auto'),
+        metrics_sample_size=data.get('metrics_sample_size', DEFAULT_METRICS_SAMPLE_SIZE),
+        metrics_seed=data.get('metrics_seed', 42),
+        feature_mode=data.get('feature_mode', 'tags'),
+        audio_weight=data.get('audio_weight', 1.0),
+        include_timings=data.get('timings', False),
+        artist_fallback=data.get('artist_fallback', False),
+        tag_weighting=data.get('tag_weighting', DEFAULT_TAG_WEIGHTING),
+        min_df=data.get('min_df', 1),
+        max_features=data.get('max_features'),
+        stop_tags=data.get('stop_tags'),  # None keeps the default stop-tag list
+        svd_components=data.get('svd_components', DEFAULT_SVD_COMPONENTS),
+        tag_space=data.get('tag_space', DEFAULT_TAG_SPACE),
+        deadline_ms=data.get('deadline_ms'),  # None waits for every Last.fm lookup
+        pending_placement=data.get('pending_placement', 'bucket')
+    )
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus scrape target: stage latencies, Last.fm calls, cache hits, input sizes
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cluster/cache', methods=['GET'])
+def cluster_cache_stats():
+    return jsonify(result_cache.stats())
+
 @app.route('/cluster', methods=['POST'])
 def cluster():
     try:
@@ -15,25 +75,303 @@ def cluster():
         data = request.json
         features = data.get('features', [])
         track_metadata = data.get('track_metadata', [])
-        n_clusters = data.get('n_clusters', 5)
+        algorithm = data.get('algorithm', 'kmeans')
+        response_format = data.get('format', 'full')
 
         # Validate the input
         if not features:
             return jsonify({"error": "Features are required for clustering"}), 400
         if not track_metadata:
             return jsonify({"error": "Track metadata is required for clustering"}), 400
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({"error": f"Unknown response format: {response_format}"}), 400
 
         # Convert the features list to a numpy array
         features_array = np.array(features)
+        options = clustering_options(data)
+
+        # Repeat views of the same playlist and settings are served from the result cache
+        use_cache = data.get('cache', True) and not options['include_timings']
+        key = playlist_fingerprint(
+            track_metadata,
+            features=features_array if options['feature_mode'] != 'tags' else None,
+            algorithm=algorithm, tag_embedding=TAG_EMBEDDING.version if TAG_EMBEDDING else None,
+            **options
+        )
+        result = result_cache.get(key) if use_cache else None
+        if result is not None:
+            result = rebind_tracks(result, track_metadata)
+            if options['deadline_ms']:
+                # Cached results are complete, so nothing was outstanding
+                result['deadline'] = {'deadline_ms': options['deadline_ms'], 'lookups_outstanding': 0,
+                                      'pending_tracks': 0, 'pending_placement': options['pending_placement']}
+        else:
+            # Perform clustering and genre matching using the imported function
+            result = match_tracks_to_clusters(
+                features_array, track_metadata, algorithm, **options
+            )
+            complete = not result.get('tag_fetch_failures') and not result.get('deadline', {}).get('lookups_outstanding')
+            if use_cache and complete:
+                result_cache.set(key, result)  # Runs with failed or outstanding lookups are retried next time
+
+        # Optionally keep the tracks searchable for /similar and /assign
+        index_id = data.get('index_id')
+        if index_id:
+            track_indexes.get(index_id, create=True).add_clustering_result(result)
+            track_indexes.save(index_id)
+
+        # Response: 'compact' references tracks by index; Accept may ask for msgpack
+        if response_format == 'compact':
+            result = compact_result(result)
+        body, mimetype = encode_result(result, request.headers.get('Accept', ''))
+        return Response(body, mimetype=mimetype)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def ndjson_line(event, payload):
+    """Encode one stream event as a line of newline-delimited JSON"""
+    return json.dumps({"event": event, **payload}, default=lambda o: o.item() if hasattr(o, 'item') else str(o)) + "\n"
+
+@app.route('/cluster/stream', methods=['POST'])
+def cluster_stream():
+    try:
+        # Same body as /cluster, answered as NDJSON events while the pipeline runs
+        data = request.json
+        features = data.get('features', [])
+        track_metadata = data.get('track_metadata', [])
+        algorithm = data.get('algorithm', 'kmeans')
+
+        if not features:
+            return jsonify({"error": "Features are required for clustering"}), 400
+        if not track_metadata:
+            return jsonify({"error": "Track metadata is required for clustering"}), 400
+
+        options = clustering_options(data)
+        features_array = np.array(features)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    events = queue.Queue()
+
+    def run():
+        # Pipeline events arrive from fetch worker threads; the queue hands them to the response
+        try:
+            result = match_tracks_to_clusters(
+                features_array, track_metadata, algorithm,
+                on_event=lambda event, payload: events.put((event, payload)),
+                **options
+            )
+            events.put(('result', {'result': result}))
+        except Exception as e:
+            events.put(('error', {'error': str(e)}))
+
+    def generate():
+        threading.Thread(target=run, daemon=True).start()
+        while True:
+            event, payload = events.get()
+            yield ndjson_line(event, payload)
+            if event in ('result', 'error'):
+                break
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/cluster/jobs', methods=['POST'])
+def submit_cluster_job():
+    try:
+        # Same body as /cluster, but returns a job ID straight away
+        data = request.json
+        features = data.get('features', [])
+        track_metadata = data.get('track_metadata', [])
+
+        if not features:
+            return jsonify({"error": "Features are required for clustering"}), 400
+        if not track_metadata:
+            return jsonify({"error": "Track metadata is required for clustering"}), 400
+
+        job = job_manager.submit(
+            match_tracks_to_clusters,
+            total=len(track_metadata),
+            features=np.array(features),
+            track_metadata=track_metadata,
+            algorithm=data.get('algorithm', 'kmeans'),
+            **clustering_options(data)
+        )
+        return jsonify({"job_id": job.id, "status": job.status,
+                        "status_url": f"/cluster/jobs/{job.id}"}), 202
+
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cluster/jobs/<job_id>', methods=['GET'])
+def get_cluster_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/cluster/library', methods=['POST'])
+def cluster_library():
+    try:
+        # Whole-library mode: tracks are processed in chunks with MiniBatchKMeans. The body and the
+        # per-cluster track lists in the response are still O(n); only the model's memory is bounded
+        data = request.json
+        track_metadata = data.get('track_metadata', [])
+        n_clusters = data.get('n_clusters') or 8
+        chunk_size = data.get('chunk_size', 1000)
 
-        # Perform clustering and genre matching using the imported function
-        result = match_tracks_to_clusters(features_array, track_metadata, n_clusters)
+        if not track_metadata:
+            return jsonify({"error": "Track metadata is required for clustering"}), 400
+
+        result = match_library_streaming(
+            lambda: iter_chunks(track_metadata, chunk_size),
+            n_clusters=n_clusters,
+            max_workers=data.get('max_workers'),
+            requests_per_second=data.get('requests_per_second')
+        )
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cluster/incremental', methods=['POST'])
+def cluster_incremental():
+    try:
+        # Re-cluster against the playlist's persisted model, refitting only on drift
+        data = request.json
+        playlist_id = data.get('playlist_id')
+        features = data.get('features', [])
+        track_metadata = data.get('track_metadata', [])
 
-        # Response
+        if not playlist_id:
+            return jsonify({"error": "playlist_id is required for incremental clustering"}), 400
+        if not track_metadata:
+            return jsonify({"error": "Track metadata is required for clustering"}), 400
+
+        result = update_playlist_clusters(
+            playlist_id, np.array(features), track_metadata,
+            drift_threshold=data.get('drift_threshold', DEFAULT_DRIFT_THRESHOLD),
+            force_refit=data.get('force_refit', False),
+            n_clusters=data.get('n_clusters')
+        )
         return jsonify(result)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/cluster/batch', methods=['POST'])
+def cluster_batch():
+    try:
+        # Many playlists per call: shared tag fetch, CPU stages on a process pool
+        data = request.json
+        playlists = data.get('playlists', [])
+
+        if not playlists:
+            return jsonify({"error": "A list of playlists is required for batch clustering"}), 400
+
+        # Each playlist takes the same options as a /cluster body; top-level ones apply to every playlist
+        shared = {name: value for name, value in data.items() if name != 'playlists'}
+        results = cluster_playlists_batch(
+            [{**playlist, **clustering_options({**shared, **playlist})} for playlist in playlists],
+            max_processes=data.get('max_processes'),
+            max_workers=data.get('max_workers'),
+            requests_per_second=data.get('requests_per_second')
+        )
+        return jsonify({"results": results})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def indexed_track_request(data):
+    """Read index_id and track from a /similar or /assign body; returns (index, track, error response)"""
+    index_id = data.get('index_id')
+    track = data.get('track') or {}
+    if not index_id:
+        return None, None, (jsonify({"error": "index_id is required"}), 400)
+    if not track.get('artist') or not track.get('name'):
+        return None, None, (jsonify({"error": "A track with an artist and a name is required"}), 400)
+    index = track_indexes.get(index_id)
+    if index is None:
+        return None, None, (jsonify({"error": "No track index found; cluster with this index_id first"}), 404)
+    return index, track, None
+
+@app.route('/similar', methods=['POST'])
+def similar_tracks():
+    try:
+        # Nearest indexed tracks by cosine similarity of their tag vectors
+        data = request.json
+        index, track, error = indexed_track_request(data)
+        if error:
+            return error
+
+        vector, source = lookup_track_vector(index, track)
+        neighbours = index.query(vector, k=int(data.get('k', DEFAULT_NEIGHBOURS)), exclude=track)
+        return jsonify({"track": track, "vector_source": source, "similar": neighbours})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/assign', methods=['POST'])
+def assign_track():
+    try:
+        # Place one track into the index's existing clusters without re-clustering
+        data = request.json
+        index, track, error = indexed_track_request(data)
+        if error:
+            return error
+
+        vector, source = lookup_track_vector(index, track)
+        assignment = index.assign(vector)
+        if assignment is None:
+            return jsonify({"error": "Track has no known tags or the index has no clusters"}), 422
+        if data.get('insert', False):
+            index.add(track, vector, assignment['cluster'])
+            track_indexes.save(data['index_id'])
+        return jsonify({"track": track, "vector_source": source, **assignment})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/visualize', methods=['POST'])
+def visualize():
+    global visualizer
+    try:
+        # Headless plots; one named plot comes back as the raw image, otherwise base64 JSON
+        data = request.json
+        tracks = data.get('tracks') or data.get('track_metadata', [])
+        plot = data.get('plot')
+        method = data.get('method', 'pca')
+        image_format = data.get('format', 'png')
+
+        if not tracks:
+            return jsonify({"error": "Tracks are required for visualization"}), 400
+        if plot is not None and plot not in PLOTS:
+            return jsonify({"error": f"Unknown plot: {plot}"}), 400
+        if method not in PROJECTION_METHODS:
+            return jsonify({"error": f"Unknown projection method: {method}"}), 400
+        if image_format not in IMAGE_FORMATS:
+            return jsonify({"error": f"Unknown image format: {image_format}"}), 400
+
+        if visualizer is None:
+            visualizer = MatchingVisualizer()
+        images = visualizer.render(
+            tracks, plots=[plot] if plot else PLOTS, method=method,
+            image_format=image_format, cache=render_cache,
+            n_clusters=data.get('n_clusters')
+        )
+
+        if plot:
+            return Response(images[plot], mimetype=IMAGE_FORMATS[image_format])
+        return jsonify({
+            "format": image_format,
+            "mimetype": IMAGE_FORMATS[image_format],
+            "images": {name: base64.b64encode(image).decode('ascii') for name, image in images.items()}
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     app.run(port=5000, debug=True)
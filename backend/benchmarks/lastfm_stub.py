@@ -0,0 +1,114 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from matching_algo.genre_taxonomy import DEFAULT_GENRE_MAPPINGS
+
+
+class TagDistribution:
+    """Deterministic synthetic tags: a few genre tags plus a Zipf-distributed long tail"""
+
+    def __init__(self, n_tail_tags: int = 500, genre_tags: int = 3, tail_tags: int = 3,
+                 zipf_exponent: float = 1.2):
+        self.genres = [[genre, *subgenres] for genre, subgenres in DEFAULT_GENRE_MAPPINGS.items()]
+        self.tail = [f"tag {i}" for i in range(n_tail_tags)]
+        weights = [1.0 / (rank + 1) ** zipf_exponent for rank in range(n_tail_tags)]
+        total = sum(weights)
+        self.tail_weights = [weight / total for weight in weights]
+        self.genre_tags = genre_tags
+        self.tail_tags = tail_tags
+
+    def tags_for(self, artist: str, track: str) -> List[Dict[str, object]]:
+        """Weighted tags for a track; the same track always gets the same tags"""
+        seed = int(hashlib.md5(f"{artist}\x1f{track}".encode('utf-8')).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        genre = rng.choice(self.genres)
+        names = rng.sample(genre, min(self.genre_tags, len(genre)))
+        names += rng.choices(self.tail, weights=self.tail_weights, k=self.tail_tags)
+        counts = {}
+        for rank, name in enumerate(names):
+            counts.setdefault(name, 100 - rank * 10)
+        return [{'name': name, 'count': count} for name, count in counts.items()]
+
+
+class LastFMStub:
+    """Local HTTP server answering track.getTopTags like the Last.fm API.
+
+    latency_ms is the mean response delay (uniformly jittered by +/-50%),
+    error_rate the fraction of requests answered with a retryable 503.
+    Point the client at it with LASTFM_API_URL=stub.url.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, error_rate: float = 0.0,
+                 distribution: Optional[TagDistribution] = None, seed: int = 42):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.distribution = distribution or TagDistribution()
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/2.0/"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                with stub._lock:
+                    stub.requests += 1
+                    delay = stub.latency_ms * stub._rng.uniform(0.5, 1.5) / 1000
+                    failed = stub._rng.random() < stub.error_rate
+                    if failed:
+                        stub.errors += 1
+                if delay:
+                    time.sleep(delay)
+
+                if failed:
+                    status, body = 503, {'error': 16, 'message': "Service temporarily unavailable"}
+                elif params.get('method') != 'track.getTopTags':
+                    status, body = 400, {'error': 3, 'message': "Invalid method"}
+                else:
+                    tags = stub.distribution.tags_for(params.get('artist', ''), params.get('track', ''))
+                    status, body = 200, {'toptags': {'tag': tags, '@attr': {
+                        'artist': params.get('artist', ''), 'track': params.get('track', '')}}}
+
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass  # Keep benchmark output readable
+
+        return Handler
+
+    def start(self) -> 'LastFMStub':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'LastFMStub':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
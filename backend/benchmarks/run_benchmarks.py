@@ -0,0 +1,156 @@
+"""Offline benchmarks for the clustering pipeline.
+
+Runs match_tracks_to_clusters on synthetic playlists against a local Last.fm
+stand-in and records how long each stage takes. Run from the backend
+directory:
+
+    python -m benchmarks.run_benchmarks --sizes 10 100 1000 --output bench.json
+    python -m benchmarks.run_benchmarks --baseline bench.json
+
+With --baseline the run exits non-zero when a stage is slower than the
+baseline by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from matching_algo.matching import match_tracks_to_clusters
+from matching_algo.tag_cache import TagCache
+
+from .lastfm_stub import LastFMStub, TagDistribution
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+STAGES = ('fetch', 'vocabulary', 'vectorize', 'reduce', 'fit', 'genres', 'merge', 'metrics')
+# Differences below this many seconds are noise, not regressions
+MIN_REGRESSION_SECONDS = 0.05
+
+
+def synthetic_playlist(n_tracks: int, n_artists: int = 0) -> Dict[str, Any]:
+    """Random audio features plus track metadata for n_tracks distinct tracks"""
+    n_artists = n_artists or max(n_tracks // 10, 1)
+    rng = np.random.RandomState(n_tracks)
+    return {
+        'features': rng.rand(n_tracks, 5),
+        'track_metadata': [{'name': f"Track {i}", 'artist': f"Artist {i % n_artists}"} for i in range(n_tracks)]
+    }
+
+
+def run_once(n_tracks: int, stub: LastFMStub, max_workers: int,
+             n_clusters: Optional[int]) -> Dict[str, Any]:
+    """Cluster one synthetic playlist with a cold tag cache and time every stage"""
+    playlist = synthetic_playlist(n_tracks)
+    requests_before, errors_before = stub.requests, stub.errors
+    started = time.perf_counter()
+    result = match_tracks_to_clusters(
+        playlist['features'], playlist['track_metadata'],
+        max_workers=max_workers,
+        requests_per_second=0,  # The stub has no rate limit; measure the pipeline itself
+        tag_cache=TagCache(':memory:'),
+        n_clusters=n_clusters,
+        include_timings=True
+    )
+    total = time.perf_counter() - started
+    return {
+        'n_tracks': n_tracks,
+        'total_seconds': total,
+        'stages': {stage: result['timings'].get(stage) for stage in STAGES},
+        'n_clusters': len(result['clusters']),
+        'tag_fetch_failures': result.get('tag_fetch_failures', 0),
+        'stub_requests': stub.requests - requests_before,
+        'stub_errors': stub.errors - errors_before
+    }
+
+
+def find_regressions(runs: List[Dict[str, Any]], baseline: Dict[str, Any],
+                     tolerance: float) -> List[str]:
+    """Describe every stage that is slower than the baseline by more than tolerance"""
+    baseline_runs = {run['n_tracks']: run for run in baseline.get('runs', [])}
+    regressions = []
+    for run in runs:
+        previous = baseline_runs.get(run['n_tracks'])
+        if previous is None:
+            continue
+        timings = {'total': (run['total_seconds'], previous['total_seconds'])}
+        for stage in STAGES:
+            timings[stage] = (run['stages'].get(stage), previous['stages'].get(stage))
+        for name, (current, before) in timings.items():
+            if current is None or before is None:
+                continue
+            if current > before * (1 + tolerance) and current - before > MIN_REGRESSION_SECONDS:
+                regressions.append(f"{run['n_tracks']} tracks, {name}: {before:.3f}s -> {current:.3f}s")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the clustering pipeline against a local Last.fm stub")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Playlist sizes to run")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per size; the fastest is kept")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Mean stub response latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of stub requests that fail")
+    parser.add_argument('--tail-tags', type=int, default=500, help="Size of the long-tail tag pool")
+    parser.add_argument('--max-workers', type=int, default=32, help="Concurrent tag fetches")
+    parser.add_argument('--n-clusters', type=int, default=None, help="Fix k instead of sweeping")
+    parser.add_argument('--output', default=None, help="Write results as JSON to this path")
+    parser.add_argument('--baseline', default=None, help="Compare against a previous results file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before flagging")
+    args = parser.parse_args(argv)
+
+    stub = LastFMStub(latency_ms=args.latency_ms, error_rate=args.error_rate,
+                      distribution=TagDistribution(n_tail_tags=args.tail_tags)).start()
+    # The Last.fm client is shared per API key, so a fresh key picks up the stub URL
+    os.environ['LASTFM_API_URL'] = stub.url
+    os.environ['LASTFM_API_KEY'] = f"benchmark-{stub.url}"
+
+    runs = []
+    try:
+        for n_tracks in args.sizes:
+            attempts = [run_once(n_tracks, stub, args.max_workers, args.n_clusters) for _ in range(args.repeat)]
+            best = min(attempts, key=lambda run: run['total_seconds'])
+            runs.append(best)
+            stages = ", ".join(
+                f"{stage} {seconds:.3f}s" for stage, seconds in best['stages'].items() if seconds is not None
+            )
+            print(f"{n_tracks:>7} tracks: {best['total_seconds']:.3f}s ({stages})")
+    finally:
+        stub.stop()
+
+    report = {
+        'created_at': time.time(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': {
+            'latency_ms': args.latency_ms,
+            'error_rate': args.error_rate,
+            'tail_tags': args.tail_tags,
+            'max_workers': args.max_workers,
+            'n_clusters': args.n_clusters,
+            'repeat': args.repeat
+        },
+        'runs': runs
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(runs, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
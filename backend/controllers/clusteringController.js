@@ -5,7 +5,7 @@ const PYTHON_SERVER = 'http://localhost:5000';
 
 exports.clusterPlaylistTracks = async (req, res) => {
     try {
-        const { tracks, algorithm = 'kmeans' } = req.body;
+        const { tracks, algorithm = 'kmeans', feature_mode, format } = req.body;
         
         if (!tracks || !Array.isArray(tracks)) {
             return res.status(400).json({ error: 'Tracks array is required' });
@@ -30,7 +30,9 @@ exports.clusterPlaylistTracks = async (req, res) => {
         const pythonResponse = await axios.post(`${PYTHON_SERVER}/cluster`, {
             features: features,
             track_metadata: track_metadata,
-            algorithm: algorithm
+            algorithm: algorithm,
+            feature_mode: feature_mode,
+            format: format
         });
 
         res.json(pythonResponse.data);
@@ -57,6 +59,54 @@ exports.clusterPlaylistTracks = async (req, res) => {
     }
 };
 
+// Streams NDJSON progress events from the Python pipeline straight through to the client
+exports.streamPlaylistTracks = async (req, res) => {
+    try {
+        const { tracks, algorithm = 'kmeans', feature_mode } = req.body;
+
+        if (!tracks || !Array.isArray(tracks)) {
+            return res.status(400).json({ error: 'Tracks array is required' });
+        }
+
+        const features = tracks.map(track => [
+            track.features.danceability,
+            track.features.energy,
+            track.features.valence,
+            track.features.tempo,
+            track.features.acousticness
+        ]);
+
+        const track_metadata = tracks.map(track => ({
+            name: track.name,
+            artist: track.artists,
+            genres: track.genres || []
+        }));
+
+        const pythonResponse = await axios.post(`${PYTHON_SERVER}/cluster/stream`, {
+            features: features,
+            track_metadata: track_metadata,
+            algorithm: algorithm,
+            feature_mode: feature_mode
+        }, { responseType: 'stream' });
+
+        res.setHeader('Content-Type', 'application/x-ndjson');
+        pythonResponse.data.pipe(res);
+    } catch (error) {
+        console.error('Error in streaming clustering:', error.message);
+        if (error.code === 'ECONNREFUSED') {
+            res.status(503).json({
+                error: 'Clustering service unavailable',
+                details: 'Please ensure the Python server is running on port 5000'
+            });
+        } else {
+            res.status(error.response ? error.response.status : 500).json({
+                error: 'Clustering failed',
+                details: error.message
+            });
+        }
+    }
+};
+
 exports.matchAndVisualize = async (enrichedTracks) => {
   // post to python server: "http://localhost:5000/visualize"
   try {
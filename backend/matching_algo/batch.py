@@ -0,0 +1,136 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+
+from .matching import (
+    FEATURE_MODES,
+    cluster_tagged_tracks,
+    fetch_track_tag_weights_with_status,
+    fill_from_artist_tags,
+    get_lastfm_api_key,
+    get_local_track_tags,
+    match_tracks_by_audio
+)
+from .tag_cache import TagCache, get_default_tag_cache, normalize_track_key
+
+# Options a batch item may set for its own clustering run; named as in match_tracks_to_clusters
+PLAYLIST_OPTIONS = ('n_clusters', 'k_min', 'k_max', 'k_criterion',
+                    'metrics_mode', 'metrics_sample_size', 'metrics_seed',
+                    'tag_weighting', 'min_df', 'max_features', 'stop_tags', 'svd_components',
+                    'tag_space', 'feature_mode', 'audio_weight', 'artist_fallback')
+# Options that only shape tag vectors, so the audio and hybrid modes drop them
+TAG_OPTIONS = ('tag_weighting', 'min_df', 'max_features', 'stop_tags', 'svd_components', 'tag_space')
+
+
+def _cluster_playlist(features, track_metadata: List[Dict], all_track_tags: List[Any],
+                      options: Dict[str, Any]) -> Dict[str, Any]:
+    """Process-pool worker: vectorize, fit and merge one playlist"""
+    # Parallelism comes from the pool, so each worker sweeps k on a single core
+    feature_mode = options.pop('feature_mode', 'tags')
+    if feature_mode == 'tags':
+        return cluster_tagged_tracks(track_metadata, all_track_tags, n_jobs=1, **options)
+    clustering_options = {name: value for name, value in options.items() if name not in TAG_OPTIONS}
+    return match_tracks_by_audio(features, track_metadata, hybrid=feature_mode == 'hybrid',
+                                 all_track_tags=all_track_tags, n_jobs=1, **clustering_options)
+
+
+def cluster_playlists_batch(playlists: List[Dict[str, Any]],
+                            max_processes: Optional[int] = None,
+                            api_key: Optional[str] = None,
+                            max_workers: Optional[int] = None,
+                            requests_per_second: Optional[float] = None,
+                            tag_cache: Optional[TagCache] = None,
+                            artist_fallback: bool = False,
+                            **default_options) -> List[Dict[str, Any]]:
+    """Cluster many playlists at once.
+
+    Tag lookups are deduplicated across the whole batch and fetched in one
+    concurrent, rate-limited pass. The CPU-bound stages then run on a process
+    pool sized to the machine's cores. Each playlist is a dict with an 'id',
+    'track_metadata', optional 'features' and any PLAYLIST_OPTIONS; results
+    come back in input order as {'id', 'result'} or {'id', 'error'}.
+    Playlists in the 'audio' and 'hybrid' feature modes only read local tags,
+    as in match_tracks_to_clusters. artist_fallback is the default for
+    playlists that do not set it.
+    """
+    cache = tag_cache or get_default_tag_cache()
+    items = []
+    for i, playlist in enumerate(playlists):
+        options = {**default_options, **{name: playlist[name] for name in PLAYLIST_OPTIONS if name in playlist}}
+        options.setdefault('feature_mode', 'tags')
+        fallback = options.pop('artist_fallback', artist_fallback)
+        track_keys = [
+            normalize_track_key(track['artist'], track['name'])
+            if 'artist' in track and 'name' in track else None
+            for track in playlist.get('track_metadata') or []
+        ]
+        items.append((playlist.get('id', i), playlist.get('track_metadata') or [], track_keys, options, fallback))
+
+    # One lookup per distinct (artist, track) across the tag-mode playlists of the batch
+    unique_tracks: Dict[str, Dict] = {}
+    fallback_keys = set()
+    for _, track_metadata, track_keys, options, fallback in items:
+        if options['feature_mode'] != 'tags':
+            continue
+        for track, key in zip(track_metadata, track_keys):
+            if key:
+                unique_tracks.setdefault(key, track)
+                if fallback:
+                    fallback_keys.add(key)
+    keys = list(unique_tracks)
+    tags_by_key, failed_keys, fallback_by_key = {}, set(), {}
+    if keys:
+        if api_key is None:
+            api_key = get_lastfm_api_key()
+        fetched_tags, failed = fetch_track_tag_weights_with_status(
+            [unique_tracks[key] for key in keys], api_key,
+            max_workers=max_workers,
+            requests_per_second=requests_per_second,
+            cache=cache
+        )
+        tags_by_key = dict(zip(keys, fetched_tags))
+        failed_keys = {keys[i] for i in failed}
+
+        # Playlists that asked for artist_fallback see their untagged tracks filled in
+        fallback_keys = [key for key in keys if key in fallback_keys]
+        fallback_tags = [dict(tags_by_key[key]) for key in fallback_keys]
+        fill_from_artist_tags(
+            [unique_tracks[key] for key in fallback_keys], fallback_tags,
+            {j for j, key in enumerate(fallback_keys) if key in failed_keys},
+            api_key, max_workers, requests_per_second, cache, emit=lambda event, payload: None
+        )
+        fallback_by_key = dict(zip(fallback_keys, fallback_tags))
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(playlists)
+    futures = {}
+    with ProcessPoolExecutor(max_workers=max_processes or os.cpu_count()) as executor:
+        for i, (playlist_id, track_metadata, track_keys, options, fallback) in enumerate(items):
+            if not track_metadata:
+                results[i] = {'id': playlist_id, 'error': "Track metadata is required for clustering"}
+                continue
+            if options['feature_mode'] not in FEATURE_MODES:
+                results[i] = {'id': playlist_id, 'error': f"Unknown feature mode: {options['feature_mode']}"}
+                continue
+
+            if options['feature_mode'] == 'tags':
+                source = fallback_by_key if fallback else tags_by_key
+                all_track_tags = [source.get(key, {}) if key else {} for key in track_keys]
+                n_failed = sum(1 for key in track_keys if key in failed_keys)
+            else:
+                all_track_tags = get_local_track_tags(track_metadata, cache)
+                n_failed = 0
+            futures[i] = (
+                executor.submit(_cluster_playlist, playlists[i].get('features'), track_metadata,
+                                all_track_tags, options),
+                n_failed
+            )
+
+        for i, (future, n_failed) in futures.items():
+            playlist_id = items[i][0]
+            try:
+                results[i] = {'id': playlist_id, 'result': {**future.result(), 'tag_fetch_failures': n_failed}}
+            except Exception as e:
+                results[i] = {'id': playlist_id, 'error': str(e)}
+
+    return results
@@ -0,0 +1,45 @@
+"""Build the tag embedding from every track in the Last.fm tag cache.
+
+Run from the backend directory; the server picks the artifact up from
+TAG_EMBEDDING_PATH (or the default location) at its next start:
+
+    python -m matching_algo.build_tag_embedding --dimensions 64 --min-count 5
+"""
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+from .tag_cache import DEFAULT_CACHE_PATH, TagCache
+from .tag_embedding import (
+    DEFAULT_DIMENSIONS,
+    DEFAULT_EMBEDDING_PATH,
+    DEFAULT_MAX_TAGS,
+    DEFAULT_MIN_COUNT,
+    build_tag_embedding
+)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build the tag embedding from the Last.fm tag cache")
+    parser.add_argument('--cache', default=os.getenv('LASTFM_TAG_CACHE_PATH', DEFAULT_CACHE_PATH),
+                        help="Tag cache to read tracks from")
+    parser.add_argument('--output', default=os.getenv('TAG_EMBEDDING_PATH', DEFAULT_EMBEDDING_PATH),
+                        help="Where to write the artifact")
+    parser.add_argument('--dimensions', type=int, default=DEFAULT_DIMENSIONS, help="Embedding size")
+    parser.add_argument('--min-count', type=int, default=DEFAULT_MIN_COUNT, help="Tracks a tag needs to be kept")
+    parser.add_argument('--max-tags', type=int, default=DEFAULT_MAX_TAGS, help="Largest vocabulary to embed")
+    args = parser.parse_args(argv)
+
+    cache = TagCache(args.cache)
+    embedding = build_tag_embedding(cache.iter_tag_weights(), dimensions=args.dimensions,
+                                    min_count=args.min_count, max_tags=args.max_tags)
+    embedding.save(args.output)
+    print(f"Wrote tag embedding {embedding.version} to {args.output}: "
+          f"{embedding.metadata['n_tags']} tags from {embedding.metadata['n_tracks']} tracks, "
+          f"{embedding.dimensions} dimensions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,19 @@
+import os
+from typing import Callable
+
+
+def atomic_write(path: str, write: Callable[[str], None], suffix: str = '.tmp'):
+    """Call write(tmp_path), then move the file over path.
+
+    os.replace is atomic, so readers (including other server processes) see
+    either the old file or the complete new one, never a half-written one.
+    suffix lets writers that insist on an extension, like np.savez, keep it.
+    """
+    tmp_path = f"{path}{suffix}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,98 @@
+import json
+import os
+from collections import Counter
+from typing import Dict, Iterable, List, Mapping, Optional
+
+import numpy as np
+from scipy import sparse
+
+# Base genre -> tags that count towards it (the base genre name always counts too)
+DEFAULT_GENRE_MAPPINGS = {
+    'rock': ['rock', 'classic rock', 'hard rock', 'alternative rock',
+             'indie rock', 'progressive rock', 'punk rock', 'folk rock'],
+    'pop': ['pop', 'synth pop', 'indie pop', 'power pop', 'electropop'],
+    'hip hop': ['hip hop', 'rap', 'trap', 'grime'],
+    'jazz': ['jazz', 'smooth jazz', 'fusion', 'bebop', 'big band'],
+    'electronic': ['electronic', 'edm', 'techno', 'house', 'trance'],
+    'folk': ['folk', 'americana', 'traditional', 'singer-songwriter'],
+    'metal': ['metal', 'heavy metal', 'black metal', 'death metal'],
+    'r&b': ['r&b', 'soul', 'funk', 'motown'],
+    'blues': ['blues', 'delta blues', 'chicago blues'],
+    'classical': ['classical', 'orchestra', 'symphony', 'chamber music']
+}
+
+UNCLASSIFIED = 'unclassified'
+
+
+class GenreTaxonomy:
+    """Genre mappings compiled into an inverted tag -> genre index.
+
+    Ties between genres are broken by taxonomy order, so the same tags always
+    give the same genre regardless of the order they arrive in.
+    """
+
+    def __init__(self, genre_mappings: Mapping[str, Iterable[str]]):
+        self.genres: List[str] = list(genre_mappings)
+        self.tag_index: Dict[str, List[int]] = {}
+        for genre_id, (genre, subgenres) in enumerate(genre_mappings.items()):
+            for tag in {genre.lower(), *(tag.lower() for tag in subgenres)}:
+                self.tag_index.setdefault(tag, []).append(genre_id)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'GenreTaxonomy':
+        """Load mappings from a JSON file of {"genre": ["tag", ...]}"""
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def genre_for_tag_counts(self, tag_counts: Mapping[str, int]) -> str:
+        """Return the base genre with the most matching tag occurrences"""
+        genre_counts = np.zeros(len(self.genres))
+        for tag, count in tag_counts.items():
+            for genre_id in self.tag_index.get(tag.lower(), ()):
+                genre_counts[genre_id] += count
+        if not genre_counts.any():
+            return UNCLASSIFIED
+        return self.genres[int(np.argmax(genre_counts))]
+
+    def genre_for_tags(self, tags: List[str]) -> str:
+        """Return the base genre for a list of tags"""
+        return self.genre_for_tag_counts(Counter(tags))
+
+    def tag_genre_matrix(self, tag_vocabulary: Dict[str, int]) -> sparse.csr_matrix:
+        """Binary (vocabulary x genres) matrix linking each tag to its genres"""
+        rows, cols = [], []
+        for tag, idx in tag_vocabulary.items():
+            for genre_id in self.tag_index.get(tag, ()):
+                rows.append(idx)
+                cols.append(genre_id)
+        return sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(tag_vocabulary), len(self.genres))
+        )
+
+    def assign_cluster_genres(self, tag_matrix: sparse.spmatrix, labels: np.ndarray,
+                              n_clusters: int, tag_vocabulary: Dict[str, int]) -> List[str]:
+        """Assign a genre to every cluster at once from the track x tag matrix and labels"""
+        n_tracks = tag_matrix.shape[0]
+        membership = sparse.csr_matrix(
+            (np.ones(n_tracks), (labels, np.arange(n_tracks))),
+            shape=(n_clusters, n_tracks)
+        )
+        # (clusters x tracks) @ (tracks x tags) @ (tags x genres) -> genre counts per cluster
+        genre_counts = (membership @ tag_matrix @ self.tag_genre_matrix(tag_vocabulary)).toarray()
+        return [
+            self.genres[int(np.argmax(counts))] if counts.any() else UNCLASSIFIED
+            for counts in genre_counts
+        ]
+
+
+def load_genre_taxonomy(path: Optional[str] = None) -> GenreTaxonomy:
+    """Load the taxonomy from path or GENRE_TAXONOMY_PATH, falling back to the built-in mappings"""
+    path = path or os.getenv('GENRE_TAXONOMY_PATH')
+    if path:
+        return GenreTaxonomy.from_file(path)
+    return GenreTaxonomy(DEFAULT_GENRE_MAPPINGS)
+
+
+# Compiled once at import
+GENRE_TAXONOMY = load_genre_taxonomy()
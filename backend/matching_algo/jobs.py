@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_JOB_WORKERS = int(os.getenv('CLUSTER_JOB_WORKERS', 2))
+DEFAULT_MAX_JOBS = int(os.getenv('CLUSTER_MAX_JOBS', 200))
+DEFAULT_JOB_RETENTION_SECONDS = float(os.getenv('CLUSTER_JOB_RETENTION', 3600))
+# track_tags statuses that mean the track's tags are available; artist fallbacks arrive as 'fetched'
+TAGGED_STATUSES = frozenset({'cached', 'fetched'})
+
+
+class JobQueueFullError(Exception):
+    """Raised when every retained job slot is taken by an unfinished job"""
+
+
+class ClusteringJob:
+    """State of one asynchronous clustering run"""
+
+    def __init__(self, job_id: str, total: int):
+        self.id = job_id
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.total = total
+        self.tags_fetched = 0
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def on_event(self, event: str, payload: Dict[str, Any]):
+        """Pipeline event hook; counts tracks whose tags are available"""
+        with self._lock:
+            if event == 'fetch_started':
+                self.total = payload['total']
+            elif event == 'track_tags' and payload.get('status') in TAGGED_STATUSES:
+                self.tags_fetched += 1
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        with self._lock:
+            data = {
+                'job_id': self.id,
+                'status': self.status,
+                'progress': {
+                    'tags_fetched': self.tags_fetched,
+                    'total': self.total,
+                    'fraction': self.tags_fetched / self.total if self.total else 0.0
+                },
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at
+            }
+        if self.error is not None:
+            data['error'] = self.error
+        if include_result and self.result is not None:
+            data['result'] = self.result
+        return data
+
+
+class JobManager:
+    """Runs clustering jobs on a local thread pool with bounded, in-process retention.
+
+    Finished jobs are kept for retention_seconds and at most max_jobs jobs
+    are held at once; the oldest finished jobs are dropped first.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_JOB_WORKERS,
+                 max_jobs: int = DEFAULT_MAX_JOBS,
+                 retention_seconds: float = DEFAULT_JOB_RETENTION_SECONDS):
+        self.max_jobs = max_jobs
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cluster-job')
+        self._jobs: 'OrderedDict[str, ClusteringJob]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, make_room: bool = False):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > self.retention_seconds:
+                del self._jobs[job_id]
+        if not make_room:
+            return
+        for job_id, job in list(self._jobs.items()):
+            if len(self._jobs) < self.max_jobs:
+                break
+            if job.finished:
+                del self._jobs[job_id]
+
+    def submit(self, func: Callable[..., Dict[str, Any]], total: int = 0, **kwargs) -> ClusteringJob:
+        """Queue func(**kwargs, on_event=...) and return its job immediately"""
+        with self._lock:
+            self._prune(make_room=True)
+            if len(self._jobs) >= self.max_jobs:
+                raise JobQueueFullError("Too many clustering jobs in progress, try again later")
+            job = ClusteringJob(uuid.uuid4().hex, total)
+            self._jobs[job.id] = job
+
+        def run():
+            job.status = 'running'
+            job.started_at = time.time()
+            result, error = None, None
+            try:
+                result = func(**kwargs, on_event=job.on_event)
+            except Exception as e:
+                error = str(e)
+            with job._lock:
+                # finished_at is set first so _prune never sees a finished job without it
+                job.finished_at = time.time()
+                job.result = result
+                job.error = error
+                job.status = 'done' if error is None else 'failed'
+
+        self._executor.submit(run)
+        return job
+
+    def get(self, job_id: str) -> Optional[ClusteringJob]:
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
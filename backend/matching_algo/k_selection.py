@@ -0,0 +1,97 @@
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+
+from .metrics import sparse_calinski_harabasz_score, sparse_davies_bouldin_score
+
+DEFAULT_K_MIN = 2
+DEFAULT_K_MAX = 8
+# Below this many tracks, thread workers are cheaper than spawning processes
+PROCESS_POOL_MIN_SAMPLES = 2000
+SILHOUETTE_SAMPLE_SIZE = 1000
+
+CRITERIA = ('silhouette', 'calinski_harabasz', 'davies_bouldin')
+
+
+def score_clustering(X, labels: np.ndarray, criterion: str = 'silhouette',
+                     random_state: int = 42) -> float:
+    """Score a clustering so that higher is always better"""
+    if len(np.unique(labels)) < 2:
+        return float('-inf')
+    if criterion == 'silhouette':
+        sample_size = SILHOUETTE_SAMPLE_SIZE if X.shape[0] > SILHOUETTE_SAMPLE_SIZE else None
+        return float(silhouette_score(X, labels, sample_size=sample_size, random_state=random_state))
+    if criterion == 'calinski_harabasz':
+        return sparse_calinski_harabasz_score(X, labels)
+    if criterion == 'davies_bouldin':
+        return -sparse_davies_bouldin_score(X, labels)
+    raise ValueError(f"Unknown k-selection criterion: {criterion}")
+
+
+def fit_and_score(X, k: int, criterion: str = 'silhouette', random_state: int = 42,
+                  n_init: int = 10) -> Tuple[int, float, np.ndarray]:
+    """Fit KMeans with k clusters and return (k, score, labels)"""
+    labels = KMeans(n_clusters=k, random_state=random_state, n_init=n_init).fit_predict(X)
+    return k, score_clustering(X, labels, criterion, random_state), labels
+
+
+def _improves(score: float, best_score: float, tolerance: float) -> bool:
+    if best_score == float('-inf'):
+        return score > best_score
+    return score > best_score + tolerance * abs(best_score)
+
+
+def select_n_clusters(X, k_min: int = DEFAULT_K_MIN, k_max: int = DEFAULT_K_MAX,
+                      criterion: str = 'silhouette', n_jobs: Optional[int] = None,
+                      patience: int = 2, tolerance: float = 0.01,
+                      random_state: int = 42) -> Dict:
+    """Sweep k in parallel waves and pick the best-scoring clustering.
+
+    Candidates are evaluated n_jobs at a time in increasing k. The sweep stops
+    once `patience` consecutive k values fail to beat the best score by more
+    than `tolerance` (relative). Returns the chosen k, its labels, and the
+    score of every k that was evaluated.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"Unknown k-selection criterion: {criterion}")
+
+    n_samples = X.shape[0]
+    k_max = max(min(k_max, n_samples - 1), 1)
+    k_min = min(max(2, k_min), k_max)
+    candidates = list(range(k_min, k_max + 1))
+    n_jobs = n_jobs or os.cpu_count() or 1
+    prefer = 'processes' if n_samples >= PROCESS_POOL_MIN_SAMPLES else 'threads'
+
+    scores: Dict[int, float] = {}
+    best_k, best_score, best_labels = None, float('-inf'), None
+    stale = 0
+    stopped_early = False
+
+    with Parallel(n_jobs=min(n_jobs, len(candidates)), prefer=prefer) as parallel:
+        for start in range(0, len(candidates), n_jobs):
+            wave = candidates[start:start + n_jobs]
+            results = parallel(delayed(fit_and_score)(X, k, criterion, random_state) for k in wave)
+
+            for k, score, labels in sorted(results, key=lambda r: r[0]):
+                scores[k] = score
+                if best_k is None or _improves(score, best_score, tolerance):
+                    best_k, best_score, best_labels = k, score, labels
+                    stale = 0
+                else:
+                    stale += 1
+
+            if stale >= patience and start + n_jobs < len(candidates):
+                stopped_early = True
+                break
+
+    return {
+        'chosen_k': best_k,
+        'labels': best_labels,
+        'criterion': criterion,
+        'scores': scores,
+        'stopped_early': stopped_early
+    }
@@ -0,0 +1,192 @@
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .instrumentation import LASTFM_RETRIES
+
+DEFAULT_BASE_URL = "http://ws.audioscrobbler.com/2.0/"
+
+# Last.fm error codes that mean "this track has no tags" rather than a failed fetch
+NOT_FOUND_ERRORS = {6}
+# Last.fm error codes for temporary problems that are worth retrying
+RETRYABLE_ERRORS = {8, 11, 16, 29}
+
+
+class LastFMError(Exception):
+    """Raised when a Last.fm lookup failed, as opposed to returning no tags"""
+
+
+class CircuitOpenError(LastFMError):
+    """Raised without calling Last.fm while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Fail fast after repeated Last.fm failures, then let one trial request through"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow_request(self) -> bool:
+        """Return True if a request may be sent to Last.fm right now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class LastFMClient:
+    """Reusable Last.fm API client with pooled connections, retries and a circuit breaker.
+
+    get_track_tags returns [] when Last.fm answered that a track has no tags
+    and raises LastFMError when the lookup itself failed.
+    """
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None,
+                 timeout: Tuple[float, float] = (3.05, 10.0),
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 pool_size: int = 16, circuit_breaker: Optional[CircuitBreaker] = None):
+        self.api_key = api_key
+        self.base_url = base_url or os.getenv('LASTFM_API_URL', DEFAULT_BASE_URL)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+        # Keep-alive pool sized for the concurrent fetch stage
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Full-jitter exponential backoff, honouring Retry-After when given"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _request(self, params: Dict[str, str]) -> Dict:
+        """Call the API, retrying 429/5xx responses with backoff"""
+        params = {**params, 'api_key': self.api_key, 'format': 'json'}
+
+        for attempt in range(self.max_retries + 1):
+            if not self.circuit_breaker.allow_request():
+                raise CircuitOpenError("Last.fm circuit breaker is open")
+
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                self.circuit_breaker.record_failure()
+                raise LastFMError(f"Request to Last.fm failed: {str(e)}") from e
+
+            retryable = response.status_code == 429 or response.status_code >= 500
+            data = None
+            if not retryable:
+                try:
+                    data = response.json()
+                except ValueError as e:
+                    self.circuit_breaker.record_failure()
+                    raise LastFMError(f"Invalid JSON from Last.fm (HTTP {response.status_code})") from e
+                retryable = data.get('error') in RETRYABLE_ERRORS
+
+            if not retryable:
+                self.circuit_breaker.record_success()
+                if 'error' in data and data['error'] not in NOT_FOUND_ERRORS:
+                    raise LastFMError(f"Last.fm error {data['error']}: {data.get('message', '')}")
+                return data
+
+            self.circuit_breaker.record_failure()
+            if attempt == self.max_retries:
+                break
+            LASTFM_RETRIES.inc()
+            time.sleep(self._backoff_delay(attempt, response.headers.get('Retry-After')))
+
+        raise LastFMError(f"Last.fm still failing after {self.max_retries + 1} attempts "
+                          f"(HTTP {response.status_code})")
+
+    def get_track_tag_weights(self, artist: str, track: str) -> Dict[str, float]:
+        """Get a track's dominant tags with their weight relative to the top tag"""
+        data = self._request({
+            'method': 'track.getTopTags',
+            'artist': artist,
+            'track': track,
+            'autocorrect': '1'
+        })
+        return self._dominant_tag_weights(data)
+
+    def get_track_tags(self, artist: str, track: str) -> List[str]:
+        """Get the dominant tags for a track, or [] if Last.fm has none"""
+        return list(self.get_track_tag_weights(artist, track))
+
+    def get_artist_tag_weights(self, artist: str) -> Dict[str, float]:
+        """Get an artist's dominant tags with their weight relative to the top tag"""
+        data = self._request({
+            'method': 'artist.getTopTags',
+            'artist': artist,
+            'autocorrect': '1'
+        })
+        return self._dominant_tag_weights(data)
+
+    def get_artist_tags(self, artist: str) -> List[str]:
+        """Get the dominant tags for an artist, or [] if Last.fm has none"""
+        return list(self.get_artist_tag_weights(artist))
+
+    @staticmethod
+    def _dominant_tag_weights(data: Dict) -> Dict[str, float]:
+        """Keep the tags counted above 30% of the top tag, weighted by count / top count"""
+        if 'toptags' in data and 'tag' in data['toptags']:
+            tags = [(tag['name'], float(tag['count'])) for tag in data['toptags']['tag']]
+            if tags:
+                max_weight = max(weight for _, weight in tags)
+                return {tag: weight / max_weight for tag, weight in tags if weight > max_weight * 0.3}
+        return {}
+
+
+_clients: Dict[str, LastFMClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_lastfm_client(api_key: str) -> LastFMClient:
+    """Return the shared client for an API key so its connection pool is reused"""
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = LastFMClient(api_key)
+        return _clients[api_key]
@@ -1,84 +1,415 @@
 from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import silhouette_score, davies_bouldin_score, calinski_harabasz_score
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.preprocessing import Normalizer, StandardScaler
 from collections import Counter, defaultdict
+from itertools import chain
+import time
 import numpy as np
-import requests
-from typing import List, Dict, Any
+from scipy import sparse
+from typing import List, Dict, Any, Callable, Iterable, Mapping, Optional, Tuple, Union
+from .tag_fetching import PENDING, SingleFlight, run_rate_limited
+from .tag_cache import TagCache, get_default_tag_cache, normalize_tag_weights, normalize_track_key
+from .lastfm_client import LastFMError, get_lastfm_client
+from .metrics import compute_cluster_metrics, DEFAULT_METRICS_SAMPLE_SIZE
+from .k_selection import select_n_clusters, DEFAULT_K_MIN, DEFAULT_K_MAX
+from .genre_taxonomy import GENRE_TAXONOMY
+from .tag_embedding import DEFAULT_STOP_TAGS, TAG_EMBEDDING, TagEmbedding
+from .instrumentation import (
+    INPUT_TRACKS,
+    LASTFM_COALESCED,
+    LASTFM_REQUEST_SECONDS,
+    LASTFM_REQUESTS,
+    TRACK_TAG_LOOKUPS,
+    VOCABULARY_SIZE,
+    StageTimer
+)
+
+FEATURE_MODES = ('tags', 'audio', 'hybrid')
+# 'binary' ignores weights, 'weights' uses Last.fm's relative tag counts, 'tfidf' reweights those by rarity
+TAG_WEIGHTINGS = ('binary', 'weights', 'tfidf')
+DEFAULT_TAG_WEIGHTING = 'tfidf'
+# Tag vectors are projected to this many dimensions before fitting when the vocabulary is larger
+DEFAULT_SVD_COMPONENTS = 64
+# 'vocabulary' builds per-request tag vectors, 'embedding' averages the global tag embedding's
+# vectors, 'auto' uses the embedding when one is loaded and knows enough of the playlist's tracks
+TAG_SPACES = ('auto', 'vocabulary', 'embedding')
+DEFAULT_TAG_SPACE = 'auto'
+MIN_EMBEDDING_COVERAGE = 0.5
+# With deadline_ms, tag lookups get this share of the budget; the rest is left for clustering
+DEADLINE_FETCH_FRACTION = 0.75
+# Tracks whose tags are still outstanding at the deadline go to a 'pending' cluster or join
+# the nearest cluster by audio features
+PENDING_PLACEMENTS = ('bucket', 'audio')
+
+# A track's tags: a list of names, or {name: weight} when Last.fm weights are known
+TrackTags = Union[List[str], Mapping[str, float]]
+
+# Artist-level tags are cached under the artist with an empty track name
+ARTIST_TAGS_TRACK = ''
+
+# on_event(event_name, payload) hook used to report pipeline progress
+EventCallback = Callable[[str, Dict[str, Any]], None]
+
+# Identical lookups from concurrent requests share one outbound call
+_lastfm_flights = SingleFlight()
+
+def get_lastfm_api_key() -> str:
+    """Read LASTFM_API_KEY from the environment (or .env), raising ValueError when it is missing"""
+    import os
+    from dotenv import load_dotenv
+    load_dotenv()
+    api_key = os.getenv('LASTFM_API_KEY')
+    if not api_key:
+        raise ValueError("LASTFM_API_KEY not found in environment variables")
+    return api_key
+
+def _coalesced_lastfm_call(key: Tuple[str, str], call: Callable[[], Dict[str, float]]) -> Dict[str, float]:
+    """Run a Last.fm call once per key at a time, recording latency and outcome"""
+    def instrumented():
+        with LASTFM_REQUEST_SECONDS.time():
+            try:
+                tags = call()
+            except LastFMError:
+                LASTFM_REQUESTS.inc(outcome='failure')
+                raise
+        LASTFM_REQUESTS.inc(outcome='success')
+        return tags
+
+    tags, shared = _lastfm_flights.do(key, instrumented)
+    if shared:
+        LASTFM_COALESCED.inc()
+    return dict(tags)
+
+def fetch_lastfm_tags(artist: str, track: str, api_key: str) -> Dict[str, float]:
+    """Get track tags and their relative weights from Last.fm API, raising LastFMError if the lookup failed"""
+    return _coalesced_lastfm_call(
+        ('track', normalize_track_key(artist, track)),
+        lambda: get_lastfm_client(api_key).get_track_tag_weights(artist, track)
+    )
+
+def fetch_artist_tags(artist: str, api_key: str) -> Dict[str, float]:
+    """Get artist-level tags and their relative weights from Last.fm API, raising LastFMError if the lookup failed"""
+    return _coalesced_lastfm_call(
+        ('artist', normalize_track_key(artist, ARTIST_TAGS_TRACK)),
+        lambda: get_lastfm_client(api_key).get_artist_tag_weights(artist)
+    )
 
 def get_lastfm_tags(artist: str, track: str, api_key: str) -> List[str]:
     """Get track tags from Last.fm API"""
-    base_url = "http://ws.audioscrobbler.com/2.0/"
-    params = {
-        'method': 'track.getTopTags',
-        'api_key': api_key,
-        'artist': artist,
-        'track': track,
-        'format': 'json',
-        'autocorrect': 1
-    }
-    
     try:
-        response = requests.get(base_url, params=params)
-        data = response.json()
-        
-        if 'toptags' in data and 'tag' in data['toptags']:
-            tags = [(tag['name'], float(tag['count'])) for tag in data['toptags']['tag']]
-            if tags:
-                max_weight = max(weight for _, weight in tags)
-                return [tag for tag, weight in tags if weight > max_weight * 0.3]
+        return list(fetch_lastfm_tags(artist, track, api_key))
+    except LastFMError as e:
+        print(f"Error getting tags for {track} by {artist}: {str(e)}")
         return []
-    except Exception as e:
+
+def fetch_cached_lastfm_tag_weights(artist: str, track: str, api_key: str,
+                                    cache: Optional[TagCache] = None) -> Dict[str, float]:
+    """Get {tag: weight} for a track through the tag cache, raising LastFMError if the fetch failed"""
+    cache = cache or get_default_tag_cache()
+    weights = cache.get_weights(artist, track)
+    if weights is None:
+        weights = normalize_tag_weights(fetch_lastfm_tags(artist, track, api_key))
+        cache.set(artist, track, weights)  # Only successful lookups are cached
+    return weights
+
+def fetch_cached_lastfm_tags(artist: str, track: str, api_key: str,
+                             cache: Optional[TagCache] = None) -> List[str]:
+    """Get track tags through the tag cache, raising LastFMError if the fetch failed"""
+    return list(fetch_cached_lastfm_tag_weights(artist, track, api_key, cache))
+
+def fetch_cached_artist_tag_weights(artist: str, api_key: str,
+                                    cache: Optional[TagCache] = None) -> Dict[str, float]:
+    """Get {tag: weight} for an artist through the tag cache, raising LastFMError if the fetch failed"""
+    cache = cache or get_default_tag_cache()
+    weights = cache.get_weights(artist, ARTIST_TAGS_TRACK)
+    if weights is None:
+        weights = normalize_tag_weights(fetch_artist_tags(artist, api_key))
+        cache.set(artist, ARTIST_TAGS_TRACK, weights)
+    return weights
+
+def get_cached_lastfm_tags(artist: str, track: str, api_key: str,
+                           cache: Optional[TagCache] = None) -> List[str]:
+    """Get track tags through the persistent tag cache"""
+    try:
+        return fetch_cached_lastfm_tags(artist, track, api_key, cache)
+    except LastFMError as e:
         print(f"Error getting tags for {track} by {artist}: {str(e)}")
         return []
 
+def fetch_track_tag_weights_with_status(track_metadata: List[Dict], api_key: str,
+                                        max_workers: Optional[int] = None,
+                                        requests_per_second: Optional[float] = None,
+                                        cache: Optional[TagCache] = None,
+                                        on_event: Optional[EventCallback] = None,
+                                        artist_fallback: bool = False) -> Tuple[List[Dict[str, float]], List[int]]:
+    """Fetch Last.fm tags with their weights for every track concurrently, keeping input order.
+
+    Returns one {tag: weight} per track plus the indices of tracks whose
+    lookup failed, so "no tags" can be told apart from "fetch failed".
+    Failed tracks get {}. Repeated (artist, track) pairs are looked up once.
+    With artist_fallback, tracks Last.fm has no tags for get their artist's
+    top tags, fetched once per artist.
+    on_event receives 'fetch_started' once and then 'track_tags' for every
+    track as its tags become available (possibly from worker threads), plus
+    'artist_tags' for tracks filled in from their artist.
+    """
+    all_tag_weights, failed, _ = fetch_track_tag_weights_until(
+        track_metadata, api_key, None, max_workers, requests_per_second, cache, on_event, artist_fallback
+    )
+    return all_tag_weights, failed
+
+def fetch_track_tag_weights_until(track_metadata: List[Dict], api_key: str,
+                                  deadline: Optional[float],
+                                  max_workers: Optional[int] = None,
+                                  requests_per_second: Optional[float] = None,
+                                  cache: Optional[TagCache] = None,
+                                  on_event: Optional[EventCallback] = None,
+                                  artist_fallback: bool = False
+                                  ) -> Tuple[List[Dict[str, float]], List[int], List[int]]:
+    """fetch_track_tag_weights_with_status that stops waiting at deadline (a time.monotonic() value).
+
+    Also returns the indices of tracks whose lookup was still outstanding;
+    they get {} and a 'track_tags' event with status 'pending'. Outstanding
+    lookups keep running and land in the tag cache for the next request.
+    """
+    cache = cache or get_default_tag_cache()
+    emit = on_event or (lambda event, payload: None)
+    emit('fetch_started', {'total': len(track_metadata)})
+
+    def report(index, tags, status):
+        TRACK_TAG_LOOKUPS.inc(status=status)
+        emit('track_tags', {'index': index, 'tags': list(tags), 'status': status})
+
+    # Serve cache hits directly so they don't use up the rate limit
+    all_tag_weights: List[Dict[str, float]] = [{} for _ in track_metadata]
+    lookups: Dict[str, Tuple[str, str, List[int]]] = {}
+    for i, track in enumerate(track_metadata):
+        if 'artist' not in track or 'name' not in track:
+            # Tracks without artist/name keep the empty fallback
+            report(i, [], 'skipped')
+            continue
+        key = normalize_track_key(track['artist'], track['name'])
+        if key in lookups:
+            lookups[key][2].append(i)  # Duplicate within the playlist shares the lookup
+            continue
+        cached = cache.get_weights(track['artist'], track['name'])
+        if cached is not None:
+            all_tag_weights[i] = cached
+            report(i, cached, 'cached')
+        else:
+            lookups[key] = (track['artist'], track['name'], [i])
+    pending = list(lookups.values())
+
+    def on_result(position, weights):
+        for i in pending[position][2]:
+            report(i, weights or [], 'failed' if weights is None else 'fetched')
+
+    fetched = run_rate_limited(
+        lambda artist, name: fetch_cached_lastfm_tag_weights(artist, name, api_key, cache),
+        [(artist, name) for artist, name, _ in pending],
+        max_workers=max_workers,
+        requests_per_second=requests_per_second,
+        fallback=lambda: None,
+        on_result=on_result,
+        deadline=deadline
+    )
+    failed = []
+    outstanding = []
+    for (_, _, indices), weights in zip(pending, fetched):
+        for i in indices:
+            if weights is PENDING:
+                outstanding.append(i)
+                report(i, [], 'pending')
+            elif weights is None:
+                failed.append(i)
+            else:
+                all_tag_weights[i] = dict(weights)
+    failed.sort()
+    outstanding.sort()
+
+    if artist_fallback:
+        fill_from_artist_tags(track_metadata, all_tag_weights, set(failed) | set(outstanding), api_key,
+                              max_workers, requests_per_second, cache, emit, deadline)
+    return all_tag_weights, failed, outstanding
+
+def fetch_track_tags_with_status(track_metadata: List[Dict], api_key: str,
+                                 max_workers: Optional[int] = None,
+                                 requests_per_second: Optional[float] = None,
+                                 cache: Optional[TagCache] = None,
+                                 on_event: Optional[EventCallback] = None,
+                                 artist_fallback: bool = False) -> Tuple[List[List[str]], List[int]]:
+    """Like fetch_track_tag_weights_with_status, but returns plain tag lists"""
+    all_tag_weights, failed = fetch_track_tag_weights_with_status(
+        track_metadata, api_key, max_workers, requests_per_second, cache, on_event, artist_fallback
+    )
+    return [list(weights) for weights in all_tag_weights], failed
+
+def fill_from_artist_tags(track_metadata: List[Dict], all_tag_weights: List[Dict[str, float]], failed: set,
+                          api_key: str, max_workers: Optional[int], requests_per_second: Optional[float],
+                          cache: TagCache, emit: EventCallback, deadline: Optional[float] = None):
+    """Give untagged tracks their artist's top tags, fetching each artist once"""
+    artists: Dict[str, Tuple[str, List[int]]] = {}
+    for i, (track, weights) in enumerate(zip(track_metadata, all_tag_weights)):
+        if weights or i in failed or 'artist' not in track or 'name' not in track:
+            continue
+        key = normalize_track_key(track['artist'], ARTIST_TAGS_TRACK)
+        artists.setdefault(key, (track['artist'], []))[1].append(i)
+    if not artists:
+        return
+
+    pending = list(artists.values())
+    artist_weights = run_rate_limited(
+        lambda artist: fetch_cached_artist_tag_weights(artist, api_key, cache),
+        [(artist,) for artist, _ in pending],
+        max_workers=max_workers,
+        requests_per_second=requests_per_second,
+        fallback=dict,
+        deadline=deadline
+    )
+    for (_, indices), weights in zip(pending, artist_weights):
+        if weights is PENDING or not weights:
+            continue
+        for i in indices:
+            all_tag_weights[i] = dict(weights)
+            TRACK_TAG_LOOKUPS.inc(status='artist')
+            emit('artist_tags', {'index': i, 'tags': list(weights)})
+
+def fetch_all_track_tags(track_metadata: List[Dict], api_key: str,
+                         max_workers: Optional[int] = None,
+                         requests_per_second: Optional[float] = None,
+                         cache: Optional[TagCache] = None) -> List[List[str]]:
+    """Fetch Last.fm tags for every track concurrently, keeping input order"""
+    all_track_tags, _ = fetch_track_tags_with_status(
+        track_metadata, api_key, max_workers, requests_per_second, cache
+    )
+    return all_track_tags
+
+def build_feature_matrix(all_tags: List[TrackTags], tag_vocabulary: Dict[str, int]) -> sparse.csr_matrix:
+    """Convert every track's tags into one CSR matrix (tracks x vocabulary).
+
+    Entries are 1.0 for plain tag lists and the tag's weight for {tag: weight}.
+    """
+    rows = []
+    for tags in all_tags:
+        weights = normalize_tag_weights(tags)
+        row = {}
+        for tag, weight in weights.items():
+            idx = tag_vocabulary.get(tag.lower())
+            if idx is not None:
+                row[idx] = max(row.get(idx, 0.0), weight)
+        rows.append(sorted(row.items()))
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=indptr[1:])
+    entries = list(chain.from_iterable(rows))
+    indices = np.fromiter((idx for idx, _ in entries), dtype=np.int32, count=len(entries))
+    data = np.fromiter((weight for _, weight in entries), dtype=np.float64, count=len(entries))
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), len(tag_vocabulary)))
+
 def create_feature_vector(tags: List[str], tag_vocabulary: Dict[str, int]) -> np.ndarray:
     """Convert track tags into a numerical feature vector"""
-    vector = np.zeros(len(tag_vocabulary))
-    for tag in tags:
-        if tag.lower() in tag_vocabulary:
-            vector[tag_vocabulary[tag.lower()]] = 1
-    return vector
-
-def build_tag_vocabulary(all_tags: List[List[str]]) -> Dict[str, int]:
-    """Create a mapping of unique tags to indices"""
-    unique_tags = sorted(set(tag.lower() for tags in all_tags for tag in tags))
+    return build_feature_matrix([tags], tag_vocabulary).toarray()[0]
+
+def build_tag_vocabulary(all_tags: List[TrackTags], min_df: int = 1,
+                         max_features: Optional[int] = None,
+                         stop_tags: Iterable[str] = ()) -> Dict[str, int]:
+    """Create a mapping of unique tags to indices.
+
+    Tags in stop_tags or on fewer than min_df tracks are dropped; max_features
+    keeps only the tags on the most tracks. Indices follow tag order.
+    """
+    stop_tags = {tag.lower() for tag in stop_tags}
+    document_frequency = Counter(tag for tags in all_tags for tag in {t.lower() for t in tags})
+    kept = [
+        (tag, df) for tag, df in document_frequency.items()
+        if df >= min_df and tag not in stop_tags
+    ]
+    if max_features is not None and len(kept) > max_features:
+        kept = sorted(kept, key=lambda item: (-item[1], item[0]))[:max_features]
+    unique_tags = sorted(tag for tag, _ in kept)
     return {tag: idx for idx, tag in enumerate(unique_tags)}
 
+def weight_tag_matrix(tag_matrix: sparse.csr_matrix, weighting: str = DEFAULT_TAG_WEIGHTING) -> sparse.csr_matrix:
+    """Apply a TAG_WEIGHTINGS scheme to a weighted tag matrix"""
+    if weighting not in TAG_WEIGHTINGS:
+        raise ValueError(f"Unknown tag weighting: {weighting}")
+    if weighting == 'binary':
+        binary = tag_matrix.copy()
+        binary.data[:] = 1.0
+        return binary
+    if weighting == 'tfidf':
+        # Rows come out L2-normalized, so long tag lists don't dominate the distances
+        return TfidfTransformer(norm='l2', smooth_idf=True).fit_transform(tag_matrix).tocsr()
+    return tag_matrix
+
+def reduce_tag_matrix(tag_matrix: sparse.csr_matrix, n_components: Optional[int] = DEFAULT_SVD_COMPONENTS,
+                      seed: int = 42) -> Tuple[Any, Optional[float]]:
+    """Project tag vectors onto n_components with TruncatedSVD when the vocabulary is larger.
+
+    Returns the (possibly unchanged) matrix and the explained variance ratio,
+    or None when no projection was needed.
+    """
+    n_tracks, n_tags = tag_matrix.shape
+    if not n_components or n_tags <= n_components or n_tracks <= n_components:
+        return tag_matrix, None
+    svd = TruncatedSVD(n_components=n_components, random_state=seed)
+    reduced = Normalizer(copy=False).fit_transform(svd.fit_transform(tag_matrix))
+    return reduced, float(svd.explained_variance_ratio_.sum())
+
 def get_base_genre(tags: List[str]) -> str:
     """Extract the base genre from a list of tags"""
-    # Define genre mappings
-    genre_mappings = {
-        'rock': ['rock', 'classic rock', 'hard rock', 'alternative rock', 
-                'indie rock', 'progressive rock', 'punk rock', 'folk rock'],
-        'pop': ['pop', 'synth pop', 'indie pop', 'power pop', 'electropop'],
-        'hip hop': ['hip hop', 'rap', 'trap', 'grime'],
-        'jazz': ['jazz', 'smooth jazz', 'fusion', 'bebop', 'big band'],
-        'electronic': ['electronic', 'edm', 'techno', 'house', 'trance'],
-        'folk': ['folk', 'americana', 'traditional', 'singer-songwriter'],
-        'metal': ['metal', 'heavy metal', 'black metal', 'death metal'],
-        'r&b': ['r&b', 'soul', 'funk', 'motown'],
-        'blues': ['blues', 'delta blues', 'chicago blues'],
-        'classical': ['classical', 'orchestra', 'symphony', 'chamber music']
-    }
-    
-    if not tags:
-        return 'unclassified'
-
-    # Count occurrences of base genres
-    genre_counts = {}
-    for tag in tags:
-        tag = tag.lower()
-        for base_genre, subgenres in genre_mappings.items():
-            if tag in subgenres or tag == base_genre:
-                genre_counts[base_genre] = genre_counts.get(base_genre, 0) + 1
-    
-    if genre_counts:
-        return max(genre_counts.items(), key=lambda x: x[1])[0]
-    return 'unclassified'
-
-def match_tracks_to_clusters(features, track_metadata, algorithm="kmeans"):
-    """Match tracks to clusters using Last.fm tags with genre merging"""
+    return GENRE_TAXONOMY.genre_for_tags(tags)
+
+def match_tracks_to_clusters(features, track_metadata, algorithm="kmeans",
+                             max_workers: Optional[int] = None,
+                             requests_per_second: Optional[float] = None,
+                             tag_cache: Optional[TagCache] = None,
+                             n_clusters: Optional[int] = None,
+                             k_min: int = DEFAULT_K_MIN, k_max: int = DEFAULT_K_MAX,
+                             k_criterion: str = 'silhouette',
+                             metrics_mode: str = 'auto',
+                             metrics_sample_size: int = DEFAULT_METRICS_SAMPLE_SIZE,
+                             metrics_seed: int = 42,
+                             feature_mode: str = 'tags',
+                             audio_weight: float = 1.0,
+                             on_event: Optional[EventCallback] = None,
+                             include_timings: bool = False,
+                             artist_fallback: bool = False,
+                             tag_weighting: str = DEFAULT_TAG_WEIGHTING,
+                             min_df: int = 1,
+                             max_features: Optional[int] = None,
+                             stop_tags: Optional[Iterable[str]] = None,
+                             svd_components: Optional[int] = DEFAULT_SVD_COMPONENTS,
+                             tag_space: str = DEFAULT_TAG_SPACE,
+                             deadline_ms: Optional[float] = None,
+                             pending_placement: str = 'bucket',
+                             api_key: Optional[str] = None):
+    """Match tracks to clusters using Last.fm tags with genre merging
+
+    max_workers and requests_per_second bound the concurrent Last.fm fetch
+    stage; they default to LASTFM_MAX_WORKERS / LASTFM_REQUESTS_PER_SECOND.
+    Tags are read through tag_cache (the shared on-disk cache by default);
+    artist_fallback gives untagged tracks their artist's top tags.
+    tag_space, tag_weighting, min_df, max_features, stop_tags and
+    svd_components shape the tag vectors; see cluster_tagged_tracks.
+    An explicit n_clusters is used as-is; otherwise k is chosen by a
+    parallel sweep over [k_min, k_max] scored with k_criterion.
+    metrics_mode ('auto', 'none', 'sampled', 'full') controls the quality
+    metrics; see compute_cluster_metrics.
+    feature_mode 'audio' clusters on the supplied audio features without
+    calling Last.fm; 'hybrid' adds tag vectors for tracks whose tags are
+    already available locally. on_event receives pipeline progress events
+    (see fetch_track_tags_with_status and cluster_feature_matrix).
+    Stage latencies always feed the instrumentation histograms;
+    include_timings also returns this run's seconds per stage as 'timings'.
+    deadline_ms bounds the wait for Last.fm: once DEADLINE_FETCH_FRACTION of
+    it has passed, tracks whose lookups are still outstanding are left out
+    of the fit and placed per pending_placement (see cluster_with_pending),
+    and the result gains a 'deadline' block. Outstanding lookups still
+    finish in the background and fill the tag cache.
+    api_key defaults to get_lastfm_api_key().
+    """
+    started = time.monotonic()
     # Handle empty inputs
     if not track_metadata:
         return {
@@ -88,54 +419,140 @@ def match_tracks_to_clusters(features, track_metadata, algorithm="kmeans"):
             'calinski_harabasz': None
         }
 
+    INPUT_TRACKS.observe(len(track_metadata))
+    timer = StageTimer()
+    clustering_options = dict(
+        n_clusters=n_clusters, k_min=k_min, k_max=k_max, k_criterion=k_criterion,
+        metrics_mode=metrics_mode, metrics_sample_size=metrics_sample_size,
+        metrics_seed=metrics_seed, timer=timer
+    )
+    if feature_mode not in FEATURE_MODES:
+        raise ValueError(f"Unknown feature mode: {feature_mode}")
+    if feature_mode != 'tags':
+        result = match_tracks_by_audio(
+            features, track_metadata,
+            hybrid=feature_mode == 'hybrid',
+            audio_weight=audio_weight,
+            tag_cache=tag_cache,
+            on_event=on_event,
+            **clustering_options
+        )
+        if include_timings:
+            result['timings'] = timer.to_dict()
+        return result
+
     # Get Last.fm API key
-    import os
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    api_key = os.getenv('LASTFM_API_KEY')
-    if not api_key:
-        raise ValueError("LASTFM_API_KEY not found in environment variables")
+    api_key = api_key or get_lastfm_api_key()
 
-    # Handle small datasets
-    if len(track_metadata) < 2:
-        # Get tags and genre for single track
-        if track_metadata and 'artist' in track_metadata[0] and 'name' in track_metadata[0]:
-            tags = get_lastfm_tags(
-                track_metadata[0]['artist'],
-                track_metadata[0]['name'],
-                api_key
-            )
-            genre = get_base_genre(tags)
-        else:
-            genre = 'unclassified'
-            
-        return {
+    if pending_placement not in PENDING_PLACEMENTS:
+        raise ValueError(f"Unknown pending placement: {pending_placement}")
+    deadline = started + deadline_ms / 1000 * DEADLINE_FETCH_FRACTION if deadline_ms else None
+
+    # Get tags for all tracks
+    with timer.stage('fetch'):
+        all_tag_weights, failed_lookups, outstanding = fetch_track_tag_weights_until(
+            track_metadata, api_key, deadline,
+            max_workers=max_workers,
+            requests_per_second=requests_per_second,
+            cache=tag_cache,
+            on_event=on_event,
+            artist_fallback=artist_fallback
+        )
+
+    tag_options = dict(
+        tag_weighting=tag_weighting, min_df=min_df, max_features=max_features,
+        stop_tags=stop_tags, svd_components=svd_components, tag_space=tag_space
+    )
+    if outstanding:
+        result = cluster_with_pending(
+            features, track_metadata, all_tag_weights, outstanding,
+            placement=pending_placement, on_event=on_event, **tag_options, **clustering_options
+        )
+    elif len(track_metadata) < 2:
+        # Handle small datasets: a single track is its own cluster
+        result = {
             'clusters': [
                 {
                     'id': 0,
-                    'genre': genre,
+                    'genre': get_base_genre(list(all_tag_weights[0])),
                     'tags': [],
-                    'tracks': track_metadata
+                    'tracks': track_metadata,
+                    'track_indices': list(range(len(track_metadata)))
                 }
             ],
             'silhouette_score': None,
             'davies_bouldin': None,
             'calinski_harabasz': None
         }
+    else:
+        result = cluster_tagged_tracks(
+            track_metadata, all_tag_weights, on_event=on_event, **tag_options, **clustering_options
+        )
+    result['tag_fetch_failures'] = len(failed_lookups)  # Lookups that failed, not tracks without tags
+    if deadline_ms:
+        result['deadline'] = {
+            'deadline_ms': deadline_ms,
+            'lookups_outstanding': len({
+                normalize_track_key(track_metadata[i]['artist'], track_metadata[i]['name'])
+                for i in outstanding
+            }),
+            'pending_tracks': len(outstanding),
+            'pending_placement': result.pop('pending_placement', pending_placement)
+        }
 
-    # Get tags for all tracks
-    all_track_tags = []
-    for track in track_metadata:
-        if 'artist' not in track or 'name' not in track:
-            tags = []
-        else:
-            tags = get_lastfm_tags(track['artist'], track['name'], api_key)
-        all_track_tags.append(tags)
-        track['tags'] = tags  # Store tags with track data
+    if include_timings:
+        result['timings'] = timer.to_dict()
+    return result
+
+def cluster_tagged_tracks(track_metadata: List[Dict], all_track_tags: List[TrackTags],
+                          on_event: Optional[EventCallback] = None,
+                          timer: Optional[StageTimer] = None,
+                          tag_weighting: str = DEFAULT_TAG_WEIGHTING,
+                          min_df: int = 1,
+                          max_features: Optional[int] = None,
+                          stop_tags: Optional[Iterable[str]] = None,
+                          svd_components: Optional[int] = DEFAULT_SVD_COMPONENTS,
+                          tag_space: str = DEFAULT_TAG_SPACE,
+                          tag_embedding: Optional[TagEmbedding] = None,
+                          **clustering_options) -> Dict[str, Any]:
+    """Run the vocabulary, vectorize, fit, metrics and merge stages on already-fetched tags.
+
+    all_track_tags may hold {tag: weight} per track to keep Last.fm's weights.
+    The vocabulary is pruned with min_df, max_features and stop_tags
+    (DEFAULT_STOP_TAGS when None), weighted with tag_weighting and projected
+    to svd_components dimensions when larger (None or 0 disables it).
+    With tag_space 'embedding' (or 'auto' and enough coverage) tracks are
+    instead the average of their tags' vectors in tag_embedding (the
+    loaded TAG_EMBEDDING by default), and only stop_tags of the vocabulary
+    options applies.
+    """
+    timer = timer or StageTimer()
+    if tag_space not in TAG_SPACES:
+        raise ValueError(f"Unknown tag space: {tag_space}")
+    for track, tags in zip(track_metadata, all_track_tags):
+        track['tags'] = list(tags)  # Store tag names with track data
+
+    tag_embedding = tag_embedding or TAG_EMBEDDING
+    if tag_space == 'embedding' and tag_embedding is None:
+        raise ValueError("No tag embedding is loaded; build one with python -m matching_algo.build_tag_embedding")
+    if tag_space != 'vocabulary' and tag_embedding is not None:
+        with timer.stage('vectorize'):
+            feature_vectors = tag_embedding.embed_tracks(all_track_tags, stop_tags)
+        covered = int(np.count_nonzero(np.any(feature_vectors, axis=1)))
+        coverage = covered / len(track_metadata)
+        if tag_space == 'embedding' or coverage >= MIN_EMBEDDING_COVERAGE:
+            return cluster_embedded_tracks(feature_vectors, track_metadata, tag_embedding, coverage,
+                                           on_event=on_event, timer=timer, **clustering_options)
 
     # Build tag vocabulary and convert to feature vectors
-    tag_vocabulary = build_tag_vocabulary(all_track_tags)
+    with timer.stage('vocabulary'):
+        tag_vocabulary = build_tag_vocabulary(
+            all_track_tags, min_df=min_df, max_features=max_features,
+            stop_tags=DEFAULT_STOP_TAGS if stop_tags is None else stop_tags
+        )
+    VOCABULARY_SIZE.observe(len(tag_vocabulary))
+    if on_event:
+        on_event('vocabulary', {'size': len(tag_vocabulary)})
     if not tag_vocabulary:
         return {
             'clusters': [
@@ -143,7 +560,8 @@ def match_tracks_to_clusters(features, track_metadata, algorithm="kmeans"):
                     'id': 0,
                     'genre': 'unclassified',
                     'tags': [],
-                    'tracks': track_metadata
+                    'tracks': track_metadata,
+                    'track_indices': list(range(len(track_metadata)))
                 }
             ],
             'silhouette_score': None,
@@ -151,118 +569,403 @@ def match_tracks_to_clusters(features, track_metadata, algorithm="kmeans"):
             'calinski_harabasz': None
         }
 
-    # Create feature vectors from tags
-    feature_vectors = np.array([
-        create_feature_vector(tags, tag_vocabulary)
-        for tags in all_track_tags
-    ])
+    # Create weighted sparse feature matrix from tags, then project it down
+    with timer.stage('vectorize'):
+        feature_vectors = weight_tag_matrix(build_feature_matrix(all_track_tags, tag_vocabulary), tag_weighting)
+    with timer.stage('reduce'):
+        feature_vectors, explained_variance = reduce_tag_matrix(feature_vectors, svd_components)
 
-    # Determine optimal number of clusters
-    n_clusters = min(max(2, len(track_metadata) // 3), 8)  # Between 2 and 8 clusters
-    
-    # Perform clustering
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(feature_vectors)
+    return {
+        **cluster_feature_matrix(feature_vectors, track_metadata, on_event=on_event, timer=timer,
+                                 **clustering_options),
+        'feature_mode': 'tags',
+        'vectorizer': {
+            'space': 'vocabulary',
+            'weighting': tag_weighting,
+            'vocabulary_size': len(tag_vocabulary),
+            'dimensions': feature_vectors.shape[1],
+            'explained_variance': explained_variance
+        }
+    }
 
-    # Calculate metrics if possible
-    metrics = {}
-    if len(feature_vectors) > 2 and n_clusters > 1:
-        metrics['silhouette_score'] = silhouette_score(feature_vectors, labels)
-        metrics['davies_bouldin'] = davies_bouldin_score(feature_vectors, labels)
-        metrics['calinski_harabasz'] = calinski_harabasz_score(feature_vectors, labels)
+def cluster_with_pending(features, track_metadata: List[Dict], all_track_tags: List[TrackTags],
+                         pending: List[int], placement: str = 'bucket',
+                         on_event: Optional[EventCallback] = None,
+                         **options) -> Dict[str, Any]:
+    """Cluster the tracks whose tags arrived and place the pending ones afterwards.
+
+    With placement 'bucket' pending tracks form their own cluster with genre
+    'pending'; with 'audio' each joins the cluster whose mean audio
+    features are nearest, falling back to the bucket when the features do
+    not line up with the tracks. Placed tracks are flagged 'tags_pending'.
+    Input positions are kept in track_indices, and the 'labels' and
+    'clusters' events are sent once placement is done, labelling tracks
+    left in the pending bucket -1.
+    """
+    emit = on_event or (lambda event, payload: None)
+    deferred = {}
+
+    def forward(event, payload):
+        if event in ('labels', 'clusters', 'metrics'):
+            deferred[event] = payload
+        else:
+            emit(event, payload)
+
+    pending_set = set(pending)
+    ready = [i for i in range(len(track_metadata)) if i not in pending_set]
+    for i in pending:
+        track_metadata[i]['tags'] = []
+
+    if len(ready) >= 2:
+        result = cluster_tagged_tracks([track_metadata[i] for i in ready], [all_track_tags[i] for i in ready],
+                                       on_event=forward, **options)
+        for cluster in result['clusters']:
+            cluster['track_indices'] = [ready[j] for j in cluster['track_indices']]
     else:
-        metrics = {
+        result = {'clusters': [], 'silhouette_score': None, 'davies_bouldin': None, 'calinski_harabasz': None}
+        for i in ready:
+            track_metadata[i]['tags'] = list(all_track_tags[i])
+            result['clusters'].append({
+                'id': 0,
+                'genre': get_base_genre(track_metadata[i]['tags']),
+                'tags': sorted(track_metadata[i]['tags']),
+                'tracks': [track_metadata[i].copy()],
+                'track_indices': [i]
+            })
+
+    clusters = result['clusters']
+    if placement == 'audio' and clusters:
+        try:
+            audio = build_audio_matrix(features, len(track_metadata))
+        except ValueError:
+            placement = 'bucket'
+    else:
+        placement = 'bucket'
+
+    if placement == 'audio':
+        centroids = np.array([audio[cluster['track_indices']].mean(axis=0) for cluster in clusters])
+        distances = ((audio[pending][:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+        for i, nearest in zip(pending, distances.argmin(axis=1)):
+            clusters[nearest]['tracks'].append({**track_metadata[i], 'tags_pending': True})
+            clusters[nearest]['track_indices'].append(i)
+    else:
+        clusters.append({
+            'id': max((cluster['id'] for cluster in clusters), default=-1) + 1,
+            'genre': 'pending',
+            'tags': [],
+            'tracks': [{**track_metadata[i], 'tags_pending': True} for i in pending],
+            'track_indices': list(pending),
+            'pending': True
+        })
+
+    labels = [-1] * len(track_metadata)
+    for cluster in clusters:
+        if not cluster.get('pending'):
+            for i in cluster['track_indices']:
+                labels[i] = int(cluster['id'])
+    emit('labels', {'labels': labels, 'k_selection': result.get('k_selection')})
+    emit('clusters', {'clusters': clusters})
+    if 'metrics' in deferred:
+        emit('metrics', deferred['metrics'])
+    result['pending_placement'] = placement
+    return result
+
+def cluster_embedded_tracks(feature_vectors: np.ndarray, track_metadata: List[Dict],
+                            tag_embedding: TagEmbedding, coverage: float,
+                            on_event: Optional[EventCallback] = None,
+                            timer: Optional[StageTimer] = None,
+                            **clustering_options) -> Dict[str, Any]:
+    """Cluster tracks already mapped into the tag embedding"""
+    if on_event:
+        on_event('vocabulary', {'size': len(tag_embedding.tags)})
+    if coverage == 0:
+        return {
+            'clusters': [
+                {
+                    'id': 0,
+                    'genre': 'unclassified',
+                    'tags': [],
+                    'tracks': track_metadata,
+                    'track_indices': list(range(len(track_metadata)))
+                }
+            ],
             'silhouette_score': None,
             'davies_bouldin': None,
             'calinski_harabasz': None
         }
 
-    # Group tracks by cluster
-    clustered_tracks = {i: [] for i in range(n_clusters)}
-    for i, label in enumerate(labels):
-        track = track_metadata[i].copy()
-        clustered_tracks[label].append(track)
-
-    # Create initial clusters with genres
-    initial_clusters = []
-    for cluster_id, tracks in clustered_tracks.items():
-        # Get all tags in cluster
-        cluster_tags = []
-        for track in tracks:
-            if 'tags' in track:
-                cluster_tags.extend(track['tags'])
-        
-        initial_clusters.append({
-            'id': cluster_id,
-            'genre': get_base_genre(cluster_tags) if cluster_tags else 'unclassified',
-            'tags': cluster_tags,
-            'tracks': tracks
-        })
+    return {
+        **cluster_feature_matrix(feature_vectors, track_metadata, on_event=on_event, timer=timer,
+                                 **clustering_options),
+        'feature_mode': 'tags',
+        'vectorizer': {
+            'space': 'embedding',
+            'version': tag_embedding.version,
+            'dimensions': tag_embedding.dimensions,
+            'coverage': coverage
+        }
+    }
+
+def build_audio_matrix(features, n_tracks: int) -> np.ndarray:
+    """Standardize per-track audio features (danceability, energy, valence, tempo, ...)"""
+    audio = np.asarray(features, dtype=float)
+    if audio.ndim != 2 or audio.shape[0] != n_tracks:
+        raise ValueError("Audio features must have one row per track")
+    return StandardScaler().fit_transform(audio)
+
+def get_local_track_tags(track_metadata: List[Dict], cache: Optional[TagCache] = None) -> List[List[str]]:
+    """Return tags available without calling Last.fm: cached tags, else tags sent with the track"""
+    cache = cache or get_default_tag_cache()
+    all_track_tags = []
+    for track in track_metadata:
+        tags = None
+        if 'artist' in track and 'name' in track:
+            tags = cache.get(track['artist'], track['name'])
+        if tags is None:
+            tags = track.get('tags') or []
+        all_track_tags.append(tags)
+    return all_track_tags
+
+def match_tracks_by_audio(features, track_metadata: List[Dict], hybrid: bool = False,
+                          audio_weight: float = 1.0, tag_cache: Optional[TagCache] = None,
+                          on_event: Optional[EventCallback] = None,
+                          timer: Optional[StageTimer] = None,
+                          all_track_tags: Optional[List[List[str]]] = None,
+                          **clustering_options) -> Dict[str, Any]:
+    """Cluster tracks on their audio features, never blocking on Last.fm.
+
+    In hybrid mode the scaled audio features (multiplied by audio_weight) are
+    joined with binary tag vectors for tracks whose tags are known locally.
+    all_track_tags overrides the local lookup (see get_local_track_tags).
+    """
+    if all_track_tags is None:
+        all_track_tags = get_local_track_tags(track_metadata, tag_cache)
+    for track, tags in zip(track_metadata, all_track_tags):
+        track['tags'] = tags  # Store tags with track data
+
+    if len(track_metadata) < 2:
+        return {
+            'clusters': [
+                {
+                    'id': 0,
+                    'genre': get_base_genre(all_track_tags[0]),
+                    'tags': [],
+                    'tracks': track_metadata,
+                    'track_indices': list(range(len(track_metadata)))
+                }
+            ],
+            'silhouette_score': None,
+            'davies_bouldin': None,
+            'calinski_harabasz': None,
+            'feature_mode': 'hybrid' if hybrid else 'audio'
+        }
+
+    timer = timer or StageTimer()
+    with timer.stage('vectorize'):
+        feature_vectors = build_audio_matrix(features, len(track_metadata))
+        if hybrid:
+            tag_vocabulary = build_tag_vocabulary(all_track_tags)
+            feature_vectors = sparse.hstack([
+                sparse.csr_matrix(feature_vectors * audio_weight),
+                build_feature_matrix(all_track_tags, tag_vocabulary)
+            ]).tocsr()
+
+    return {
+        **cluster_feature_matrix(feature_vectors, track_metadata, on_event=on_event, timer=timer,
+                                 **clustering_options),
+        'feature_mode': 'hybrid' if hybrid else 'audio',
+        'locally_tagged_tracks': sum(1 for tags in all_track_tags if tags)
+    }
+
+def cluster_feature_matrix(feature_vectors, track_metadata: List[Dict],
+                           n_clusters: Optional[int] = None,
+                           k_min: int = DEFAULT_K_MIN, k_max: int = DEFAULT_K_MAX,
+                           k_criterion: str = 'silhouette',
+                           metrics_mode: str = 'auto',
+                           metrics_sample_size: int = DEFAULT_METRICS_SAMPLE_SIZE,
+                           metrics_seed: int = 42,
+                           n_jobs: Optional[int] = None,
+                           on_event: Optional[EventCallback] = None,
+                           timer: Optional[StageTimer] = None) -> Dict[str, Any]:
+    """Fit, label, merge and score clusters for an already-built feature matrix.
+
+    Each track dict should already carry its 'tags', which drive the genre
+    labels and merging. n_jobs caps the parallel k sweep (all cores by default).
+    on_event receives 'features', 'labels', then 'clusters' once merged, then
+    'metrics'; the metrics run last because they are the slowest stage.
+    """
+    emit = on_event or (lambda event, payload: None)
+    timer = timer or StageTimer()
+    emit('features', {'n_tracks': feature_vectors.shape[0], 'n_features': feature_vectors.shape[1]})
+
+    # Perform clustering, sweeping k unless the caller fixed it
+    with timer.stage('fit'):
+        if n_clusters:
+            n_clusters = min(int(n_clusters), len(track_metadata))
+            kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+            labels = kmeans.fit_predict(feature_vectors)
+            k_selection = {'chosen_k': n_clusters, 'source': 'request'}
+        else:
+            sweep = select_n_clusters(feature_vectors, k_min=k_min, k_max=k_max, criterion=k_criterion,
+                                      n_jobs=n_jobs)
+            n_clusters, labels = sweep['chosen_k'], sweep['labels']
+            k_selection = {
+                'chosen_k': n_clusters,
+                'source': 'sweep',
+                'criterion': sweep['criterion'],
+                'scores': {str(k): (score if np.isfinite(score) else None) for k, score in sweep['scores'].items()},
+                'stopped_early': sweep['stopped_early']
+            }
+
+    emit('labels', {'labels': [int(label) for label in labels], 'k_selection': k_selection})
+
+    with timer.stage('genres'):
+        # Group tracks by cluster, remembering their input positions
+        clustered_tracks = {i: [] for i in range(n_clusters)}
+        clustered_indices = {i: [] for i in range(n_clusters)}
+        for i, label in enumerate(labels):
+            track = track_metadata[i].copy()
+            clustered_tracks[label].append(track)
+            clustered_indices[label].append(i)
+
+        # Assign every cluster's genre in one sparse product over the tag matrix
+        all_track_tags = [track.get('tags', []) for track in track_metadata]
+        tag_vocabulary = build_tag_vocabulary(all_track_tags)
+        cluster_genres = GENRE_TAXONOMY.assign_cluster_genres(
+            build_feature_matrix(all_track_tags, tag_vocabulary), labels, n_clusters, tag_vocabulary
+        )
+
+        # Create initial clusters with genres
+        initial_clusters = []
+        for cluster_id, tracks in clustered_tracks.items():
+            initial_clusters.append({
+                'id': cluster_id,
+                'genre': cluster_genres[cluster_id],
+                'tags': sorted(get_cluster_tags({'tracks': tracks})),
+                'tracks': tracks,
+                'track_indices': clustered_indices[cluster_id]
+            })
 
     # Merge similar clusters
-    final_clusters = merge_similar_clusters(initial_clusters)
+    with timer.stage('merge'):
+        final_clusters = merge_similar_clusters(initial_clusters)
+    emit('clusters', {'clusters': final_clusters})
 
-    # Prepare final result
-    result = {
+    # Calculate metrics if possible
+    with timer.stage('metrics'):
+        metrics = compute_cluster_metrics(
+            feature_vectors, labels, n_clusters,
+            mode=metrics_mode, sample_size=metrics_sample_size, seed=metrics_seed
+        )
+    emit('metrics', metrics)
+
+    return {
         'clusters': final_clusters,
-        **metrics
+        **metrics,
+        'k_selection': k_selection
     }
 
-    return result
+class UnionFind:
+    """Disjoint-set forest with path halving and union by size"""
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return
+        if self.size[root_i] < self.size[root_j]:
+            root_i, root_j = root_j, root_i
+        self.parent[root_j] = root_i
+        self.size[root_i] += self.size[root_j]
+
+def get_cluster_tags(cluster: Dict) -> set:
+    """Get all unique tags from a cluster's tracks"""
+    tags = set()
+    for track in cluster['tracks']:
+        track_tags = track.get('tags', [])
+        if isinstance(track_tags, (list, tuple)):
+            tags.update(track_tags)
+        elif isinstance(track_tags, str):
+            tags.add(track_tags)
+    return tags
 
 def merge_similar_clusters(clusters: List[Dict], similarity_threshold: float = 0.3) -> List[Dict]:
-    """Merge clusters that have similar genre distributions"""
+    """Merge clusters of the same genre whose tag sets are similar.
+
+    Every pairwise Jaccard similarity is computed in one sparse
+    intersection product, and merges are transitive (union-find), so the
+    result does not depend on the order of the input clusters. Clusters that
+    carry 'track_indices' keep them, concatenated like their tracks.
+    """
     if not clusters:
         return clusters
 
-    def get_cluster_tags(cluster):
-        """Helper function to get all unique tags from a cluster"""
-        tags = set()
-        for track in cluster['tracks']:
-            track_tags = track.get('tags', [])
-            if isinstance(track_tags, (list, tuple)):
-                tags.update(set(track_tags))
-            elif isinstance(track_tags, str):
-                tags.add(track_tags)
-        return tags
+    # Compute each cluster's tag set once and encode them as a binary matrix
+    tag_sets = [get_cluster_tags(cluster) for cluster in clusters]
+    tag_ids = {tag: idx for idx, tag in enumerate(sorted(set().union(*tag_sets)))}
+    rows = [sorted(tag_ids[tag] for tag in tags) for tags in tag_sets]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=indptr[1:])
+    membership = sparse.csr_matrix(
+        (np.ones(indptr[-1]), np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=indptr[-1]), indptr),
+        shape=(len(clusters), len(tag_ids))
+    )
+    sizes = np.diff(indptr)
 
-    # Group clusters by genre
-    genre_groups = defaultdict(list)
-    for cluster in clusters:
-        genre_groups[cluster['genre']].append(cluster)
-    
-    # Merge clusters within each genre group
+    genre_ids = {}
+    cluster_genres = np.array([genre_ids.setdefault(cluster['genre'], len(genre_ids)) for cluster in clusters])
+
+    union_find = UnionFind(len(clusters))
+    if similarity_threshold <= 0:
+        # Even disjoint tag sets qualify, as long as one of the pair has tags
+        first_tagged = {}
+        for i, genre in enumerate(cluster_genres):
+            if sizes[i]:
+                first_tagged.setdefault(genre, i)
+        for i, genre in enumerate(cluster_genres):
+            if genre in first_tagged:
+                union_find.union(first_tagged[genre], i)
+    else:
+        # Pairwise intersections; pairs with no shared tags never appear
+        intersections = sparse.triu(membership @ membership.T, k=1).tocoo()
+        same_genre = cluster_genres[intersections.row] == cluster_genres[intersections.col]
+        unions = sizes[intersections.row] + sizes[intersections.col] - intersections.data
+        similar = same_genre & (intersections.data / unions >= similarity_threshold)
+        for i, j in zip(intersections.row[similar], intersections.col[similar]):
+            union_find.union(int(i), int(j))
+
+    # Collect merged groups, ordered by genre first appearance then by first member
+    groups = defaultdict(list)
+    for i in range(len(clusters)):
+        groups[union_find.find(i)].append(i)
+    ordered_groups = sorted(groups.values(), key=lambda members: (cluster_genres[members[0]], members[0]))
+
+    has_indices = all('track_indices' in cluster for cluster in clusters)
     merged_clusters = []
-    for genre, group in genre_groups.items():
-        while group:
-            base_cluster = group.pop(0)
-            base_tags = get_cluster_tags(base_cluster)
-            
-            merged_tracks = base_cluster['tracks'].copy()
-            merged_tags = base_tags.copy()
-            
-            # Find similar clusters to merge
-            i = 0
-            while i < len(group):
-                other_cluster = group[i]
-                other_tags = get_cluster_tags(other_cluster)
-                
-                # Calculate Jaccard similarity
-                if base_tags or other_tags:
-                    similarity = len(base_tags & other_tags) / len(base_tags | other_tags) if (base_tags | other_tags) else 0
-                    if similarity >= similarity_threshold:
-                        merged_tracks.extend(other_cluster['tracks'])
-                        merged_tags.update(other_tags)
-                        group.pop(i)
-                    else:
-                        i += 1
-            
-            # Create merged cluster
-            merged_clusters.append({
-                'id': len(merged_clusters),
-                'genre': genre,
-                'tags': list(merged_tags),
-                'tracks': merged_tracks
-            })
-    
-    return merged_clusters
\ No newline at end of file
+    for members in ordered_groups:
+        merged_tracks = []
+        merged_tags = set()
+        for i in members:
+            merged_tracks.extend(clusters[i]['tracks'])
+            merged_tags.update(tag_sets[i])
+        merged_clusters.append({
+            'id': len(merged_clusters),
+            'genre': clusters[members[0]]['genre'],
+            'tags': sorted(merged_tags),
+            'tracks': merged_tracks
+        })
+        if has_indices:
+            merged_clusters[-1]['track_indices'] = [
+                index for i in members for index in clusters[i]['track_indices']
+            ]
+
+    return merged_clusters
@@ -1,36 +1,104 @@
-import matplotlib
-# Try to use a backend that works in your environment
-try:
-    matplotlib.use('TkAgg')  # Try TkAgg first
-except:
-    try:
-        matplotlib.use('Qt5Agg')  # Try Qt5Agg if TkAgg fails
-    except:
-        try:
-            matplotlib.use('Agg')  # Use Agg as a last resort (non-interactive)
-            print("Warning: Using non-interactive backend. Visualizations will be saved to files only.")
-        except:
-            print("Warning: Could not set matplotlib backend. Visualizations may not display properly.")
+import hashlib
+import io
+import json
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+import os
 
-import matplotlib.pyplot as plt 
-import seaborn as sns
+import matplotlib
+matplotlib.use('Agg')  # Headless: figures are rendered to PNG/SVG bytes, never shown
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from sklearn.manifold import TSNE
 from sklearn.decomposition import PCA
 import numpy as np
-from typing import List, Dict, Any
-import os
-import time
-from dotenv import load_dotenv
-from .matching import match_tracks_to_clusters, create_feature_vector, build_tag_vocabulary, get_lastfm_tags
+from .matching import match_tracks_to_clusters, build_feature_matrix, build_tag_vocabulary, get_cached_lastfm_tags, get_lastfm_api_key
+from .tag_cache import get_default_tag_cache
+
+IMAGE_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+PLOTS = ('clusters', 'tags')
+PROJECTION_METHODS = ('pca', 'tsne')
+# t-SNE is quadratic in the track count; larger inputs fall back to PCA
+TSNE_MAX_TRACKS = int(os.getenv('VISUALIZE_TSNE_MAX_TRACKS', 300))
+DEFAULT_RENDER_CACHE_SIZE = int(os.getenv('VISUALIZE_CACHE_SIZE', 128))
+
+
+def render_cache_key(tracks: Iterable[Dict[str, Any]], **params) -> str:
+    """Content hash of the tracks (by artist and name) and the render parameters"""
+    payload = {
+        'tracks': [[track.get('artist'), track.get('name')] for track in tracks],
+        'params': params
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """In-memory LRU of rendered images keyed by render_cache_key"""
+
+    def __init__(self, max_entries: int = DEFAULT_RENDER_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._images: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def set(self, key: str, image: bytes):
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+
+def figure_bytes(fig: Figure, image_format: str = 'png') -> bytes:
+    """Render a figure with the Agg canvas into PNG or SVG bytes"""
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}")
+    FigureCanvasAgg(fig)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def project_2d(features: np.ndarray, method: str = 'pca') -> Tuple[np.ndarray, str]:
+    """Project feature vectors to 2D, using t-SNE only for small inputs"""
+    if method not in PROJECTION_METHODS:
+        raise ValueError(f"Unknown projection method: {method}")
+    n_tracks = features.shape[0]
+    if n_tracks < 2:
+        return np.zeros((n_tracks, 2)), 'Track Clusters'
+    if features.shape[1] < 2:
+        features = np.hstack([features, np.zeros((n_tracks, 2 - features.shape[1]))])
+    if method == 'tsne' and 5 <= n_tracks <= TSNE_MAX_TRACKS:
+        reducer = TSNE(n_components=2, random_state=42,
+                       perplexity=min(n_tracks - 1, 30) / 3.0)
+        return reducer.fit_transform(features), 'Track Clusters (t-SNE)'
+    return PCA(n_components=2).fit_transform(features), 'Track Clusters (PCA)'
+
 
 class MatchingVisualizer:
-    def __init__(self):
+    def __init__(self, requests_per_second: Optional[float] = None, max_workers: Optional[int] = None):
         print("Initializing MatchingVisualizer...")
-        load_dotenv()
-        self.api_key = os.getenv('LASTFM_API_KEY')
-        if not self.api_key:
-            raise ValueError("LASTFM_API_KEY not found in environment variables")
+        self.api_key = get_lastfm_api_key()
         print("LastFM API key loaded successfully")
+        self.tag_cache = get_default_tag_cache()
+        # Last.fm pacing is left to the shared rate limiter (LASTFM_REQUESTS_PER_SECOND by default)
+        self.requests_per_second = requests_per_second
+        self.max_workers = max_workers
 
         # Define color palette for genres
         self.genre_colors = {
@@ -52,143 +120,197 @@ class MatchingVisualizer:
         """Fetch tags for a single track with error handling and logging"""
         try:
             print(f"Fetching tags for: {track['artist']} - {track['name']}")
-            tags = get_lastfm_tags(track['artist'], track['name'], self.api_key)
+            tags = get_cached_lastfm_tags(track['artist'], track['name'], self.api_key, self.tag_cache)
             print(f"Found {len(tags)} tags")
             return tags
         except Exception as e:
             print(f"Error fetching tags: {str(e)}")
             return []
 
-    def prepare_data(self, tracks: List[Dict[str, str]]):
-        """Prepare track data for visualization"""
-        print("\nPreparing data...")
-        
-        # Get tags for all tracks
-        all_track_tags = []
-        for i, track in enumerate(tracks, 1):
-            print(f"\nProcessing track {i}/{len(tracks)}")
-            tags = self.fetch_track_tags(track)
-            all_track_tags.append(tags)
-            time.sleep(0.5)  # Add delay to avoid rate limiting
-
-        # Build vocabulary
+    def analyze(self, tracks: List[Dict[str, str]], **clustering_options) -> Dict[str, Any]:
+        """Fetch tags and cluster once; every plot reads from the returned analysis.
+
+        Returns the tracks, each track's tags, its cluster id and genre (by
+        input position) and the raw clustering result. clustering_options
+        are passed through to match_tracks_to_clusters.
+        """
+        print(f"\nAnalyzing {len(tracks)} tracks...")
+        tracks = [dict(track) for track in tracks]
+        all_track_tags: List[List[str]] = [[] for _ in tracks]
+
+        def on_event(event, payload):
+            if event in ('track_tags', 'artist_tags'):
+                all_track_tags[payload['index']] = list(payload['tags'])
+
+        dummy_features = [[0, 0]] * len(tracks)
+        result = match_tracks_to_clusters(
+            dummy_features, tracks,
+            max_workers=self.max_workers,
+            requests_per_second=self.requests_per_second,
+            tag_cache=self.tag_cache,
+            on_event=on_event,
+            api_key=self.api_key,
+            **clustering_options
+        )
+
+        # Labels come straight from the clusters' input positions
+        labels: List[Optional[int]] = [None] * len(tracks)
+        genres = ['unclassified'] * len(tracks)
+        for cluster in result['clusters']:
+            for i in cluster['track_indices']:
+                labels[i] = cluster['id']
+                genres[i] = cluster['genre']
+        for i, label in enumerate(labels):
+            if label is None:
+                print(f"Warning: No cluster found for {tracks[i].get('name')} by {tracks[i].get('artist')}")
+
+        return {
+            'tracks': tracks,
+            'tags': all_track_tags,
+            'labels': labels,
+            'genres': genres,
+            'result': result
+        }
+
+    def prepare_data(self, analysis: Dict[str, Any]):
+        """Build the tag vectors for an analysis without fetching anything again"""
         print("\nBuilding tag vocabulary...")
+        all_track_tags = analysis['tags']
         tag_vocabulary = build_tag_vocabulary(all_track_tags)
         print(f"Created vocabulary with {len(tag_vocabulary)} unique tags")
 
-        # Create feature vectors
         print("Creating feature vectors...")
-        feature_vectors = np.array([
-            create_feature_vector(tags, tag_vocabulary)
-            for tags in all_track_tags
-        ])
+        feature_vectors = build_feature_matrix(all_track_tags, tag_vocabulary).toarray()
         print(f"Created {len(feature_vectors)} feature vectors")
 
         return feature_vectors, all_track_tags, tag_vocabulary
 
+    def render_clusters_2d(self, analysis: Dict[str, Any], method: str = 'pca',
+                           image_format: str = 'png') -> bytes:
+        """Render the 2D cluster scatter plot for an analysis"""
+        tracks = analysis['tracks']
+        genres = analysis['genres']
+        features, _, _ = self.prepare_data(analysis)
+
+        print(f"\nReducing dimensionality using {method.upper()}...")
+        reduced_features, title = project_2d(features, method)
+
+        print("\nCreating visualization...")
+        fig = Figure(figsize=(15, 10))
+        ax = fig.add_subplot()
+
+        # Plot points
+        for genre in sorted(set(genres)):
+            mask = np.array(genres) == genre
+            color = self.genre_colors.get(genre, '#CCCCCC')
+            ax.scatter(reduced_features[mask, 0], reduced_features[mask, 1],
+                       color=color, label=genre.title(),
+                       alpha=0.8, s=150, edgecolor='white')
+
+        # Add labels
+        for i, track in enumerate(tracks):
+            ax.annotate(f"{track.get('name', '')}\n({track.get('artist', '')})",
+                        (reduced_features[i, 0], reduced_features[i, 1]),
+                        xytext=(10, 10), textcoords='offset points',
+                        bbox=dict(facecolor='white', edgecolor='none', alpha=0.7),
+                        fontsize=8)
+
+        ax.set_title(title)
+        ax.set_xlabel('Component 1')
+        ax.set_ylabel('Component 2')
+        ax.legend()
+        fig.tight_layout()
+        return figure_bytes(fig, image_format)
+
+    def render_tag_distribution(self, analysis: Dict[str, Any], image_format: str = 'png') -> bytes:
+        """Render the tag count bar chart for an analysis"""
+        print("\nCalculating tag distribution...")
+        tag_counts = Counter(tag for tags in analysis['tags'] for tag in tags)
+
+        print("\nCreating tag distribution visualization...")
+        fig = Figure(figsize=(15, 10))
+        ax = fig.add_subplot()
+        ax.bar(list(tag_counts.keys()), list(tag_counts.values()))
+        ax.tick_params(axis='x', labelrotation=90)
+        ax.set_title('Tag Distribution')
+        ax.set_xlabel('Tag')
+        ax.set_ylabel('Count')
+        fig.tight_layout()
+        return figure_bytes(fig, image_format)
+
+    def render(self, tracks: List[Dict[str, str]], plots: Iterable[str] = PLOTS, method: str = 'pca',
+               image_format: str = 'png', cache: Optional[RenderCache] = None,
+               **clustering_options) -> Dict[str, bytes]:
+        """Render the requested plots, serving repeats from cache.
+
+        Only plots missing from the cache trigger an analysis, and one
+        analysis feeds all of them. Nothing is cached when a tag lookup failed.
+        """
+        plots = list(plots)
+        for plot in plots:
+            if plot not in PLOTS:
+                raise ValueError(f"Unknown plot: {plot}")
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown image format: {image_format}")
+        if method not in PROJECTION_METHODS:
+            raise ValueError(f"Unknown projection method: {method}")
+
+        images = {}
+        keys = {}
+        for plot in plots:
+            params = dict(plot=plot, image_format=image_format, **clustering_options)
+            if plot == 'clusters':
+                params['method'] = method
+            keys[plot] = render_cache_key(tracks, **params)
+            cached = cache.get(keys[plot]) if cache is not None else None
+            if cached is not None:
+                images[plot] = cached
+
+        missing = [plot for plot in plots if plot not in images]
+        if missing:
+            analysis = self.analyze(tracks, **clustering_options)
+            # Like /cluster, renders from runs with failed lookups are redone next time
+            cacheable = cache is not None and not analysis['result'].get('tag_fetch_failures')
+            for plot in missing:
+                if plot == 'clusters':
+                    images[plot] = self.render_clusters_2d(analysis, method, image_format)
+                else:
+                    images[plot] = self.render_tag_distribution(analysis, image_format)
+                if cacheable:
+                    cache.set(keys[plot], images[plot])
+        return images
+
     def visualize_clusters_2d(self, tracks: List[Dict[str, str]], method='pca', 
-                            save_path: str = None):
-        """Visualize clusters in 2D"""
+                            save_path: str = None, analysis: Optional[Dict[str, Any]] = None,
+                            image_format: str = 'png') -> bytes:
+        """Visualize clusters in 2D, reusing analysis when given"""
         try:
-            # Prepare data
-            features, _, _ = self.prepare_data(tracks)
-            print("\nRunning clustering algorithm...")
-            dummy_features = [[0, 0]] * len(tracks)
-            clustering_result = match_tracks_to_clusters(dummy_features, tracks)
-
-            # Get cluster information
-            print("Processing cluster information...")
-            labels = []
-            genres = []
-            for track in tracks:
-                found = False
-                for cluster in clustering_result['clusters']:
-                    if any(t['name'] == track['name'] and t['artist'] == track['artist'] 
-                          for t in cluster['tracks']):
-                        labels.append(cluster['id'])
-                        genres.append(cluster['genre'])
-                        found = True
-                        break
-                if not found:
-                    print(f"Warning: No cluster found for {track['name']} by {track['artist']}")
-
-            # Reduce dimensionality
-            print(f"\nReducing dimensionality using {method.upper()}...")
-            if method == 'tsne' and len(tracks) >= 5:
-                reducer = TSNE(n_components=2, random_state=42, 
-                             perplexity=min(len(tracks) - 1, 30) / 3.0)
-                title = 'Track Clusters (t-SNE)'
-            else:
-                reducer = PCA(n_components=2)
-                title = 'Track Clusters (PCA)'
-
-            reduced_features = reducer.fit_transform(features)
-
-            # Create visualization
-            print("\nCreating visualization...")
-            plt.figure(figsize=(15, 10))
-            
-            # Plot points
-            unique_genres = list(set(genres))
-            for genre in unique_genres:
-                mask = np.array(genres) == genre
-                color = self.genre_colors.get(genre, '#CCCCCC')
-                plt.scatter(reduced_features[mask, 0], reduced_features[mask, 1],
-                          color=color, label=genre.title(),
-                          alpha=0.8, s=150, edgecolor='white')
-
-            # Add labels
-            for i, track in enumerate(tracks):
-                plt.annotate(f"{track['name']}\n({track['artist']})",
-                           (reduced_features[i, 0], reduced_features[i, 1]),
-                           xytext=(10, 10), textcoords='offset points',
-                           bbox=dict(facecolor='white', edgecolor='none', alpha=0.7),
-                           fontsize=8)
-
-            plt.title(title)
-            plt.xlabel('Component 1')
-            plt.ylabel('Component 2')
-            plt.legend()
-            plt.tight_layout()
-
+            analysis = analysis or self.analyze(tracks)
+            image = self.render_clusters_2d(analysis, method, image_format)
             if save_path:
-                plt.savefig(save_path)
+                with open(save_path, 'wb') as f:
+                    f.write(image)
                 print(f"Saved visualization to {save_path}")
-
-            plt.show()
             print("Visualization completed!")
+            return image
 
         except Exception as e:
             print(f"Error during visualization: {str(e)}")
             raise
 
-    def visualize_tag_distribution(self, tracks: List[Dict[str, str]], save_path: str = None):
-        """Visualize tag distribution for a set of tracks"""
+    def visualize_tag_distribution(self, tracks: List[Dict[str, str]], save_path: str = None,
+                                   analysis: Optional[Dict[str, Any]] = None,
+                                   image_format: str = 'png') -> bytes:
+        """Visualize tag distribution for a set of tracks, reusing analysis when given"""
         try:
-            _, _, tag_vocabulary = self.prepare_data(tracks)
-            print("\nCalculating tag distribution...")
-            tag_counts = {tag: 0 for tag in tag_vocabulary}
-            for track in tracks:
-                tags = self.fetch_track_tags(track)
-                for tag in tags:
-                    tag_counts[tag] += 1
-
-            print("\nCreating tag distribution visualization...")
-            plt.figure(figsize=(15, 10))
-            
-            plt.bar(tag_counts.keys(), tag_counts.values())
-            plt.xticks(rotation=90)
-            plt.title('Tag Distribution')
-            plt.xlabel('Tag')
-            plt.ylabel('Count')
-            plt.tight_layout()
-
+            analysis = analysis or self.analyze(tracks)
+            image = self.render_tag_distribution(analysis, image_format)
             if save_path:
-                plt.savefig(save_path)
+                with open(save_path, 'wb') as f:
+                    f.write(image)
                 print(f"Saved tag distribution visualization to {save_path}")
-
-            plt.show()
             print("Tag distribution visualization completed!")
+            return image
 
         except Exception as e:
             print(f"Error during tag distribution visualization: {str(e)}")
@@ -230,9 +352,11 @@ def main():
         cluster_path = os.path.join(output_dir, "cluster_visualization.png")
         tag_path = os.path.join(output_dir, "tag_distribution.png")
         
+        # One fetch and one clustering run feed both plots
+        analysis = visualizer.analyze(test_tracks)
         print(f"Saving visualizations to {output_dir}...")
-        visualizer.visualize_clusters_2d(test_tracks, method='pca', save_path=cluster_path)
-        visualizer.visualize_tag_distribution(test_tracks, save_path=tag_path)
+        visualizer.visualize_clusters_2d(test_tracks, method='pca', save_path=cluster_path, analysis=analysis)
+        visualizer.visualize_tag_distribution(test_tracks, save_path=tag_path, analysis=analysis)
         
         print(f"Visualizations saved to:")
         print(f"  - {cluster_path}")
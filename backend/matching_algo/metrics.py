@@ -0,0 +1,111 @@
+import numpy as np
+from scipy import sparse
+from sklearn.metrics import silhouette_score
+from typing import Any, Dict, Tuple
+
+METRICS_MODES = ('auto', 'none', 'sampled', 'full')
+# Above this many tracks 'auto' switches silhouette to a sample
+AUTO_SAMPLE_THRESHOLD = 2000
+DEFAULT_METRICS_SAMPLE_SIZE = 1000
+
+
+def _centroids_and_sq_distances(X, labels: np.ndarray, n_clusters: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return cluster centroids, cluster sizes and each row's squared distance to its centroid"""
+    n_samples = X.shape[0]
+    membership = sparse.csr_matrix(
+        (np.ones(n_samples), (labels, np.arange(n_samples))),
+        shape=(n_clusters, n_samples)
+    )
+    counts = np.asarray(membership.sum(axis=1)).ravel()
+    cluster_sums = membership @ X
+    if sparse.issparse(cluster_sums):
+        cluster_sums = cluster_sums.toarray()
+    centroids = np.asarray(cluster_sums) / counts[:, None]
+
+    # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, so X never has to be densified
+    if sparse.issparse(X):
+        row_sq_norms = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+    else:
+        row_sq_norms = np.einsum('ij,ij->i', X, X)
+    own_dots = np.asarray(X @ centroids.T)[np.arange(n_samples), labels]
+    centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    sq_distances = np.maximum(row_sq_norms - 2 * own_dots + centroid_sq_norms[labels], 0)
+    return centroids, counts, sq_distances
+
+
+def sparse_calinski_harabasz_score(X, labels) -> float:
+    """Calinski-Harabasz index that accepts dense or sparse feature matrices"""
+    _, labels = np.unique(labels, return_inverse=True)
+    n_samples, n_clusters = X.shape[0], labels.max() + 1
+    centroids, counts, sq_distances = _centroids_and_sq_distances(X, labels, n_clusters)
+
+    overall_mean = np.asarray(X.mean(axis=0)).ravel()
+    between = np.sum(counts * np.sum((centroids - overall_mean) ** 2, axis=1))
+    within = np.sum(sq_distances)
+    if within == 0:
+        return 1.0
+    return float(between * (n_samples - n_clusters) / (within * (n_clusters - 1)))
+
+
+def sparse_davies_bouldin_score(X, labels) -> float:
+    """Davies-Bouldin index that accepts dense or sparse feature matrices"""
+    _, labels = np.unique(labels, return_inverse=True)
+    n_clusters = labels.max() + 1
+    centroids, counts, sq_distances = _centroids_and_sq_distances(X, labels, n_clusters)
+
+    intra_dists = np.bincount(labels, weights=np.sqrt(sq_distances), minlength=n_clusters) / counts
+    centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    centroid_distances = np.sqrt(np.maximum(
+        centroid_sq_norms[:, None] - 2 * centroids @ centroids.T + centroid_sq_norms[None, :], 0
+    ))
+    np.fill_diagonal(centroid_distances, 0)
+    if np.allclose(intra_dists, 0) or np.allclose(centroid_distances, 0):
+        return 0.0
+
+    centroid_distances[centroid_distances == 0] = np.inf
+    combined_intra_dists = intra_dists[:, None] + intra_dists[None, :]
+    scores = np.max(combined_intra_dists / centroid_distances, axis=1)
+    return float(np.mean(scores))
+
+
+def compute_cluster_metrics(X, labels, n_clusters: int, mode: str = 'auto',
+                            sample_size: int = DEFAULT_METRICS_SAMPLE_SIZE,
+                            seed: int = 42) -> Dict[str, Any]:
+    """Compute silhouette, Davies-Bouldin and Calinski-Harabasz scores on a dense or sparse matrix.
+
+    mode is one of 'none', 'sampled', 'full' or 'auto' (sampled once there are
+    more than AUTO_SAMPLE_THRESHOLD rows). Only silhouette is O(n^2), so
+    sampled mode estimates it on sample_size rows and keeps the linear-time
+    scores exact. The result's 'metrics_mode' records how each number was made.
+    """
+    if mode not in METRICS_MODES:
+        raise ValueError(f"Unknown metrics mode: {mode}")
+    if mode == 'auto':
+        mode = 'sampled' if X.shape[0] > AUTO_SAMPLE_THRESHOLD else 'full'
+
+    metrics = {
+        'silhouette_score': None,
+        'davies_bouldin': None,
+        'calinski_harabasz': None,
+        'metrics_mode': {
+            'silhouette_score': None,
+            'davies_bouldin': None,
+            'calinski_harabasz': None
+        }
+    }
+    computable = X.shape[0] > 2 and n_clusters > 1 and 1 < len(np.unique(labels)) < X.shape[0]
+    if mode == 'none' or not computable:
+        return metrics
+
+    sampled = mode == 'sampled' and X.shape[0] > sample_size
+    metrics['silhouette_score'] = float(silhouette_score(
+        X, labels, sample_size=sample_size if sampled else None, random_state=seed
+    ))
+    metrics['davies_bouldin'] = sparse_davies_bouldin_score(X, labels)
+    metrics['calinski_harabasz'] = sparse_calinski_harabasz_score(X, labels)
+    metrics['metrics_mode'] = {
+        'silhouette_score': 'sampled' if sampled else 'full',
+        'davies_bouldin': 'full',
+        'calinski_harabasz': 'full'
+    }
+    return metrics
@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .matching import (
+    build_feature_matrix,
+    build_tag_vocabulary,
+    fetch_track_tags_with_status,
+    get_lastfm_api_key,
+    match_tracks_to_clusters
+)
+from .files import atomic_write
+from .tag_cache import TagCache, normalize_track_key
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "playlist_models")
+DEFAULT_DRIFT_THRESHOLD = 0.25
+
+
+def track_key(track: Dict) -> str:
+    """Stable identity for a track within a playlist model"""
+    return normalize_track_key(track.get('artist', ''), track.get('name', ''))
+
+
+class PlaylistModel:
+    """Persisted clustering state for one playlist.
+
+    Holds the tag vocabulary, one centroid per (merged) cluster, the
+    cluster -> genre mapping, and every known track's tags and cluster, plus
+    the drift statistics accumulated since the last full fit.
+    """
+
+    def __init__(self, playlist_id: str, vocabulary: Dict[str, int], centroids: np.ndarray,
+                 cluster_genres: List[str], tracks: Dict[str, Dict[str, Any]],
+                 baseline_distance: float, metrics: Optional[Dict[str, Any]] = None,
+                 drift: Optional[Dict[str, float]] = None, fitted_at: Optional[float] = None):
+        self.playlist_id = playlist_id
+        self.vocabulary = vocabulary
+        self.centroids = np.asarray(centroids, dtype=float)
+        self.cluster_genres = cluster_genres
+        self.tracks = tracks
+        self.baseline_distance = baseline_distance
+        self.metrics = metrics or {}
+        self.drift = drift or {
+            'n_fitted': len(tracks),
+            'added': 0,
+            'removed': 0,
+            'added_tags': 0,
+            'unknown_tags': 0,
+            'added_distance': 0.0
+        }
+        self.fitted_at = fitted_at or time.time()
+
+    @classmethod
+    def from_result(cls, playlist_id: str, result: Dict[str, Any],
+                    unfetched: Iterable[int] = ()) -> 'PlaylistModel':
+        """Build a model from a match_tracks_to_clusters result.
+
+        Tracks at the unfetched input positions, and tracks whose tags were
+        still pending, are left out so the next update fetches them.
+        """
+        clusters = [cluster for cluster in result['clusters'] if not cluster.get('pending')]
+        unfetched = set(unfetched)
+        tracks = {}
+        for cluster_id, cluster in enumerate(clusters):
+            indices = cluster.get('track_indices') or [None] * len(cluster['tracks'])
+            for i, track in zip(indices, cluster['tracks']):
+                if i in unfetched or track.get('tags_pending'):
+                    continue
+                tracks[track_key(track)] = {'tags': list(track.get('tags', [])), 'cluster': cluster_id}
+
+        keys = list(tracks)
+        all_track_tags = [tracks[key]['tags'] for key in keys]
+        vocabulary = build_tag_vocabulary(all_track_tags)
+        X = build_feature_matrix(all_track_tags, vocabulary)
+        labels = np.array([tracks[key]['cluster'] for key in keys], dtype=int)
+
+        centroids = np.zeros((len(clusters), len(vocabulary)))
+        for cluster_id in range(len(clusters)):
+            members = labels == cluster_id
+            if members.any():
+                centroids[cluster_id] = np.asarray(X[members].mean(axis=0)).ravel()
+
+        distances = cls._distances(X, centroids)
+        baseline = float(distances[np.arange(len(keys)), labels].mean()) if keys else 0.0
+        metrics = {name: result.get(name) for name in ('silhouette_score', 'davies_bouldin', 'calinski_harabasz')}
+        return cls(playlist_id, vocabulary, centroids, [cluster['genre'] for cluster in clusters],
+                   tracks, baseline, metrics)
+
+    @staticmethod
+    def _distances(X, centroids: np.ndarray) -> np.ndarray:
+        """Euclidean distance from every row of sparse X to every centroid"""
+        row_sq = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+        centroid_sq = np.einsum('ij,ij->i', centroids, centroids)
+        sq = row_sq[:, None] - 2 * np.asarray(X @ centroids.T) + centroid_sq[None, :]
+        return np.sqrt(np.maximum(sq, 0))
+
+    def assign(self, all_track_tags: List[List[str]]) -> Dict[str, Any]:
+        """Assign tracks to their nearest existing cluster using the stored vocabulary"""
+        X = build_feature_matrix(all_track_tags, self.vocabulary)
+        distances = self._distances(X, self.centroids)
+        labels = distances.argmin(axis=1)
+        n_tags = sum(len({tag.lower() for tag in tags}) for tags in all_track_tags)
+        return {
+            'labels': labels,
+            'distances': distances[np.arange(len(labels)), labels],
+            'n_tags': n_tags,
+            'unknown_tags': n_tags - X.nnz
+        }
+
+    def drift_score(self) -> Dict[str, float]:
+        """Summarize how far the playlist has moved since the last full fit"""
+        drift = self.drift
+        n_fitted = max(drift['n_fitted'], 1)
+        churn = (drift['added'] + drift['removed']) / n_fitted
+        unknown_rate = drift['unknown_tags'] / drift['added_tags'] if drift['added_tags'] else 0.0
+        distance_increase = 0.0
+        if drift['added'] and self.baseline_distance > 0:
+            mean_distance = drift['added_distance'] / drift['added']
+            distance_increase = max(mean_distance / self.baseline_distance - 1.0, 0.0)
+        return {
+            'churn': churn,
+            'unknown_tag_rate': unknown_rate,
+            'distance_increase': distance_increase,
+            'score': max(churn, unknown_rate, distance_increase)
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'playlist_id': self.playlist_id,
+            'vocabulary': self.vocabulary,
+            'centroids': self.centroids.tolist(),
+            'cluster_genres': self.cluster_genres,
+            'tracks': self.tracks,
+            'baseline_distance': self.baseline_distance,
+            'metrics': self.metrics,
+            'drift': self.drift,
+            'fitted_at': self.fitted_at
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'PlaylistModel':
+        return cls(
+            data['playlist_id'], data['vocabulary'], np.array(data['centroids']),
+            data['cluster_genres'], data['tracks'], data['baseline_distance'],
+            data.get('metrics'), data.get('drift'), data.get('fitted_at')
+        )
+
+
+class PlaylistModelStore:
+    """One JSON file per playlist under a directory"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.getenv('PLAYLIST_MODEL_DIR', DEFAULT_MODEL_DIR)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, playlist_id: str) -> str:
+        digest = hashlib.sha1(str(playlist_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def load(self, playlist_id: str) -> Optional[PlaylistModel]:
+        path = self._path(playlist_id)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return PlaylistModel.from_dict(json.load(f))
+
+    def save(self, model: PlaylistModel):
+        def write(tmp_path: str):
+            with open(tmp_path, 'w') as f:
+                json.dump(model.to_dict(), f)
+        atomic_write(self._path(model.playlist_id), write)
+
+    def delete(self, playlist_id: str):
+        path = self._path(playlist_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _clusters_from_model(model: PlaylistModel, track_metadata: List[Dict],
+                         unfetched: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+    unfetched = unfetched or {}
+    clusters = [
+        {'id': cluster_id, 'genre': genre, 'tags': set(), 'tracks': []}
+        for cluster_id, genre in enumerate(model.cluster_genres)
+    ]
+    for track in track_metadata:
+        key = track_key(track)
+        state = model.tracks[key] if key in model.tracks else unfetched[key]
+        cluster = clusters[state['cluster']]
+        cluster['tracks'].append({**track, 'tags': state['tags']})
+        cluster['tags'].update(state['tags'])
+
+    # Drop clusters whose tracks were all removed and renumber the rest
+    clusters = [cluster for cluster in clusters if cluster['tracks']]
+    for cluster_id, cluster in enumerate(clusters):
+        cluster['id'] = cluster_id
+        cluster['tags'] = sorted(cluster['tags'])
+    return clusters
+
+
+def update_playlist_clusters(playlist_id: str, features, track_metadata: List[Dict],
+                             store: Optional[PlaylistModelStore] = None,
+                             drift_threshold: float = DEFAULT_DRIFT_THRESHOLD,
+                             force_refit: bool = False,
+                             tag_cache: Optional[TagCache] = None,
+                             **match_options) -> Dict[str, Any]:
+    """Cluster a playlist incrementally against its persisted model.
+
+    Only tracks the model has not seen are fetched and vectorized; they are
+    assigned to the nearest existing cluster. A full match_tracks_to_clusters
+    refit happens when there is no model yet, when force_refit is set, or
+    when the drift score (see PlaylistModel.drift_score) exceeds
+    drift_threshold. The refit reads old tracks' tags from the tag cache.
+    Either way, tracks whose lookup failed or was still pending are placed
+    for this response but not stored, so the next call fetches them again.
+    """
+    store = store or PlaylistModelStore()
+    model = store.load(playlist_id)
+
+    def refit(reason: str, drift: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        unfetched = set()
+        on_event = match_options.get('on_event')
+
+        def record(event: str, payload: Dict[str, Any]):
+            if event == 'track_tags' and payload['status'] in ('failed', 'pending'):
+                unfetched.add(payload['index'])
+            if on_event:
+                on_event(event, payload)
+
+        result = match_tracks_to_clusters(features, track_metadata, tag_cache=tag_cache,
+                                          **{**match_options, 'on_event': record})
+        if result['clusters']:
+            store.save(PlaylistModel.from_result(playlist_id, result, unfetched))
+        result['incremental'] = {'refit': True, 'reason': reason, 'new_tracks': len(track_metadata)}
+        if drift:
+            result['incremental']['drift'] = drift
+        return result
+
+    if model is None:
+        return refit('no_model')
+    if force_refit:
+        return refit('forced')
+
+    # Diff the playlist against the model
+    current_keys = [track_key(track) for track in track_metadata]
+    current_set = set(current_keys)
+    removed = [key for key in model.tracks if key not in current_set]
+    new_indices = [i for i, key in enumerate(current_keys) if key not in model.tracks]
+    for key in removed:
+        del model.tracks[key]
+
+    failed = []
+    unfetched = {}
+    if new_indices:
+        api_key = get_lastfm_api_key()
+        new_tracks = [track_metadata[i] for i in new_indices]
+        new_tags, failed = fetch_track_tags_with_status(new_tracks, api_key, cache=tag_cache)
+        assignment = model.assign(new_tags)
+        fetched = np.ones(len(new_tracks), dtype=bool)
+        fetched[failed] = False
+        for track, tags, label, ok in zip(new_tracks, new_tags, assignment['labels'], fetched):
+            state = {'tags': tags, 'cluster': int(label)}
+            if ok:
+                model.tracks[track_key(track)] = state
+            else:
+                unfetched[track_key(track)] = state  # Placed for this response only, so the next call retries it
+
+        # Failed tracks have no tags, so they only need leaving out of the counts and distances
+        model.drift['added'] += int(fetched.sum())
+        model.drift['added_tags'] += assignment['n_tags']
+        model.drift['unknown_tags'] += assignment['unknown_tags']
+        model.drift['added_distance'] += float(assignment['distances'][fetched].sum())
+    model.drift['removed'] += len(removed)
+
+    drift = model.drift_score()
+    if drift['score'] > drift_threshold:
+        return refit('drift', drift)
+
+    store.save(model)
+    return {
+        'clusters': _clusters_from_model(model, track_metadata, unfetched),
+        **model.metrics,
+        'tag_fetch_failures': len(failed),
+        'incremental': {
+            'refit': False,
+            'new_tracks': len(new_indices),
+            'removed_tracks': len(removed),
+            'drift': drift
+        }
+    }
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .files import atomic_write
+from .instrumentation import RESULT_CACHE_LOOKUPS
+from .serialization import decode_result, encode_result
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 512 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 24 * 3600
+# Options that change how fast a result is computed but not the result itself; deadline
+# options only matter for results with outstanding lookups, which are never cached
+UNKEYED_OPTIONS = frozenset({'max_workers', 'requests_per_second', 'on_event', 'deadline_ms', 'pending_placement'})
+# Result fields describing the request that produced them rather than the clustering
+REQUEST_FIELDS = ('deadline', 'timings')
+
+
+def playlist_fingerprint(track_metadata: List[Dict], features=None, **params) -> str:
+    """Stable hash of the ordered (artist, name) list plus the clustering parameters.
+
+    features are only hashed when given, i.e. for the audio and hybrid modes
+    that actually read them.
+    """
+    digest = hashlib.sha256()
+    tracks = [[track.get('artist'), track.get('name')] for track in track_metadata]
+    keyed = {name: value for name, value in params.items() if name not in UNKEYED_OPTIONS}
+    digest.update(json.dumps({'tracks': tracks, 'params': keyed}, sort_keys=True, default=str).encode('utf-8'))
+    if features is not None:
+        audio = np.ascontiguousarray(features, dtype=float)
+        digest.update(str(audio.shape).encode('ascii'))
+        digest.update(audio.tobytes())
+    return digest.hexdigest()
+
+
+def rebind_tracks(result: Dict[str, Any], track_metadata: List[Dict]) -> Dict[str, Any]:
+    """Point a cached result's cluster tracks back at this request's track dicts"""
+    for cluster in result['clusters']:
+        if 'track_indices' not in cluster:
+            continue
+        tracks = []
+        for i, cached in zip(cluster['track_indices'], cluster['tracks']):
+            track = dict(track_metadata[i])
+            if 'tags' in cached:
+                track['tags'] = cached['tags']
+            tracks.append(track)
+        cluster['tracks'] = tracks
+    return result
+
+
+class ResultCache:
+    """Clustering results keyed by playlist_fingerprint.
+
+    Results are held serialized in an in-memory LRU bounded by max_bytes and
+    expire after ttl_seconds. With a directory they are also written there,
+    one file per fingerprint, so they survive restarts; the directory is
+    pruned to max_disk_bytes, oldest first.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 directory: Optional[str] = None,
+                 max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries: 'OrderedDict[str, Tuple[float, bytes]]' = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _remember(self, key: str, stored_at: float, payload: bytes):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= len(previous[1])
+        self._entries[key] = (stored_at, payload)
+        self.bytes += len(payload)
+        while self.bytes > self.max_bytes and self._entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def _load_from_disk(self, key: str) -> Optional[Tuple[float, bytes]]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            with open(path, 'rb') as f:
+                return stored_at, f.read()
+        except OSError:
+            return None
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        RESULT_CACHE_LOOKUPS.inc(outcome='hit' if hit else 'miss')
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh copy of the cached result, or None on a miss or expired entry"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._load_from_disk(key)
+            if entry is not None and len(entry[1]) <= self.max_bytes:
+                with self._lock:
+                    self._remember(key, *entry)
+        if entry is None or now - entry[0] > self.ttl_seconds:
+            with self._lock:
+                if entry is not None and self._entries.pop(key, None) is not None:
+                    self.bytes -= len(entry[1])
+                self._record(False)
+            return None
+        with self._lock:
+            self._record(True)
+        return decode_result(entry[1])
+
+    def set(self, key: str, result: Dict[str, Any]):
+        """Store a result without its REQUEST_FIELDS; results bigger than the whole budget are not cached"""
+        payload, _ = encode_result({name: value for name, value in result.items() if name not in REQUEST_FIELDS})
+        if len(payload) > self.max_bytes:
+            return
+        stored_at = time.time()
+        with self._lock:
+            self._remember(key, stored_at, payload)
+        if self.directory:
+            def write(tmp_path: str):
+                with open(tmp_path, 'wb') as f:
+                    f.write(payload)
+            atomic_write(self._path(key), write)
+            self._prune_disk()
+
+    def _prune_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'persistent': bool(self.directory)
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.directory, name))
+
+
+def result_cache_from_env() -> ResultCache:
+    """Build the result cache configured from CLUSTER_RESULT_CACHE_* variables"""
+    return ResultCache(
+        max_bytes=int(os.getenv('CLUSTER_RESULT_CACHE_BYTES', DEFAULT_MAX_BYTES)),
+        ttl_seconds=float(os.getenv('CLUSTER_RESULT_CACHE_TTL', DEFAULT_TTL_SECONDS)),
+        directory=os.getenv('CLUSTER_RESULT_CACHE_DIR') or None,
+        max_disk_bytes=int(os.getenv('CLUSTER_RESULT_CACHE_DISK_BYTES', DEFAULT_MAX_DISK_BYTES))
+    )
@@ -0,0 +1,78 @@
+import json
+from typing import Any, Dict, List, Tuple
+
+try:
+    import orjson
+except ImportError:  # Optional: falls back to the standard library encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # Optional: msgpack responses are only offered when installed
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+RESPONSE_FORMATS = ('full', 'compact')
+
+
+def _to_builtin(obj: Any) -> Any:
+    """Fallback for numpy scalars and arrays that the encoders do not know"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def compact_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Rewrite a clustering result so tracks are referenced by input index.
+
+    Every tag is interned once into 'tags'; 'track_tags' holds each input
+    track's tag ids and clusters carry tag ids and 'track_indices' instead
+    of copies of the track dicts. All other result fields pass through.
+    """
+    tag_ids: Dict[str, int] = {}
+
+    def intern(tags: List[str]) -> List[int]:
+        return [tag_ids.setdefault(tag, len(tag_ids)) for tag in tags]
+
+    n_tracks = sum(len(cluster['tracks']) for cluster in result['clusters'])
+    track_tags: List[List[int]] = [[] for _ in range(n_tracks)]
+    clusters = []
+    for cluster in result['clusters']:
+        if 'track_indices' not in cluster:
+            raise ValueError("Compact format needs clusters with track_indices")
+        for index, track in zip(cluster['track_indices'], cluster['tracks']):
+            track_tags[index] = intern(track.get('tags') or [])
+        clusters.append({
+            'id': cluster['id'],
+            'genre': cluster['genre'],
+            'tags': intern(cluster['tags']),
+            'track_indices': cluster['track_indices']
+        })
+
+    return {
+        **{key: value for key, value in result.items() if key != 'clusters'},
+        'format': 'compact',
+        'tags': list(tag_ids),
+        'track_tags': track_tags,
+        'clusters': clusters
+    }
+
+
+def encode_result(result: Dict[str, Any], accept: str = '') -> Tuple[bytes, str]:
+    """Serialize a result, honouring an Accept header that asks for msgpack"""
+    if msgpack is not None and MSGPACK_MIMETYPE in (accept or ''):
+        return msgpack.packb(result, default=_to_builtin), MSGPACK_MIMETYPE
+    if orjson is not None:
+        return orjson.dumps(result, default=_to_builtin,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS), JSON_MIMETYPE
+    return json.dumps(result, default=_to_builtin).encode('utf-8'), JSON_MIMETYPE
+
+
+def decode_result(payload: bytes) -> Dict[str, Any]:
+    """Parse JSON produced by encode_result"""
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
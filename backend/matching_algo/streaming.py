@@ -0,0 +1,153 @@
+from collections import Counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from scipy import sparse
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction import FeatureHasher
+
+from .matching import fetch_track_tags_with_status, get_lastfm_api_key, merge_similar_clusters
+from .genre_taxonomy import GENRE_TAXONOMY
+from .metrics import compute_cluster_metrics
+from .tag_cache import TagCache
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_N_FEATURES = 2 ** 12
+DEFAULT_METRICS_SAMPLE_SIZE = 2000
+
+
+def iter_chunks(tracks: Iterable[Dict], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[Dict]]:
+    """Split an iterable of tracks into lists of at most chunk_size tracks"""
+    chunk = []
+    for track in tracks:
+        chunk.append(track)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def hash_tag_matrix(all_tags: List[List[str]], n_features: int = DEFAULT_N_FEATURES) -> sparse.csr_matrix:
+    """Binary CSR tag matrix in a fixed hashed space, so no global vocabulary is needed"""
+    hasher = FeatureHasher(n_features=n_features, input_type='string', alternate_sign=False)
+    matrix = hasher.transform([sorted({tag.lower() for tag in tags}) for tags in all_tags]).tocsr()
+    matrix.data[:] = 1.0
+    return matrix
+
+
+def match_library_streaming(track_chunks: Callable[[], Iterable[List[Dict]]],
+                            n_clusters: int = 8,
+                            n_features: int = DEFAULT_N_FEATURES,
+                            api_key: Optional[str] = None,
+                            max_workers: Optional[int] = None,
+                            requests_per_second: Optional[float] = None,
+                            tag_cache: Optional[TagCache] = None,
+                            metrics_sample_size: int = DEFAULT_METRICS_SAMPLE_SIZE,
+                            random_state: int = 42) -> Dict:
+    """Cluster a whole library chunk by chunk with MiniBatchKMeans.
+
+    track_chunks is called once per pass and must return a fresh iterable of
+    track lists. The first pass fetches tags and fits incrementally with
+    partial_fit; the second re-reads tags (now cache hits) and assigns labels.
+    Tracks are vectorized with feature hashing and metrics are computed on a
+    reservoir sample, so the model and scoring memory do not grow with the
+    library. The result does: it has the same cluster/genre/merge shape as
+    match_tracks_to_clusters, so every track and its tags are held until
+    it is returned, which is O(n) in the library size.
+    """
+    if api_key is None:
+        api_key = get_lastfm_api_key()
+
+    def tagged_chunks():
+        for chunk in track_chunks():
+            if not chunk:
+                continue
+            all_track_tags, failed = fetch_track_tags_with_status(
+                chunk, api_key,
+                max_workers=max_workers,
+                requests_per_second=requests_per_second,
+                cache=tag_cache
+            )
+            yield chunk, all_track_tags, failed
+
+    # First pass: fit incrementally, buffering until a batch can seed every centroid
+    model = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state)
+    pending = []
+    pending_rows = 0
+    fitted = False
+    for chunk, all_track_tags, _ in tagged_chunks():
+        pending.append(hash_tag_matrix(all_track_tags, n_features))
+        pending_rows += len(chunk)
+        if pending_rows >= n_clusters:
+            model.partial_fit(sparse.vstack(pending).tocsr())
+            pending, pending_rows, fitted = [], 0, True
+    if pending and fitted:
+        model.partial_fit(sparse.vstack(pending).tocsr())
+    if not fitted:
+        # Fewer tracks than clusters: nothing to stream, fall back to one cluster
+        n_clusters = 0
+
+    # Second pass: assign labels and accumulate per-cluster state; the tracks themselves are the O(n) output
+    rng = np.random.RandomState(random_state)
+    clustered_tracks = {i: [] for i in range(max(n_clusters, 1))}
+    cluster_tag_counts = {i: Counter() for i in clustered_tracks}
+    sample_rows, sample_labels = [], []
+    seen = 0
+    failures = 0
+    for chunk, all_track_tags, failed in tagged_chunks():
+        failures += len(failed)
+        X = hash_tag_matrix(all_track_tags, n_features)
+        labels = model.predict(X) if n_clusters else np.zeros(len(chunk), dtype=int)
+
+        for i, (track, tags, label) in enumerate(zip(chunk, all_track_tags, labels)):
+            track = {**track, 'tags': tags}
+            clustered_tracks[label].append(track)
+            cluster_tag_counts[label].update(tags)
+
+            # Reservoir sample keeps the metrics input bounded
+            if seen < metrics_sample_size:
+                sample_rows.append(X[i])
+                sample_labels.append(label)
+            else:
+                slot = rng.randint(0, seen + 1)
+                if slot < metrics_sample_size:
+                    sample_rows[slot] = X[i]
+                    sample_labels[slot] = label
+            seen += 1
+
+    if not seen:
+        return {
+            'clusters': [],
+            'silhouette_score': None,
+            'davies_bouldin': None,
+            'calinski_harabasz': None
+        }
+
+    metrics = compute_cluster_metrics(
+        sparse.vstack(sample_rows).tocsr(), np.array(sample_labels), n_clusters, mode='full'
+    )
+    if seen > len(sample_rows):
+        # Every score was computed on the reservoir sample, not the full library
+        metrics['metrics_mode'] = {
+            name: 'sampled' if mode else None for name, mode in metrics['metrics_mode'].items()
+        }
+
+    initial_clusters = []
+    for cluster_id, tracks in clustered_tracks.items():
+        if not tracks:
+            continue
+        tag_counts = cluster_tag_counts[cluster_id]
+        initial_clusters.append({
+            'id': cluster_id,
+            'genre': GENRE_TAXONOMY.genre_for_tag_counts(tag_counts),
+            'tags': list(tag_counts),
+            'tracks': tracks
+        })
+
+    return {
+        'clusters': merge_similar_clusters(initial_clusters),
+        **metrics,
+        'tag_fetch_failures': failures,
+        'n_tracks': seen
+    }
@@ -0,0 +1,187 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Mapping, Optional, Union
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "lastfm_tags.sqlite3")
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_NEGATIVE_TTL_SECONDS = 24 * 3600
+DEFAULT_MAX_ENTRIES = 200_000
+# A hit only rewrites last_access when it is older than this, so cached reads stay reads
+DEFAULT_TOUCH_INTERVAL_SECONDS = 3600
+
+
+def normalize_track_key(artist: str, track: str) -> str:
+    """Build the cache key for an (artist, track) pair"""
+    def normalize(value):
+        return " ".join(str(value).lower().split())
+    return f"{normalize(artist)}\x1f{normalize(track)}"
+
+
+def normalize_tag_weights(tags: Union[List[str], Mapping[str, float], None]) -> Dict[str, float]:
+    """Return tags as {tag: weight}; a plain tag list gives every tag weight 1.0"""
+    if not tags:
+        return {}
+    if isinstance(tags, Mapping):
+        return {tag: float(weight) for tag, weight in tags.items()}
+    return {tag: 1.0 for tag in tags}
+
+
+class TagCache:
+    """Persistent SQLite cache of Last.fm tags keyed by normalized (artist, track).
+
+    Tags are stored with their Last.fm weights when known ({tag: weight});
+    get() returns just the tag names and get_weights() the mapping.
+    Entries expire after ttl_seconds; empty tag lists are cached too (negative
+    caching) but expire sooner so newly tagged tracks are picked up. Once the
+    table grows past max_entries the least recently used rows are evicted;
+    recency is tracked to within touch_interval_seconds.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 negative_ttl_seconds: float = DEFAULT_NEGATIVE_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 touch_interval_seconds: float = DEFAULT_TOUCH_INTERVAL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.touch_interval_seconds = touch_interval_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Counting rows is a table scan, so capacity is only checked every few writes
+        self._trim_interval = max(1, min(256, max_entries // 10))
+        self._writes_since_trim = 0
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS track_tags ("
+            " key TEXT PRIMARY KEY,"
+            " tags TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_track_tags_access ON track_tags (last_access)")
+        self._conn.commit()
+
+    def _is_expired(self, tags: List[str], fetched_at: float, now: float) -> bool:
+        ttl = self.ttl_seconds if tags else self.negative_ttl_seconds
+        return now - fetched_at > ttl
+
+    def get(self, artist: str, track: str) -> Optional[List[str]]:
+        """Return cached tags, or None on a miss or expired entry"""
+        tags = self._lookup(artist, track)
+        return None if tags is None else list(tags)
+
+    def get_weights(self, artist: str, track: str) -> Optional[Dict[str, float]]:
+        """Return cached {tag: weight}, or None on a miss or expired entry"""
+        tags = self._lookup(artist, track)
+        return None if tags is None else normalize_tag_weights(tags)
+
+    def _lookup(self, artist: str, track: str):
+        key = normalize_track_key(artist, track)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tags, fetched_at, last_access FROM track_tags WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                tags = json.loads(row[0])
+                if not self._is_expired(tags, row[1], now):
+                    if now - row[2] > self.touch_interval_seconds:
+                        self._conn.execute("UPDATE track_tags SET last_access = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                    self.hits += 1
+                    return tags
+                self._conn.execute("DELETE FROM track_tags WHERE key = ?", (key,))
+                self._conn.commit()
+            self.misses += 1
+            return None
+
+    def set(self, artist: str, track: str, tags: Union[List[str], Mapping[str, float]]):
+        """Store tags (a list or {tag: weight}) for a track, evicting the oldest entries if over capacity"""
+        key = normalize_track_key(artist, track)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO track_tags (key, tags, fetched_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(dict(tags) if isinstance(tags, Mapping) else list(tags)), now, now)
+            )
+            self._writes_since_trim += 1
+            if self._writes_since_trim >= self._trim_interval:
+                self._writes_since_trim = 0
+                self._evict_over_capacity()
+            self._conn.commit()
+
+    def _evict_over_capacity(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM track_tags").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM track_tags WHERE key IN ("
+                " SELECT key FROM track_tags ORDER BY last_access ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def iter_tag_weights(self, batch_size: int = 10_000) -> Iterator[Dict[str, float]]:
+        """Yield {tag: weight} for every cached track with tags, expired or not"""
+        last_key = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, tags FROM track_tags WHERE key > ? ORDER BY key LIMIT ?",
+                    (last_key, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for key, tags in rows:
+                weights = normalize_tag_weights(json.loads(tags))
+                if weights:
+                    yield weights
+            last_key = rows[-1][0]
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current number of entries"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM track_tags").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': size
+        }
+
+    def clear(self):
+        """Remove every cached entry and reset the counters"""
+        with self._lock:
+            self._conn.execute("DELETE FROM track_tags")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+
+_default_cache: Optional[TagCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_tag_cache() -> TagCache:
+    """Return the shared tag cache configured from LASTFM_TAG_CACHE_* variables"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = TagCache(
+                path=os.getenv('LASTFM_TAG_CACHE_PATH', DEFAULT_CACHE_PATH),
+                ttl_seconds=float(os.getenv('LASTFM_TAG_CACHE_TTL', DEFAULT_TTL_SECONDS)),
+                negative_ttl_seconds=float(os.getenv('LASTFM_TAG_CACHE_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL_SECONDS)),
+                max_entries=int(os.getenv('LASTFM_TAG_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+                touch_interval_seconds=float(os.getenv('LASTFM_TAG_CACHE_TOUCH_INTERVAL', DEFAULT_TOUCH_INTERVAL_SECONDS))
+            )
+        return _default_cache
@@ -0,0 +1,190 @@
+import json
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Union
+
+import numpy as np
+from scipy import sparse
+from sklearn.utils.extmath import randomized_svd
+
+from .files import atomic_write
+
+EMBEDDING_FORMAT_VERSION = 1
+DEFAULT_EMBEDDING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "tag_embedding.npz")
+DEFAULT_DIMENSIONS = 64
+DEFAULT_MIN_COUNT = 5
+DEFAULT_MAX_TAGS = 50_000
+# Context distribution smoothing; dampens PMI's bias towards rare tags
+CONTEXT_SMOOTHING = 0.75
+# Listening-habit tags that say nothing about how a track sounds
+DEFAULT_STOP_TAGS = frozenset({
+    'seen live', 'favorites', 'favourites', 'favorite', 'favourite', 'favorite songs',
+    'my favorite', 'albums i own', 'love', 'loved', 'awesome', 'amazing', 'beautiful',
+    'cool', 'spotify', 'under 2000 listeners'
+})
+
+TrackTags = Union[List[str], Mapping[str, float]]
+
+
+def normalize_tag(tag: str) -> str:
+    """Fold spelling variants together: "Hip-Hop", "hip hop" and "hiphop" become "hiphop" """
+    return re.sub(r"[\s\-_./']+", '', str(tag).lower())
+
+
+def _normalized_stop_tags(stop_tags: Optional[Iterable[str]]) -> FrozenSet[str]:
+    return frozenset(normalize_tag(tag) for tag in (DEFAULT_STOP_TAGS if stop_tags is None else stop_tags))
+
+
+def _normalized_weights(tags: TrackTags, stop: FrozenSet[str] = frozenset()) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    items = tags.items() if isinstance(tags, Mapping) else ((tag, 1.0) for tag in tags)
+    for tag, weight in items:
+        key = normalize_tag(tag)
+        if key and key not in stop:
+            weights[key] = max(weights.get(key, 0.0), float(weight))
+    return weights
+
+
+class TagEmbedding:
+    """Unit-length vectors for normalized tags plus the artifact's provenance.
+
+    Learned offline from tag co-occurrence across every cached track (see
+    build_tag_embedding.py) and loaded once at import as TAG_EMBEDDING.
+    """
+
+    def __init__(self, tags: List[str], vectors: np.ndarray, metadata: Optional[Dict] = None):
+        self.tags = list(tags)
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.index = {tag: i for i, tag in enumerate(self.tags)}
+        self.metadata = dict(metadata or {})
+
+    @property
+    def dimensions(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def version(self) -> str:
+        return str(self.metadata.get('version', ''))
+
+    def vector(self, tag: str) -> Optional[np.ndarray]:
+        i = self.index.get(normalize_tag(tag))
+        return None if i is None else self.vectors[i]
+
+    def embed_tracks(self, all_track_tags: List[TrackTags],
+                     stop_tags: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Weighted average of each track's known tag vectors, L2-normalized.
+
+        Tags in stop_tags (DEFAULT_STOP_TAGS when None) are ignored. Tracks
+        with no other tag in the embedding get a zero row.
+        """
+        stop = _normalized_stop_tags(stop_tags)
+        rows, cols, values = [], [], []
+        for row, tags in enumerate(all_track_tags):
+            for tag, weight in _normalized_weights(tags, stop).items():
+                col = self.index.get(tag)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+                    values.append(weight)
+        weights = sparse.csr_matrix((values, (rows, cols)), shape=(len(all_track_tags), len(self.tags)),
+                                    dtype=np.float32)
+        X = np.asarray(weights @ self.vectors)
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        return np.divide(X, norms, out=np.zeros_like(X), where=norms > 0)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        def write(tmp_path: str):
+            np.savez_compressed(tmp_path, vectors=self.vectors, tags=np.array(self.tags, dtype=str),
+                                metadata=np.array(json.dumps(self.metadata)))
+        atomic_write(path, write, suffix='.tmp.npz')  # np.savez appends .npz to paths without it
+
+    @classmethod
+    def load(cls, path: str) -> 'TagEmbedding':
+        with np.load(path) as data:
+            metadata = json.loads(str(data['metadata']))
+            if metadata.get('format') != EMBEDDING_FORMAT_VERSION:
+                raise ValueError(f"Unsupported tag embedding format: {metadata.get('format')}")
+            return cls([str(tag) for tag in data['tags']], data['vectors'], metadata)
+
+
+def build_tag_embedding(all_track_tags: Iterable[TrackTags], dimensions: int = DEFAULT_DIMENSIONS,
+                        min_count: int = DEFAULT_MIN_COUNT, max_tags: int = DEFAULT_MAX_TAGS,
+                        seed: int = 42, stop_tags: Optional[Iterable[str]] = None) -> TagEmbedding:
+    """Learn tag vectors from a PPMI co-occurrence matrix factorized with SVD.
+
+    Tags are normalized with normalize_tag, stop_tags (DEFAULT_STOP_TAGS when
+    None) are dropped, and the rest are kept when at least min_count tracks
+    carry them (the max_tags most frequent at most). Two tags co-occur when
+    they are on the same track.
+    """
+    stop = _normalized_stop_tags(stop_tags)
+    tracks = [weights for weights in (_normalized_weights(tags, stop) for tags in all_track_tags) if weights]
+    counts = Counter(tag for weights in tracks for tag in weights)
+    tags = sorted((tag for tag, count in counts.items() if count >= min_count),
+                  key=lambda tag: (-counts[tag], tag))[:max_tags]
+    if len(tags) < 2:
+        raise ValueError("Not enough tag data to build an embedding")
+    index = {tag: i for i, tag in enumerate(tags)}
+
+    rows, cols = [], []
+    for row, weights in enumerate(tracks):
+        for tag in weights:
+            if tag in index:
+                rows.append(row)
+                cols.append(index[tag])
+    X = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(tracks), len(tags)))
+
+    # Co-occurrence counts, without each tag's pairing with itself
+    C = (X.T @ X).tocoo()
+    off_diagonal = C.row != C.col
+    C = sparse.coo_matrix((C.data[off_diagonal], (C.row[off_diagonal], C.col[off_diagonal])), shape=C.shape)
+
+    # Positive pointwise mutual information with smoothed context probabilities
+    total = C.sum()
+    if total == 0:
+        raise ValueError("No tag co-occurrences to build an embedding from")
+    row_totals = np.asarray(C.sum(axis=1)).ravel()
+    context = np.asarray(C.sum(axis=0)).ravel() ** CONTEXT_SMOOTHING
+    context /= context.sum()
+    pmi = np.log(C.data / total) - np.log(row_totals[C.row] / total) - np.log(context[C.col])
+    positive = pmi > 0
+    ppmi = sparse.csr_matrix((pmi[positive], (C.row[positive], C.col[positive])), shape=C.shape)
+
+    # Symmetric SVD weighting (U * sqrt(S)) works better than U * S for similarity
+    n_components = min(dimensions, len(tags) - 1)
+    U, S, _ = randomized_svd(ppmi, n_components=n_components, random_state=seed)
+    vectors = U * np.sqrt(S)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    created_at = time.time()
+    return TagEmbedding(tags, vectors, {
+        'format': EMBEDDING_FORMAT_VERSION,
+        'version': time.strftime('%Y%m%d%H%M%S', time.gmtime(created_at)),
+        'created_at': created_at,
+        'dimensions': int(vectors.shape[1]),
+        'n_tags': len(tags),
+        'n_tracks': len(tracks),
+        'min_count': min_count
+    })
+
+
+def load_tag_embedding(path: Optional[str] = None) -> Optional[TagEmbedding]:
+    """Load the artifact at path or TAG_EMBEDDING_PATH; None when there is none yet"""
+    path = path or os.getenv('TAG_EMBEDDING_PATH', DEFAULT_EMBEDDING_PATH)
+    if not os.path.exists(path):
+        return None
+    try:
+        embedding = TagEmbedding.load(path)
+    except Exception as e:
+        print(f"Warning: could not load tag embedding from {path}: {str(e)}")
+        return None
+    print(f"Loaded tag embedding {embedding.version} ({len(embedding.tags)} tags, {embedding.dimensions} dimensions)")
+    return embedding
+
+
+# Loaded once at import
+TAG_EMBEDDING = load_tag_embedding()
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+# Last.fm asks API clients to stay around 5 requests per second
+DEFAULT_MAX_WORKERS = int(os.getenv('LASTFM_MAX_WORKERS', 8))
+DEFAULT_REQUESTS_PER_SECOND = float(os.getenv('LASTFM_REQUESTS_PER_SECOND', 5))
+
+# Placeholder result for calls still running when run_rate_limited's deadline passes
+PENDING = object()
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces out calls to at most `rate` per second"""
+
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def acquire(self, deadline: Optional[float] = None) -> bool:
+        """Block until the caller is allowed to make its next request.
+
+        With a deadline (a time.monotonic() value), a slot that would only
+        come after it is not reserved and False is returned straight away.
+        """
+        if not self.interval:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            if deadline is not None and slot > deadline:
+                return False
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+
+
+_shared_limiters: Dict[float, RateLimiter] = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def get_shared_rate_limiter(rate: Optional[float]) -> RateLimiter:
+    """Return the process-wide limiter for a rate so concurrent requests share one budget"""
+    key = float(rate or 0)
+    with _shared_limiters_lock:
+        if key not in _shared_limiters:
+            _shared_limiters[key] = RateLimiter(key)
+        return _shared_limiters[key]
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one in-flight call.
+
+    The first caller for a key runs func; callers arriving while it runs wait
+    for and share its result (or exception). Nothing is kept once the call
+    finishes, so later callers run func again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return (result, shared), where shared means another caller's call was reused"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+def run_rate_limited(func: Callable[..., Any], args_list: Sequence[tuple],
+                     max_workers: Optional[int] = None,
+                     requests_per_second: Optional[float] = None,
+                     fallback: Callable[[], Any] = list,
+                     on_result: Optional[Callable[[int, Any], None]] = None,
+                     deadline: Optional[float] = None) -> List[Any]:
+    """Call func(*args) for every args tuple on a bounded thread pool.
+
+    Results are returned in the same order as args_list. A call that raises
+    is replaced with fallback() so one bad lookup never fails the batch.
+    on_result(position, result) is called from the worker as each call finishes.
+    With a deadline (a time.monotonic() value) the function returns once it
+    passes and unfinished calls are reported as PENDING. Calls already in
+    flight finish in the background without calling on_result, so their
+    side effects (such as cache writes) still land; calls that have not
+    started are dropped and never take a rate-limit slot past the deadline.
+    """
+    if not args_list:
+        return []
+
+    max_workers = max_workers or DEFAULT_MAX_WORKERS
+    if requests_per_second is None:
+        requests_per_second = DEFAULT_REQUESTS_PER_SECOND
+    limiter = get_shared_rate_limiter(requests_per_second)
+    results = [PENDING] * len(args_list)
+    # Results are recorded under a lock so none is both reported and returned as PENDING
+    lock = threading.Lock()
+    closed = False
+
+    def call(position, args):
+        if closed or not limiter.acquire(deadline):
+            return PENDING
+        try:
+            result = func(*args)
+        except Exception as e:
+            print(f"Error in rate limited call: {str(e)}")
+            result = fallback()
+        with lock:
+            if closed:
+                return result
+            results[position] = result
+            if on_result:
+                on_result(position, result)
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(args_list)))
+    futures = [executor.submit(call, position, args) for position, args in enumerate(args_list)]
+    wait(futures, timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+    with lock:
+        closed = True
+        finished = list(results)
+    # Queued calls are cancelled so they don't hold the shared limiter; in-flight ones finish
+    executor.shutdown(wait=False, cancel_futures=True)
+    return finished
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+from .batch import cluster_playlists_batch
+from .tag_cache import TagCache
+
+TAGS = {'Rock': ['rock', 'hard rock'], 'Jazz': ['jazz', 'bebop']}
+
+
+class TestBatchClustering(unittest.TestCase):
+    def test_batch_dedupes_lookups_and_isolates_errors(self):
+        """Test shared tag lookups and per-playlist results"""
+        shared = [{"name": f"{genre} {i}", "artist": "Artist"} for genre in TAGS for i in range(3)]
+        playlists = [
+            {'id': 'a', 'track_metadata': [dict(track) for track in shared]},
+            {'id': 'b', 'track_metadata': [dict(track) for track in shared], 'n_clusters': 2},
+            {'id': 'c', 'track_metadata': []},
+            {'id': 'd', 'track_metadata': [dict(track) for track in shared], 'k_criterion': 'bogus'}
+        ]
+
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags',
+                        side_effect=lambda artist, track, key: TAGS[track.split()[0]]) as fetch:
+            results = cluster_playlists_batch(playlists, max_processes=2, api_key='key',
+                                              requests_per_second=0, tag_cache=TagCache(':memory:'))
+
+        self.assertEqual(fetch.call_count, len(shared))
+        self.assertEqual([item['id'] for item in results], ['a', 'b', 'c', 'd'])
+        self.assertEqual(sorted(c['genre'] for c in results[0]['result']['clusters']), ['jazz', 'rock'])
+        self.assertEqual(results[1]['result']['k_selection']['source'], 'request')
+        self.assertIn('error', results[2])
+        self.assertIn('bogus', results[3]['error'])
+
+    def test_items_take_feature_modes_and_artist_fallback(self):
+        """Test per-playlist feature_mode and artist_fallback, with audio playlists fetching nothing"""
+        tracks = [{"name": f"Song {i}", "artist": "Rock Band" if i % 2 else "Jazz Band"} for i in range(6)]
+        features = [[i % 2, 1 - i % 2] for i in range(6)]
+        playlists = [
+            {'id': 'audio', 'track_metadata': [dict(t) for t in tracks], 'features': features,
+             'feature_mode': 'audio', 'n_clusters': 2},
+            {'id': 'plain', 'track_metadata': [dict(t) for t in tracks], 'n_clusters': 2},
+            {'id': 'fallback', 'track_metadata': [dict(t) for t in tracks], 'n_clusters': 2,
+             'artist_fallback': True},
+            {'id': 'bogus', 'track_metadata': [dict(t) for t in tracks], 'feature_mode': 'bogus'}
+        ]
+        artist_tags = {'Rock Band': {'rock': 1.0}, 'Jazz Band': {'jazz': 1.0}}
+
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags', return_value={}) as fetch, \
+                mock.patch(f'{__package__}.matching.fetch_artist_tags',
+                           side_effect=lambda artist, key: artist_tags[artist]) as fetch_artist:
+            results = cluster_playlists_batch(playlists, max_processes=2, api_key='key',
+                                              requests_per_second=0, tag_cache=TagCache(':memory:'))
+
+        self.assertEqual((fetch.call_count, fetch_artist.call_count), (6, 2))
+        self.assertEqual(results[0]['result']['feature_mode'], 'audio')
+        self.assertEqual(len(results[0]['result']['clusters']), 2)
+        self.assertEqual([c['genre'] for c in results[1]['result']['clusters']], ['unclassified'])
+        self.assertEqual(sorted(c['genre'] for c in results[2]['result']['clusters']), ['jazz', 'rock'])
+        self.assertIn('bogus', results[3]['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+from .files import atomic_write
+
+
+def write_text(text):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+    return write
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'model.json')
+
+    def test_replaces_the_file(self):
+        """Test the new contents land at the path with no temporary file left behind"""
+        atomic_write(self.path, write_text('old'))
+        atomic_write(self.path, write_text('new'))
+
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'new')
+        self.assertEqual(os.listdir(self.tmp.name), ['model.json'])
+
+    def test_failed_write_keeps_the_old_file(self):
+        """Test a writer that fails part way leaves the previous file intact"""
+        atomic_write(self.path, write_text('old'))
+
+        def broken(tmp_path):
+            write_text('half')(tmp_path)
+            raise OSError("disk full")
+
+        with self.assertRaises(OSError):
+            atomic_write(self.path, broken)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'old')
+        self.assertEqual(os.listdir(self.tmp.name), ['model.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
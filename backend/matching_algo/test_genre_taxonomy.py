@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+from .genre_taxonomy import GenreTaxonomy, GENRE_TAXONOMY, load_genre_taxonomy
+from .matching import build_tag_vocabulary, build_feature_matrix
+
+
+class TestGenreTaxonomy(unittest.TestCase):
+    def test_ties_follow_taxonomy_order(self):
+        """Test that tag order does not change the chosen genre"""
+        self.assertEqual(GENRE_TAXONOMY.genre_for_tags(['techno', 'pop']), 'pop')
+        self.assertEqual(GENRE_TAXONOMY.genre_for_tags(['pop', 'techno']), 'pop')
+        self.assertEqual(GENRE_TAXONOMY.genre_for_tags(['Hard Rock', 'house', 'rock']), 'rock')
+
+    def test_batch_assignment_matches_per_cluster(self):
+        """Test the sparse batch API against per-cluster lookups"""
+        all_tags = [['rock', 'hard rock'], ['house'], ['techno', 'edm'], ['seen live'], ['jazz']]
+        labels = np.array([0, 1, 1, 2, 0])
+        vocabulary = build_tag_vocabulary(all_tags)
+
+        genres = GENRE_TAXONOMY.assign_cluster_genres(
+            build_feature_matrix(all_tags, vocabulary), labels, 3, vocabulary
+        )
+
+        self.assertEqual(genres, ['rock', 'electronic', 'unclassified'])
+        for cluster_id, genre in enumerate(genres):
+            cluster_tags = [tag for tags, label in zip(all_tags, labels) if label == cluster_id for tag in tags]
+            self.assertEqual(GENRE_TAXONOMY.genre_for_tags(cluster_tags), genre)
+
+    def test_taxonomy_loads_from_config_file(self):
+        """Test loading a custom taxonomy from JSON"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'taxonomy.json')
+            with open(path, 'w') as f:
+                json.dump({'k-pop': ['kpop', 'korean'], 'city pop': ['japanese']}, f)
+            taxonomy = load_genre_taxonomy(path)
+
+        self.assertEqual(taxonomy.genre_for_tags(['Korean', 'dance']), 'k-pop')
+        self.assertEqual(taxonomy.genre_for_tags(['city pop']), 'city pop')
+        self.assertIsInstance(taxonomy, GenreTaxonomy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import unittest
+from unittest import mock
+import numpy as np
+from .instrumentation import STAGE_SECONDS, TRACK_TAG_LOOKUPS, Counter, Histogram, MetricsRegistry
+from .matching import match_tracks_to_clusters
+from .tag_cache import TagCache
+
+
+class TestMetricsRendering(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        """Test the Prometheus histogram layout"""
+        registry = MetricsRegistry()
+        histogram = registry.register(Histogram('test_seconds', "Test", buckets=(0.1, 1.0), labelnames=('stage',)))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, stage='fit')
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{stage="fit",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="fit",le="1"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="fit",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{stage="fit"} 3', lines)
+
+    def test_counters_render_with_total_suffix(self):
+        """Test labelled and unlabelled counters"""
+        registry = MetricsRegistry()
+        calls = registry.register(Counter('test_calls', "Test", labelnames=('outcome',)))
+        registry.register(Counter('test_retries', "Test"))
+        calls.inc(outcome='failure')
+        calls.inc(2, outcome='failure')
+
+        lines = registry.render().splitlines()
+        self.assertIn('test_calls_total{outcome="failure"} 3', lines)
+        self.assertIn('test_retries_total 0', lines)
+
+
+class TestPipelineTimings(unittest.TestCase):
+    def test_timings_block_and_stage_histograms(self):
+        """Test that every stage is timed and lookups are counted by status"""
+        tracks = [{"name": str(i), "artist": "A"} for i in range(6)]
+        fits_before = STAGE_SECONDS.count(stage='fit')
+        fetched_before = TRACK_TAG_LOOKUPS.value(status='fetched')
+
+        with mock.patch.dict(os.environ, {'LASTFM_API_KEY': 'key'}), \
+                mock.patch(f'{__package__}.matching.fetch_lastfm_tags',
+                           side_effect=lambda artist, track, key: ['rock'] if int(track) % 2 else ['jazz']):
+            result = match_tracks_to_clusters(np.zeros((6, 1)), tracks, n_clusters=2, requests_per_second=0,
+                                              tag_cache=TagCache(':memory:'), include_timings=True)
+
+        self.assertEqual(set(result['timings']),
+                         {'fetch', 'vocabulary', 'vectorize', 'reduce', 'fit', 'genres', 'merge', 'metrics'})
+        self.assertEqual(STAGE_SECONDS.count(stage='fit'), fits_before + 1)
+        self.assertEqual(TRACK_TAG_LOOKUPS.value(status='fetched'), fetched_before + 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import threading
+import time
+import unittest
+from .jobs import JobManager, JobQueueFullError
+
+
+def wait_for(job, timeout=5.0):
+    deadline = time.time() + timeout
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+class TestJobManager(unittest.TestCase):
+    def test_job_reports_progress_and_result(self):
+        """Test that tag events drive progress and the result is kept"""
+        release = threading.Event()
+
+        def pipeline(track_metadata, on_event):
+            on_event('fetch_started', {'total': len(track_metadata)})
+            on_event('track_tags', {'index': 0, 'tags': ['rock'], 'status': 'fetched'})
+            release.wait(5)
+            on_event('track_tags', {'index': 1, 'tags': [], 'status': 'fetched'})
+            on_event('track_tags', {'index': 2, 'tags': [], 'status': 'failed'})
+            return {'clusters': []}
+
+        manager = JobManager(max_workers=1)
+        job = manager.submit(pipeline, total=3, track_metadata=[{}, {}, {}])
+        time.sleep(0.05)
+        running = manager.get(job.id).to_dict()
+        self.assertEqual(running['status'], 'running')
+        self.assertEqual(running['progress']['tags_fetched'], 1)
+
+        release.set()
+        done = wait_for(job).to_dict()
+        self.assertEqual(done['status'], 'done')
+        self.assertEqual(done['progress']['tags_fetched'], 2)  # The failed lookup is not progress
+        self.assertEqual(done['result'], {'clusters': []})
+
+    def test_failures_are_reported(self):
+        """Test that a failing job records its error"""
+        def pipeline(on_event):
+            raise ValueError("LASTFM_API_KEY not found in environment variables")
+
+        manager = JobManager(max_workers=1)
+        job = wait_for(manager.submit(pipeline))
+        self.assertEqual(job.to_dict()['status'], 'failed')
+        self.assertIn('LASTFM_API_KEY', job.to_dict()['error'])
+
+    def test_retention_is_bounded(self):
+        """Test that old finished jobs are dropped and unfinished ones are never evicted"""
+        manager = JobManager(max_workers=1, max_jobs=2, retention_seconds=60)
+        first = wait_for(manager.submit(lambda on_event: {}))
+        second = wait_for(manager.submit(lambda on_event: {}))
+        third = manager.submit(lambda on_event: {})
+
+        self.assertIsNone(manager.get(first.id))
+        self.assertIsNotNone(manager.get(second.id))
+        wait_for(third)
+
+        release = threading.Event()
+        blocking = JobManager(max_workers=2, max_jobs=1)
+        blocking.submit(lambda on_event: release.wait(5))
+        with self.assertRaises(JobQueueFullError):
+            blocking.submit(lambda on_event: {})
+        release.set()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from unittest import mock
+import numpy as np
+from sklearn.datasets import make_blobs
+from .k_selection import select_n_clusters
+from .matching import match_tracks_to_clusters
+from .tag_cache import TagCache
+
+
+class TestKSelection(unittest.TestCase):
+    def test_sweep_finds_separated_clusters(self):
+        """Test that the sweep recovers the true number of blobs"""
+        X, _ = make_blobs(n_samples=90, centers=3, cluster_std=0.3, random_state=0)
+        result = select_n_clusters(X, k_min=2, k_max=8, n_jobs=2)
+
+        self.assertEqual(result['chosen_k'], 3)
+        self.assertEqual(len(np.unique(result['labels'])), 3)
+        self.assertIn(3, result['scores'])
+
+    def test_sweep_stops_on_plateau(self):
+        """Test early stopping once scores stop improving"""
+        X, _ = make_blobs(n_samples=60, centers=2, cluster_std=0.2, random_state=1)
+        result = select_n_clusters(X, k_min=2, k_max=10, n_jobs=1, patience=2)
+
+        self.assertTrue(result['stopped_early'])
+        self.assertEqual(sorted(result['scores']), [2, 3, 4])
+
+    def test_explicit_n_clusters_overrides_sweep(self):
+        """Test that a requested n_clusters skips the sweep"""
+        tracks = [{"name": f"Song {i}", "artist": "Artist"} for i in range(12)]
+        tags = [['rock'], ['pop'], ['jazz'], ['house']]
+
+        with mock.patch.dict('os.environ', {'LASTFM_API_KEY': 'key'}), \
+             mock.patch(f'{__package__}.matching.fetch_lastfm_tags',
+                        side_effect=lambda a, t, k: tags[int(t.split()[-1]) % 4]), \
+             mock.patch(f'{__package__}.matching.select_n_clusters') as sweep:
+            result = match_tracks_to_clusters([], tracks, n_clusters=4, requests_per_second=0,
+                                              tag_cache=TagCache(':memory:'))
+
+        sweep.assert_not_called()
+        self.assertEqual(result['k_selection'], {'chosen_k': 4, 'source': 'request'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from unittest import mock
+import requests
+from .lastfm_client import LastFMClient, LastFMError, CircuitOpenError, CircuitBreaker
+
+
+def make_response(status_code, payload=None, headers=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = payload if payload is not None else {}
+    return response
+
+
+TOP_TAGS = {'toptags': {'tag': [
+    {'name': 'rock', 'count': 100},
+    {'name': 'classic rock', 'count': 60},
+    {'name': 'seen live', 'count': 5}
+]}}
+
+
+class TestLastFMClient(unittest.TestCase):
+    def setUp(self):
+        self.client = LastFMClient('key', base_url='http://lastfm.test/', max_retries=2, backoff_base=0)
+        self.get = mock.patch.object(self.client.session, 'get').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_tags_are_thresholded(self):
+        """Test that low-weight tags are dropped"""
+        self.get.return_value = make_response(200, TOP_TAGS)
+        self.assertEqual(self.client.get_track_tags('Queen', 'Bohemian Rhapsody'), ['rock', 'classic rock'])
+        self.assertIsNotNone(self.get.call_args.kwargs['timeout'])
+
+    def test_tag_weights_are_relative_to_the_top_tag(self):
+        """Test that kept tags carry count / top count"""
+        self.get.return_value = make_response(200, TOP_TAGS)
+        self.assertEqual(self.client.get_track_tag_weights('Queen', 'Bohemian Rhapsody'),
+                         {'rock': 1.0, 'classic rock': 0.6})
+
+    def test_artist_tags_use_artist_method(self):
+        """Test that artist tags come from artist.getTopTags with the same threshold"""
+        self.get.return_value = make_response(200, TOP_TAGS)
+        self.assertEqual(self.client.get_artist_tags('Queen'), ['rock', 'classic rock'])
+        self.assertEqual(self.get.call_args.kwargs['params']['method'], 'artist.getTopTags')
+
+    def test_not_found_is_empty_not_an_error(self):
+        """Test that an unknown track returns [] instead of raising"""
+        self.get.return_value = make_response(200, {'error': 6, 'message': 'Track not found'})
+        self.assertEqual(self.client.get_track_tags('Nobody', 'Nothing'), [])
+
+    def test_retries_rate_limited_and_server_errors(self):
+        """Test that 429 and 5xx responses are retried before succeeding"""
+        self.get.side_effect = [make_response(429), make_response(503), make_response(200, TOP_TAGS)]
+        self.assertEqual(self.client.get_track_tags('Queen', 'Bohemian Rhapsody'), ['rock', 'classic rock'])
+        self.assertEqual(self.get.call_count, 3)
+
+    def test_exhausted_retries_raise(self):
+        """Test that a persistent outage surfaces as LastFMError"""
+        self.get.return_value = make_response(500)
+        with self.assertRaises(LastFMError):
+            self.client.get_track_tags('Queen', 'Bohemian Rhapsody')
+
+    def test_circuit_breaker_fails_fast(self):
+        """Test that an open breaker stops calling Last.fm"""
+        self.client.circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        self.get.side_effect = requests.ConnectionError("unreachable")
+        for _ in range(2):
+            with self.assertRaises(LastFMError):
+                self.client.get_track_tags('Queen', 'Bohemian Rhapsody')
+
+        with self.assertRaises(CircuitOpenError):
+            self.client.get_track_tags('Queen', 'Bohemian Rhapsody')
+        self.assertEqual(self.get.call_count, 2)
+        self.assertEqual(self.client.circuit_breaker.state, 'open')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import unittest
 import os
+import time
+import threading
+from unittest import mock
 import numpy as np
 from dotenv import load_dotenv
 from .matching import (
@@ -8,8 +11,18 @@ from .matching import (
     build_tag_vocabulary,
     get_base_genre,
     merge_similar_clusters,
-    match_tracks_to_clusters
+    match_tracks_to_clusters,
+    fetch_all_track_tags,
+    fetch_track_tags_with_status,
+    build_feature_matrix,
+    weight_tag_matrix,
+    reduce_tag_matrix
 )
+from .tag_fetching import PENDING, RateLimiter, SingleFlight, run_rate_limited
+from .lastfm_client import LastFMError
+from .tag_cache import TagCache
+from .metrics import sparse_davies_bouldin_score, sparse_calinski_harabasz_score, compute_cluster_metrics
+from sklearn.metrics import davies_bouldin_score, calinski_harabasz_score
 
 class TestMatchingAlgorithm(unittest.TestCase):
     @classmethod
@@ -161,6 +174,378 @@ class TestMatchingAlgorithm(unittest.TestCase):
         self.assertEqual(len(result_malformed['clusters']), 1)
         self.assertEqual(result_malformed['clusters'][0]['genre'], 'unclassified')
 
+class TestConcurrentTagFetching(unittest.TestCase):
+    def test_results_keep_track_order(self):
+        """Test that concurrent fetching returns tags in input order"""
+        tracks = [
+            {"name": "Slow", "artist": "A"},
+            {"name": "No Artist"},
+            {"name": "Fast", "artist": "B"},
+        ]
+
+        def fake_tags(artist, track, api_key):
+            if track == 'Slow':
+                time.sleep(0.05)
+            return [track.lower()]
+
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags', side_effect=fake_tags):
+            tags = fetch_all_track_tags(tracks, 'key', max_workers=3, requests_per_second=0,
+                                        cache=TagCache(':memory:'))
+
+        self.assertEqual(tags, [['slow'], [], ['fast']])
+
+    def test_failed_call_falls_back_to_empty_list(self):
+        """Test that one failing lookup does not fail the batch"""
+        def flaky(value):
+            if value == 2:
+                raise RuntimeError("boom")
+            return [value]
+
+        results = run_rate_limited(flaky, [(1,), (2,), (3,)], max_workers=2, requests_per_second=0)
+        self.assertEqual(results, [[1], [], [3]])
+
+    def test_single_flight_shares_in_flight_calls(self):
+        """Test that concurrent callers with the same key share one call"""
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def slow_lookup():
+            calls.append(1)
+            release.wait(1)
+            return ['rock']
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flights.do('key', slow_lookup)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True])
+        self.assertTrue(all(tags == ['rock'] for tags, _ in results))
+
+    def test_duplicate_tracks_share_one_lookup(self):
+        """Test that a repeated (artist, track) pair is fetched once"""
+        tracks = [{"name": "Song", "artist": "A"}, {"name": " song", "artist": "a"}, {"name": "Other", "artist": "A"}]
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags', return_value=['rock']) as fetch:
+            tags = fetch_all_track_tags(tracks, 'key', requests_per_second=0, cache=TagCache(':memory:'))
+
+        self.assertEqual(tags, [['rock'], ['rock'], ['rock']])
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_artist_fallback_fetches_each_artist_once(self):
+        """Test that untagged tracks get their artist's tags, one lookup per artist"""
+        tracks = [{"name": "Rare 1", "artist": "A"}, {"name": "Rare 2", "artist": "A"},
+                  {"name": "Known", "artist": "B"}]
+        track_tags = {'Rare 1': [], 'Rare 2': [], 'Known': ['jazz']}
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags',
+                        side_effect=lambda artist, track, key: track_tags[track]), \
+                mock.patch(f'{__package__}.matching.fetch_artist_tags', return_value=['folk']) as artist_fetch:
+            tags, failed = fetch_track_tags_with_status(tracks, 'key', requests_per_second=0,
+                                                        cache=TagCache(':memory:'), artist_fallback=True)
+
+        self.assertEqual(tags, [['folk'], ['folk'], ['jazz']])
+        self.assertEqual(failed, [])
+        artist_fetch.assert_called_once_with('A', 'key')
+
+    def test_rate_limiter_spaces_calls(self):
+        """Test that the limiter enforces the configured rate"""
+        limiter = RateLimiter(20)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+class TestSparseFeatures(unittest.TestCase):
+    def test_feature_matrix_matches_dense_vectors(self):
+        """Test that the CSR matrix equals the stacked per-track vectors"""
+        all_tags = [['Rock', 'rock', 'classic rock'], [], ['pop', 'unknown']]
+        vocabulary = {'rock': 0, 'classic rock': 1, 'pop': 2}
+
+        matrix = build_feature_matrix(all_tags, vocabulary)
+        dense = np.array([create_feature_vector(tags, vocabulary) for tags in all_tags])
+
+        self.assertEqual(matrix.format, 'csr')
+        self.assertEqual(matrix.nnz, 3)
+        np.testing.assert_array_equal(matrix.toarray(), dense)
+
+    def test_weighted_tags_keep_their_weights(self):
+        """Test that {tag: weight} input fills the matrix with the weights"""
+        matrix = build_feature_matrix([{'Rock': 1.0, 'indie': 0.4}, ['pop']], {'indie': 0, 'pop': 1, 'rock': 2})
+        np.testing.assert_array_equal(matrix.toarray(), [[0.4, 0, 1.0], [0, 1.0, 0]])
+
+    def test_vocabulary_pruning(self):
+        """Test min_df, max_features and stop tags"""
+        all_tags = [['rock', 'seen live', 'rare'], ['rock', 'indie'], ['rock', 'indie', 'seen live']]
+        self.assertEqual(build_tag_vocabulary(all_tags), {'indie': 0, 'rare': 1, 'rock': 2, 'seen live': 3})
+        self.assertEqual(build_tag_vocabulary(all_tags, min_df=2, stop_tags=['Seen Live']), {'indie': 0, 'rock': 1})
+        self.assertEqual(build_tag_vocabulary(all_tags, max_features=1), {'rock': 0})
+
+    def test_tfidf_and_svd_projection(self):
+        """Test that TF-IDF rows are unit length and SVD only runs on larger vocabularies"""
+        rng = np.random.RandomState(0)
+        from scipy import sparse
+        X = sparse.random(50, 30, density=0.2, format='csr', random_state=rng)
+        X.data[:] = rng.rand(X.nnz)
+        X = X[np.asarray(X.sum(axis=1)).ravel() > 0]
+
+        tfidf = weight_tag_matrix(X, 'tfidf')
+        np.testing.assert_allclose(np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel()), 1.0)
+        np.testing.assert_array_equal(weight_tag_matrix(X, 'binary').data, 1.0)
+        with self.assertRaises(ValueError):
+            weight_tag_matrix(X, 'bogus')
+
+        reduced, explained = reduce_tag_matrix(tfidf, n_components=5)
+        self.assertEqual(reduced.shape, (X.shape[0], 5))
+        self.assertTrue(0 < explained <= 1)
+        unchanged, explained = reduce_tag_matrix(tfidf, n_components=64)
+        self.assertIs(unchanged, tfidf)
+        self.assertIsNone(explained)
+
+    def test_sparse_metrics_match_sklearn(self):
+        """Test that sparse-friendly metrics agree with the dense sklearn versions"""
+        rng = np.random.RandomState(0)
+        X = (rng.rand(60, 25) > 0.8).astype(float)
+        labels = rng.randint(0, 4, size=60)
+
+        from scipy import sparse
+        X_sparse = sparse.csr_matrix(X)
+        self.assertAlmostEqual(sparse_davies_bouldin_score(X_sparse, labels), davies_bouldin_score(X, labels))
+        self.assertAlmostEqual(sparse_calinski_harabasz_score(X_sparse, labels), calinski_harabasz_score(X, labels))
+
+class TestMetricsPolicy(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X = (rng.rand(300, 20) > 0.7).astype(float)
+        self.labels = rng.randint(0, 3, size=300)
+
+    def test_none_skips_all_metrics(self):
+        """Test that metrics can be switched off"""
+        metrics = compute_cluster_metrics(self.X, self.labels, 3, mode='none')
+        self.assertIsNone(metrics['silhouette_score'])
+        self.assertIsNone(metrics['metrics_mode']['davies_bouldin'])
+
+    def test_sampled_mode_only_samples_silhouette(self):
+        """Test that sampled mode reports which numbers were sampled"""
+        metrics = compute_cluster_metrics(self.X, self.labels, 3, mode='sampled', sample_size=100, seed=1)
+        self.assertEqual(metrics['metrics_mode'], {
+            'silhouette_score': 'sampled',
+            'davies_bouldin': 'full',
+            'calinski_harabasz': 'full'
+        })
+        again = compute_cluster_metrics(self.X, self.labels, 3, mode='sampled', sample_size=100, seed=1)
+        self.assertEqual(metrics['silhouette_score'], again['silhouette_score'])
+
+    def test_auto_uses_full_metrics_for_small_inputs(self):
+        """Test that auto mode stays exact below the size threshold"""
+        metrics = compute_cluster_metrics(self.X, self.labels, 3)
+        self.assertEqual(metrics['metrics_mode']['silhouette_score'], 'full')
+
+class TestAudioFeatureModes(unittest.TestCase):
+    def setUp(self):
+        # Two obvious groups: quiet acoustic tracks and loud dance tracks
+        self.features = [[0.2, 0.1, 0.3, 80, 0.9]] * 4 + [[0.9, 0.9, 0.8, 128, 0.05]] * 4
+        self.tracks = [{"name": f"Song {i}", "artist": "Artist"} for i in range(8)]
+        self.cache = TagCache(':memory:')
+
+    def test_audio_mode_never_calls_lastfm(self):
+        """Test that audio mode clusters on the supplied features only"""
+        self.cache.set("Artist", "Song 0", ["folk"])
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags') as fetch:
+            result = match_tracks_to_clusters(self.features, self.tracks, feature_mode='audio',
+                                              n_clusters=2, tag_cache=self.cache)
+
+        fetch.assert_not_called()
+        self.assertEqual(result['feature_mode'], 'audio')
+        sizes = sorted(len(cluster['tracks']) for cluster in result['clusters'])
+        self.assertEqual(sizes, [4, 4])
+        self.assertIn('folk', [cluster['genre'] for cluster in result['clusters']])
+
+    def test_hybrid_mode_uses_local_tags(self):
+        """Test that hybrid mode mixes in tags that are already known"""
+        tracks = [dict(track, tags=['rock']) for track in self.tracks[:2]] + self.tracks[2:]
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags') as fetch:
+            result = match_tracks_to_clusters(self.features, tracks, feature_mode='hybrid',
+                                              n_clusters=2, tag_cache=self.cache)
+
+        fetch.assert_not_called()
+        self.assertEqual(result['feature_mode'], 'hybrid')
+        self.assertEqual(result['locally_tagged_tracks'], 2)
+
+    def test_mismatched_features_are_rejected(self):
+        """Test that audio features must line up with the tracks"""
+        with self.assertRaises(ValueError):
+            match_tracks_to_clusters(self.features[:3], self.tracks, feature_mode='audio',
+                                     tag_cache=self.cache)
+
+class TestClusterMergeEngine(unittest.TestCase):
+    @staticmethod
+    def make_cluster(cluster_id, genre, tags):
+        return {'id': cluster_id, 'genre': genre, 'tags': tags,
+                'tracks': [{'name': f'Track{cluster_id}', 'artist': 'Artist', 'tags': tags}]}
+
+    def test_merges_are_transitive_and_order_independent(self):
+        """Test that A~B and B~C end up in one cluster in any input order"""
+        clusters = [
+            self.make_cluster(0, 'rock', ['rock', 'classic rock']),
+            self.make_cluster(1, 'rock', ['grunge', 'hard rock']),
+            self.make_cluster(2, 'rock', ['rock', 'hard rock']),
+            self.make_cluster(3, 'pop', ['pop'])
+        ]
+
+        forward = merge_similar_clusters(clusters)
+        backward = merge_similar_clusters(list(reversed(clusters)))
+
+        for merged in (forward, backward):
+            self.assertEqual(len(merged), 2)
+            rock = next(cluster for cluster in merged if cluster['genre'] == 'rock')
+            self.assertEqual(len(rock['tracks']), 3)
+            self.assertEqual(rock['tags'], ['classic rock', 'grunge', 'hard rock', 'rock'])
+
+    def test_different_genres_never_merge(self):
+        """Test that identical tags across genres stay separate"""
+        clusters = [self.make_cluster(0, 'rock', ['guitar']), self.make_cluster(1, 'pop', ['guitar'])]
+        self.assertEqual(len(merge_similar_clusters(clusters)), 2)
+
+    def test_untagged_clusters_are_left_alone(self):
+        """Test that clusters without tags are kept as-is"""
+        clusters = [self.make_cluster(0, 'unclassified', []), self.make_cluster(1, 'unclassified', [])]
+        self.assertEqual(len(merge_similar_clusters(clusters)), 2)
+
+    def test_hundreds_of_clusters(self):
+        """Test that over-clustered input merges down by genre"""
+        genres = ['rock', 'pop', 'jazz']
+        clusters = [self.make_cluster(i, genres[i % 3], [genres[i % 3], f'tag{i % 7}']) for i in range(600)]
+        merged = merge_similar_clusters(clusters)
+        self.assertEqual(sorted(cluster['genre'] for cluster in merged), sorted(genres))
+        self.assertEqual(sum(len(cluster['tracks']) for cluster in merged), 600)
+
+class TestPipelineEvents(unittest.TestCase):
+    def test_events_arrive_in_pipeline_order(self):
+        """Test that tags, vocabulary, labels, clusters and metrics are reported in order"""
+        tracks = [{"name": str(i), "artist": "A"} for i in range(6)]
+        events = []
+
+        def fake_tags(artist, track, api_key):
+            return ['rock'] if int(track) % 2 else ['jazz']
+
+        with mock.patch.dict(os.environ, {'LASTFM_API_KEY': 'key'}), \
+                mock.patch(f'{__package__}.matching.fetch_lastfm_tags', side_effect=fake_tags):
+            result = match_tracks_to_clusters(
+                np.zeros((6, 1)), tracks, n_clusters=2, requests_per_second=0,
+                tag_cache=TagCache(':memory:'), on_event=lambda event, payload: events.append((event, payload))
+            )
+
+        names = [event for event, _ in events]
+        self.assertEqual(names[0], 'fetch_started')
+        self.assertEqual(names.count('track_tags'), 6)
+        self.assertEqual(names[7:], ['vocabulary', 'features', 'labels', 'clusters', 'metrics'])
+        payloads = dict(events)
+        self.assertEqual(payloads['vocabulary']['size'], 2)
+        self.assertEqual(len(payloads['labels']['labels']), 6)
+        self.assertEqual(payloads['clusters']['clusters'], result['clusters'])
+
+class TestDeadline(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def fake_tags(self, artist, track, api_key):
+        if track.startswith('Slow'):
+            self.release.wait(5)  # Holds its lookup past the deadline until the test releases it
+        return ['jazz'] if int(track.split()[-1]) % 2 else ['rock']
+
+    def cluster(self, tracks, cache, **options):
+        with mock.patch.dict(os.environ, {'LASTFM_API_KEY': 'key'}), \
+                mock.patch(f'{__package__}.matching.fetch_lastfm_tags', side_effect=self.fake_tags):
+            return match_tracks_to_clusters(
+                np.array([[i % 2, 1 - i % 2] for i in range(len(tracks))], dtype=float), tracks,
+                n_clusters=2, requests_per_second=0, tag_cache=cache, **options
+            )
+
+    def test_outstanding_lookups_go_to_pending_bucket(self):
+        """Test slow lookups are left out at the deadline and still land in the cache"""
+        tracks = [{"name": f"Song {i}", "artist": "A"} for i in range(6)] + [{"name": "Slow 7", "artist": "B"}]
+        cache = TagCache(':memory:')
+
+        started = time.monotonic()
+        result = self.cluster(tracks, cache, deadline_ms=200)
+        self.assertLess(time.monotonic() - started, 2)
+
+        self.assertEqual(result['deadline']['lookups_outstanding'], 1)
+        self.assertEqual(result['deadline']['pending_placement'], 'bucket')
+        pending = [cluster for cluster in result['clusters'] if cluster.get('pending')]
+        self.assertEqual(len(pending), 1)
+        self.assertEqual(pending[0]['track_indices'], [6])
+        self.assertTrue(pending[0]['tracks'][0]['tags_pending'])
+        self.assertEqual(sorted(i for c in result['clusters'] for i in c['track_indices']), list(range(7)))
+
+        self.release.set()
+        for _ in range(100):
+            if cache.get('B', 'Slow 7') is not None:
+                break
+            time.sleep(0.02)
+        self.assertEqual(cache.get('B', 'Slow 7'), ['jazz'])
+
+    def test_single_track_respects_deadline(self):
+        """Test a lone slow track is returned as pending at the deadline instead of holding the request"""
+        started = time.monotonic()
+        result = self.cluster([{"name": "Slow 1", "artist": "B"}], TagCache(':memory:'), deadline_ms=200)
+        self.assertLess(time.monotonic() - started, 2)
+
+        self.assertEqual(result['deadline']['lookups_outstanding'], 1)
+        self.assertEqual(len(result['clusters']), 1)
+        self.assertTrue(result['clusters'][0]['pending'])
+
+    def test_single_track_reports_failed_lookup(self):
+        """Test a lone track whose lookup failed is counted so its result is not cached"""
+        with mock.patch.dict(os.environ, {'LASTFM_API_KEY': 'key'}), \
+                mock.patch(f'{__package__}.matching.fetch_lastfm_tags', side_effect=LastFMError("down")):
+            result = match_tracks_to_clusters(None, [{"name": "Song 1", "artist": "A"}],
+                                              requests_per_second=0, tag_cache=TagCache(':memory:'))
+        self.assertEqual(result['tag_fetch_failures'], 1)
+        self.assertEqual(result['clusters'][0]['genre'], 'unclassified')
+
+    def test_audio_placement_joins_nearest_cluster(self):
+        """Test pending tracks can be placed by their audio features instead"""
+        tracks = [{"name": f"Song {i}", "artist": "A"} for i in range(6)] + [{"name": "Slow 7", "artist": "B"}]
+        result = self.cluster(tracks, TagCache(':memory:'), deadline_ms=200, pending_placement='audio')
+
+        self.assertEqual(result['deadline']['pending_placement'], 'audio')
+        self.assertFalse(any(cluster.get('pending') for cluster in result['clusters']))
+        home = next(cluster for cluster in result['clusters'] if 6 in cluster['track_indices'])
+        self.assertEqual(home['genre'], 'rock')  # Even rows share its audio features
+
+    def test_deadline_drops_queued_calls(self):
+        """Test a run past its deadline leaves the shared limiter free for the next one"""
+        calls = []
+
+        def lookup(i):
+            calls.append(i)
+            return [i]
+
+        done = []
+        for _ in range(3):
+            results = run_rate_limited(lookup, [(i,) for i in range(60)], max_workers=4,
+                                       requests_per_second=20, deadline=time.monotonic() + 0.3)
+            done.append(sum(result is not PENDING for result in results))
+        time.sleep(0.3)
+
+        self.assertTrue(all(count >= 2 for count in done), done)
+        self.assertLessEqual(len(calls), sum(done) + 3 * 4)  # Only in-flight calls outlive a deadline
+
+    def test_no_deadline_block_without_deadline(self):
+        """Test complete runs are unchanged when no deadline is given"""
+        tracks = [{"name": f"Song {i}", "artist": "A"} for i in range(4)]
+        result = self.cluster(tracks, TagCache(':memory:'))
+        self.assertNotIn('deadline', result)
+        self.assertFalse(any(cluster.get('pending') for cluster in result['clusters']))
+
 def run_tests():
     """Run the test suite"""
     print("\n=== Running Matching Algorithm Tests ===\n")
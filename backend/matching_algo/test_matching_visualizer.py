@@ -0,0 +1,73 @@
+import os
+import unittest
+from unittest import mock
+import numpy as np
+from .matching_visualizer import MatchingVisualizer, RenderCache, project_2d, TSNE_MAX_TRACKS
+from .tag_cache import TagCache
+
+TAGS = {'Rock': ['rock', 'hard rock'], 'Jazz': ['jazz', 'bebop']}
+
+
+class TestMatchingVisualizer(unittest.TestCase):
+    def setUp(self):
+        mock.patch.dict(os.environ, {'LASTFM_API_KEY': 'key'}).start()
+        self.addCleanup(mock.patch.stopall)
+        self.visualizer = MatchingVisualizer(requests_per_second=0)
+        self.visualizer.tag_cache = TagCache(':memory:')
+
+    def test_analysis_fetches_each_track_once(self):
+        """Test one fetch per track feeds the labels, genres and tag vectors"""
+        tracks = [{"name": f"{genre} {i}", "artist": "Artist"} for genre in TAGS for i in range(3)]
+
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags',
+                        side_effect=lambda artist, track, key: TAGS[track.split()[0]]) as fetch:
+            analysis = self.visualizer.analyze(tracks, n_clusters=2)
+            features, all_track_tags, vocabulary = self.visualizer.prepare_data(analysis)
+
+        self.assertEqual(fetch.call_count, len(tracks))
+        self.assertEqual(all_track_tags[0], ['rock', 'hard rock'])
+        self.assertEqual(features.shape, (len(tracks), len(vocabulary)))
+        self.assertEqual(analysis['genres'], ['rock'] * 3 + ['jazz'] * 3)
+        self.assertEqual(len(set(analysis['labels'][:3])), 1)
+        self.assertNotEqual(analysis['labels'][0], analysis['labels'][3])
+        self.assertNotIn('tags', tracks[0])  # The caller's track dicts are left alone
+
+    def test_render_is_cached_by_content(self):
+        """Test repeat renders are served from the cache without refetching"""
+        tracks = [{"name": f"{genre} {i}", "artist": "Artist"} for genre in TAGS for i in range(3)]
+        cache = RenderCache(max_entries=2)
+
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags',
+                        side_effect=lambda artist, track, key: TAGS[track.split()[0]]) as fetch, \
+             mock.patch.object(self.visualizer, 'analyze', wraps=self.visualizer.analyze) as analyze:
+            first = self.visualizer.render(tracks, cache=cache, n_clusters=2)
+            second = self.visualizer.render(tracks, cache=cache, n_clusters=2)
+            svg = self.visualizer.render(tracks, plots=['tags'], image_format='svg', cache=cache, n_clusters=2)
+
+        self.assertEqual(analyze.call_count, 2)  # The SVG render is a different key
+        self.assertEqual(fetch.call_count, len(tracks))  # Its tags come from the tag cache
+        self.assertEqual(first, second)
+        self.assertTrue(first['clusters'].startswith(b'\x89PNG'))
+        self.assertIn(b'<svg', svg['tags'])
+        self.assertEqual(len(cache), 2)  # LRU bound evicted the oldest image
+        self.assertEqual(cache.hits, 2)
+
+    def test_failed_lookups_are_not_cached(self):
+        """Test a render made while Last.fm was failing is redone next time"""
+        tracks = [{"name": f"{genre} {i}", "artist": "Artist"} for genre in TAGS for i in range(3)]
+        cache = RenderCache()
+
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags', side_effect=RuntimeError("outage")):
+            self.visualizer.render(tracks, plots=['tags'], cache=cache, n_clusters=2)
+        self.assertEqual(len(cache), 0)
+
+    def test_large_inputs_fall_back_to_pca(self):
+        """Test t-SNE is only used up to TSNE_MAX_TRACKS"""
+        features = np.random.RandomState(0).rand(TSNE_MAX_TRACKS + 1, 3)
+        reduced, title = project_2d(features, 'tsne')
+        self.assertEqual(reduced.shape, (TSNE_MAX_TRACKS + 1, 2))
+        self.assertIn('PCA', title)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import tempfile
+import unittest
+from unittest import mock
+from .playlist_model import PlaylistModelStore, update_playlist_clusters
+from .tag_cache import TagCache
+
+TAGS = {'Rock': ['rock', 'classic rock'], 'Jazz': ['jazz', 'bebop'], 'Noise': ['noise', 'harsh noise']}
+
+
+def fake_tags(artist, track, api_key):
+    return TAGS[track.split()[0]]
+
+
+def make_tracks(names):
+    return [{"name": name, "artist": "Artist"} for name in names]
+
+
+class TestIncrementalClustering(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = PlaylistModelStore(self.tmp.name)
+        self.cache = TagCache(':memory:')
+        patches = [
+            mock.patch.dict('os.environ', {'LASTFM_API_KEY': 'key', 'LASTFM_REQUESTS_PER_SECOND': '0'}),
+            mock.patch(f'{__package__}.matching.fetch_lastfm_tags', side_effect=fake_tags)
+        ]
+        self.fetch = [p.start() for p in patches][1]
+        self.addCleanup(mock.patch.stopall)
+
+    def cluster(self, tracks, **kwargs):
+        return update_playlist_clusters('playlist-1', [], tracks, store=self.store,
+                                        tag_cache=self.cache, n_clusters=2,
+                                        requests_per_second=0, **kwargs)
+
+    def test_new_tracks_join_existing_clusters(self):
+        """Test that a small change is assigned without refitting"""
+        base = make_tracks([f"Rock {i}" for i in range(5)] + [f"Jazz {i}" for i in range(5)])
+        first = self.cluster(base)
+        self.assertTrue(first['incremental']['refit'])
+        self.fetch.reset_mock()
+
+        second = self.cluster(base + make_tracks(["Rock new", "Jazz new"]), drift_threshold=0.5)
+
+        self.assertFalse(second['incremental']['refit'])
+        self.assertEqual(second['incremental']['new_tracks'], 2)
+        self.assertEqual(self.fetch.call_count, 2)  # Only the new tracks were looked up
+        by_genre = {cluster['genre']: [t['name'] for t in cluster['tracks']] for cluster in second['clusters']}
+        self.assertIn("Rock new", by_genre['rock'])
+        self.assertIn("Jazz new", by_genre['jazz'])
+
+    def test_drift_triggers_refit(self):
+        """Test that unfamiliar tracks past the threshold cause a full refit"""
+        base = make_tracks([f"Rock {i}" for i in range(4)] + [f"Jazz {i}" for i in range(4)])
+        self.cluster(base)
+
+        result = self.cluster(base + make_tracks([f"Noise {i}" for i in range(4)]))
+
+        self.assertTrue(result['incremental']['refit'])
+        self.assertEqual(result['incremental']['reason'], 'drift')
+        self.assertGreater(result['incremental']['drift']['unknown_tag_rate'], 0.25)
+
+    def test_failed_new_tracks_are_refetched(self):
+        """Test that a new track whose lookup failed is not stored and is fetched on the next call"""
+        base = make_tracks([f"Rock {i}" for i in range(5)] + [f"Jazz {i}" for i in range(5)])
+        self.cluster(base)
+        self.fetch.side_effect = RuntimeError("Last.fm unavailable")
+
+        second = self.cluster(base + make_tracks(["Rock new"]), drift_threshold=0.5)
+
+        self.assertEqual(second['tag_fetch_failures'], 1)
+        self.assertIn("Rock new", [t['name'] for c in second['clusters'] for t in c['tracks']])
+        model = self.store.load('playlist-1')
+        self.assertEqual(len(model.tracks), 10)
+        self.assertEqual(model.drift['added'], 0)
+
+        self.fetch.reset_mock(side_effect=True)
+        self.fetch.side_effect = fake_tags
+        third = self.cluster(base + make_tracks(["Rock new"]), drift_threshold=0.5)
+
+        self.assertEqual(third['incremental']['new_tracks'], 1)
+        self.assertEqual(self.fetch.call_count, 1)
+        by_genre = {cluster['genre']: [t['name'] for t in cluster['tracks']] for cluster in third['clusters']}
+        self.assertIn("Rock new", by_genre['rock'])
+
+    def test_failed_tracks_are_not_stored_by_a_refit(self):
+        """Test a track whose lookup failed during a full fit is fetched again on the next call"""
+        tracks = make_tracks([f"Rock {i}" for i in range(5)] + [f"Jazz {i}" for i in range(5)])
+
+        def flaky(artist, track, api_key):
+            if track == "Rock 0":
+                raise RuntimeError("Last.fm unavailable")
+            return fake_tags(artist, track, api_key)
+
+        self.fetch.side_effect = flaky
+        first = self.cluster(tracks)
+        self.assertEqual(first['tag_fetch_failures'], 1)
+        self.assertEqual(len(self.store.load('playlist-1').tracks), 9)
+
+        self.fetch.reset_mock(side_effect=True)
+        self.fetch.side_effect = fake_tags
+        second = self.cluster(tracks, drift_threshold=0.5)
+
+        self.assertFalse(second['incremental']['refit'])
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertEqual(self.store.load('playlist-1').tracks['artist\x1frock 0']['tags'], TAGS['Rock'])
+
+
+if __name__ == '__main__':
+    unittest.main()
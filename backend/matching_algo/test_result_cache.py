@@ -0,0 +1,84 @@
+import tempfile
+import unittest
+from unittest import mock
+from .result_cache import ResultCache, playlist_fingerprint, rebind_tracks
+
+TRACKS = [{"name": "Song A", "artist": "Artist"}, {"name": "Song B", "artist": "Artist"}]
+
+
+def make_result(tracks, tags=('rock',)):
+    return {
+        'clusters': [{
+            'id': 0, 'genre': 'rock', 'tags': list(tags),
+            'tracks': [dict(track, tags=list(tags)) for track in tracks],
+            'track_indices': list(range(len(tracks)))
+        }],
+        'silhouette_score': None
+    }
+
+
+class TestResultCache(unittest.TestCase):
+    def test_fingerprint_covers_order_and_parameters(self):
+        """Test the fingerprint changes with track order and result-shaping options only"""
+        key = playlist_fingerprint(TRACKS, n_clusters=2, max_workers=4)
+        self.assertEqual(key, playlist_fingerprint([dict(t, extra=1) for t in TRACKS], n_clusters=2))
+        self.assertNotEqual(key, playlist_fingerprint(TRACKS[::-1], n_clusters=2))
+        self.assertNotEqual(key, playlist_fingerprint(TRACKS, n_clusters=3))
+        self.assertNotEqual(playlist_fingerprint(TRACKS, features=[[0.1], [0.2]]),
+                            playlist_fingerprint(TRACKS, features=[[0.1], [0.3]]))
+
+    def test_lru_byte_budget_and_hit_rate(self):
+        """Test entries are evicted oldest-first once the byte budget is exceeded"""
+        probe = ResultCache()
+        probe.set('probe', make_result(TRACKS))
+        size = probe.bytes
+
+        cache = ResultCache(max_bytes=size * 2)
+        cache.set('a', make_result(TRACKS))
+        cache.set('b', make_result(TRACKS))
+        self.assertIsNotNone(cache.get('a'))  # 'a' becomes most recently used
+        cache.set('c', make_result(TRACKS))
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a')['clusters'][0]['genre'], 'rock')
+        self.assertLessEqual(cache.bytes, cache.max_bytes)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (2, 1, 2))
+        self.assertAlmostEqual(stats['hit_rate'], 2 / 3)
+
+    def test_request_fields_are_not_cached(self):
+        """Test a deadline run's deadline block is not served to later requests"""
+        cache = ResultCache()
+        result = make_result(TRACKS)
+        result['deadline'] = {'deadline_ms': 200, 'lookups_outstanding': 0}
+        cache.set('a', result)
+        self.assertNotIn('deadline', cache.get('a'))
+        self.assertIn('deadline', result)  # The caller's result is left alone
+
+    def test_entries_expire(self):
+        """Test results older than the TTL are misses"""
+        cache = ResultCache(ttl_seconds=10)
+        with mock.patch('time.time', return_value=1000.0):
+            cache.set('a', make_result(TRACKS))
+        with mock.patch('time.time', return_value=1011.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_disk_persistence_survives_restart(self):
+        """Test a new cache over the same directory serves earlier results"""
+        with tempfile.TemporaryDirectory() as directory:
+            ResultCache(directory=directory).set('a', make_result(TRACKS))
+            restarted = ResultCache(directory=directory)
+            self.assertEqual(restarted.get('a')['clusters'][0]['track_indices'], [0, 1])
+            self.assertEqual(restarted.stats()['entries'], 1)
+
+    def test_rebind_uses_request_tracks(self):
+        """Test cached clusters carry this request's track dicts with the cached tags"""
+        tracks = [dict(track, uri=f"spotify:{i}") for i, track in enumerate(TRACKS)]
+        result = rebind_tracks(make_result(TRACKS, tags=('jazz',)), tracks)
+        self.assertEqual(result['clusters'][0]['tracks'][1], dict(tracks[1], tags=['jazz']))
+        self.assertNotIn('tags', tracks[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
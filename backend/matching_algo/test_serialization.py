@@ -0,0 +1,51 @@
+import json
+import unittest
+import numpy as np
+from .matching import merge_similar_clusters
+from .serialization import compact_result, encode_result
+
+
+class TestCompactFormat(unittest.TestCase):
+    def setUp(self):
+        tracks = [
+            {"name": "A", "artist": "X", "tags": ['rock', 'indie']},
+            {"name": "B", "artist": "Y", "tags": ['jazz']},
+            {"name": "C", "artist": "Z", "tags": ['rock']}
+        ]
+        self.result = {
+            'clusters': [
+                {'id': 0, 'genre': 'rock', 'tags': ['indie', 'rock'],
+                 'tracks': [tracks[0], tracks[2]], 'track_indices': [0, 2]},
+                {'id': 1, 'genre': 'jazz', 'tags': ['jazz'], 'tracks': [tracks[1]], 'track_indices': [1]}
+            ],
+            'silhouette_score': np.float64(0.5)
+        }
+
+    def test_tracks_are_referenced_by_index(self):
+        """Test that tags are interned once and clusters point at input positions"""
+        compact = compact_result(self.result)
+        tags = compact['tags']
+        self.assertEqual(len(tags), len(set(tags)))
+        self.assertEqual([[tags[i] for i in ids] for ids in compact['track_tags']],
+                         [['rock', 'indie'], ['jazz'], ['rock']])
+        self.assertEqual(compact['clusters'][0]['track_indices'], [0, 2])
+        self.assertNotIn('tracks', compact['clusters'][0])
+        self.assertEqual(compact['silhouette_score'], 0.5)
+
+    def test_merge_keeps_track_indices(self):
+        """Test that merged clusters concatenate their members' track indices"""
+        merged = merge_similar_clusters([
+            {'id': 0, 'genre': 'rock', 'tags': ['rock'], 'tracks': [{'tags': ['rock']}], 'track_indices': [3]},
+            {'id': 1, 'genre': 'rock', 'tags': ['rock'], 'tracks': [{'tags': ['rock']}], 'track_indices': [1]}
+        ])
+        self.assertEqual(merged[0]['track_indices'], [3, 1])
+
+    def test_encoded_json_handles_numpy(self):
+        """Test that the default encoder emits plain JSON for numpy values"""
+        body, mimetype = encode_result(compact_result(self.result))
+        self.assertEqual(mimetype, 'application/json')
+        self.assertEqual(json.loads(body)['silhouette_score'], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from unittest import mock
+from .streaming import iter_chunks, hash_tag_matrix, match_library_streaming
+from .tag_cache import TagCache
+
+GENRE_TAGS = [['rock', 'classic rock'], ['pop', 'synth pop'], ['jazz', 'bebop']]
+
+
+def fake_tags(artist, track, api_key):
+    return GENRE_TAGS[int(track.split()[-1]) % 3]
+
+
+class TestStreamingClustering(unittest.TestCase):
+    def test_iter_chunks(self):
+        """Test that chunking covers every track once"""
+        chunks = list(iter_chunks(range(7), 3))
+        self.assertEqual(chunks, [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_hashed_matrix_is_binary(self):
+        """Test that hashed vectors ignore case and duplicates"""
+        matrix = hash_tag_matrix([['Rock', 'rock'], []], n_features=16)
+        self.assertEqual(matrix.shape, (2, 16))
+        self.assertEqual(matrix.sum(), 1.0)
+
+    def test_library_is_clustered_in_two_passes(self):
+        """Test streaming clustering returns the regular result shape"""
+        tracks = [{"name": f"Song {i}", "artist": "Artist"} for i in range(60)]
+        cache = TagCache(':memory:')
+
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags', side_effect=fake_tags) as fetch:
+            result = match_library_streaming(
+                lambda: iter_chunks(tracks, 16), n_clusters=3, api_key='key',
+                requests_per_second=0, tag_cache=cache
+            )
+
+        # Second pass is served from the cache
+        self.assertEqual(fetch.call_count, 60)
+        self.assertEqual(result['n_tracks'], 60)
+        self.assertEqual(sum(len(c['tracks']) for c in result['clusters']), 60)
+        self.assertEqual(sorted(c['genre'] for c in result['clusters']), ['jazz', 'pop', 'rock'])
+        self.assertIsNotNone(result['silhouette_score'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+from .tag_cache import TagCache
+from .lastfm_client import LastFMError
+from .matching import fetch_all_track_tags, get_cached_lastfm_tags
+
+
+class TestTagCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = TagCache(':memory:', ttl_seconds=60, negative_ttl_seconds=10, max_entries=3,
+                              touch_interval_seconds=0)
+
+    def test_hits_use_normalized_keys(self):
+        """Test that lookups ignore case and extra whitespace"""
+        self.cache.set("Queen", "Bohemian Rhapsody", ["rock"])
+
+        self.assertEqual(self.cache.get("  queen ", "bohemian   rhapsody"), ["rock"])
+        self.assertIsNone(self.cache.get("Queen", "Another One Bites the Dust"))
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_weights_round_trip(self):
+        """Test that weighted entries keep their weights and plain lists weigh 1.0"""
+        self.cache.set("A", "Weighted", {"rock": 1.0, "indie": 0.5})
+        self.cache.set("A", "Plain", ["pop"])
+
+        self.assertEqual(self.cache.get("A", "Weighted"), ["rock", "indie"])
+        self.assertEqual(self.cache.get_weights("A", "Weighted"), {"rock": 1.0, "indie": 0.5})
+        self.assertEqual(self.cache.get_weights("A", "Plain"), {"pop": 1.0})
+
+    def test_negative_entries_expire_sooner(self):
+        """Test that empty tag lists are cached with the shorter TTL"""
+        with mock.patch('time.time', return_value=1000.0):
+            self.cache.set("A", "Tagged", ["pop"])
+            self.cache.set("A", "Untagged", [])
+        with mock.patch('time.time', return_value=1030.0):
+            self.assertEqual(self.cache.get("A", "Tagged"), ["pop"])
+            self.assertIsNone(self.cache.get("A", "Untagged"))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """Test size-bounded eviction"""
+        for i, now in enumerate([1.0, 2.0, 3.0]):
+            with mock.patch('time.time', return_value=now):
+                self.cache.set("A", f"Track {i}", ["rock"])
+        with mock.patch('time.time', return_value=4.0):
+            self.cache.get("A", "Track 0")
+        with mock.patch('time.time', return_value=5.0):
+            self.cache.set("A", "Track 3", ["rock"])
+
+        self.assertEqual(self.cache.stats()['size'], 3)
+        with mock.patch('time.time', return_value=6.0):
+            self.assertIsNone(self.cache.get("A", "Track 1"))
+            self.assertIsNotNone(self.cache.get("A", "Track 0"))
+
+    def test_hits_only_touch_stale_access_times(self):
+        """Test that a hit rewrites last_access only once it is older than the touch interval"""
+        cache = TagCache(':memory:', ttl_seconds=600, touch_interval_seconds=60)
+
+        def last_access():
+            return cache._conn.execute("SELECT last_access FROM track_tags").fetchone()[0]
+
+        with mock.patch('time.time', return_value=1000.0):
+            cache.set("A", "B", ["rock"])
+        with mock.patch('time.time', return_value=1030.0):
+            cache.get("A", "B")
+        self.assertEqual(last_access(), 1000.0)
+        with mock.patch('time.time', return_value=1100.0):
+            cache.get("A", "B")
+        self.assertEqual(last_access(), 1100.0)
+
+    def test_failed_fetches_are_not_cached(self):
+        """Test that only successful lookups, including empty ones, are stored"""
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags', side_effect=LastFMError("down")):
+            self.assertEqual(get_cached_lastfm_tags("A", "B", "key", self.cache), [])
+        self.assertIsNone(self.cache.get("A", "B"))
+
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags', return_value=[]):
+            get_cached_lastfm_tags("A", "B", "key", self.cache)
+        self.assertEqual(self.cache.get("A", "B"), [])
+
+    def test_batch_fetch_skips_cached_tracks(self):
+        """Test that cached tracks never reach Last.fm"""
+        self.cache.set("A", "Cached", ["jazz"])
+        tracks = [{"name": "Cached", "artist": "A"}, {"name": "New", "artist": "A"}]
+
+        with mock.patch(f'{__package__}.matching.fetch_lastfm_tags', return_value=["rock"]) as fetch:
+            tags = fetch_all_track_tags(tracks, "key", requests_per_second=0, cache=self.cache)
+
+        self.assertEqual(tags, [["jazz"], ["rock"]])
+        fetch.assert_called_once_with("A", "New", "key")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from .matching import cluster_tagged_tracks
+from .tag_cache import TagCache
+from .tag_embedding import TagEmbedding, build_tag_embedding, normalize_tag
+
+ROCK = ['rock', 'hard rock', 'guitar', 'classic rock']
+JAZZ = ['jazz', 'bebop', 'saxophone', 'smooth jazz']
+HIPHOP = ['Hip-Hop', 'rap', 'hiphop', 'hip hop']
+
+
+def corpus(n_per_genre=20):
+    """Tracks that each carry three of their genre's four tags"""
+    tracks = []
+    for genre in (ROCK, JAZZ, HIPHOP):
+        for i in range(n_per_genre):
+            tracks.append([tag for j, tag in enumerate(genre) if j != i % len(genre)])
+    return tracks
+
+
+class TestTagEmbedding(unittest.TestCase):
+    def test_normalize_folds_spelling_variants(self):
+        """Test hyphen, space and case variants share one key"""
+        self.assertEqual({normalize_tag(tag) for tag in HIPHOP if tag != 'rap'}, {'hiphop'})
+        self.assertEqual(normalize_tag('R&B'), 'r&b')
+
+    def test_cooccurring_tags_are_close(self):
+        """Test tags used together end up closer than tags from other genres"""
+        embedding = build_tag_embedding(corpus(), dimensions=8, min_count=2)
+        self.assertNotIn('Hip-Hop', embedding.index)
+        self.assertIn('hiphop', embedding.index)
+
+        def similarity(a, b):
+            return float(embedding.vector(a) @ embedding.vector(b))
+
+        self.assertGreater(similarity('rock', 'guitar'), similarity('rock', 'bebop'))
+        self.assertGreater(similarity('jazz', 'saxophone'), similarity('jazz', 'rap'))
+
+    def test_stop_tags_are_dropped(self):
+        """Test stop tags are neither embedded nor averaged into track vectors, after normalization"""
+        embedding = build_tag_embedding([tags + ['seen live'] for tags in corpus()], dimensions=4, min_count=2)
+        self.assertNotIn('seenlive', embedding.index)
+
+        with_stop = TagEmbedding(['rock', 'seenlive'], np.eye(2))
+        vectors = with_stop.embed_tracks([['rock', 'Seen-Live'], ['seen live']], stop_tags=None)
+        np.testing.assert_allclose(vectors[0], [1.0, 0.0])
+        self.assertFalse(np.any(vectors[1]))
+        self.assertTrue(np.any(with_stop.embed_tracks([['seen live']], stop_tags=())))
+
+    def test_builds_from_tag_cache_and_round_trips(self):
+        """Test the artifact built from cached tags loads back with its version"""
+        cache = TagCache(':memory:')
+        for i, tags in enumerate(corpus()):
+            cache.set('Artist', f"Track {i}", {tag: 1.0 for tag in tags})
+        cache.set('Artist', 'Untagged', [])
+        embedding = build_tag_embedding(cache.iter_tag_weights(), dimensions=4, min_count=2)
+        self.assertEqual(embedding.metadata['n_tracks'], len(corpus()))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'embedding.npz')
+            embedding.save(path)
+            loaded = TagEmbedding.load(path)
+        self.assertEqual(loaded.version, embedding.version)
+        self.assertEqual(loaded.tags, embedding.tags)
+        np.testing.assert_allclose(loaded.vectors, embedding.vectors)
+
+    def test_clustering_in_embedding_space(self):
+        """Test tracks become fixed-size averages and 'auto' falls back on low coverage"""
+        embedding = build_tag_embedding(corpus(), dimensions=4, min_count=2)
+        tracks = [{"name": f"Song {i}", "artist": "Artist"} for i in range(6)]
+        tags = [ROCK[:2]] * 3 + [JAZZ[:2]] * 3
+
+        result = cluster_tagged_tracks(tracks, tags, tag_space='embedding', tag_embedding=embedding,
+                                       n_clusters=2)
+        self.assertEqual(result['vectorizer']['space'], 'embedding')
+        self.assertEqual(result['vectorizer']['dimensions'], 4)
+        self.assertEqual(sorted(c['genre'] for c in result['clusters']), ['jazz', 'rock'])
+
+        unknown = [['polka'], ['yodel'], ['polka'], ['yodel'], ['rock'], ['jazz']]
+        result = cluster_tagged_tracks(tracks, unknown, tag_space='auto', tag_embedding=embedding,
+                                       n_clusters=2)
+        self.assertEqual(result['vectorizer']['space'], 'vocabulary')
+
+
+if __name__ == '__main__':
+    unittest.main()
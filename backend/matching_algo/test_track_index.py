@@ -0,0 +1,103 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+import numpy as np
+from .tag_cache import TagCache
+from .track_index import TrackIndex, TrackIndexStore, lookup_track_vector, track_vectors
+
+RESULT = {
+    'clusters': [
+        {'id': 0, 'genre': 'rock', 'tags': ['rock'], 'track_indices': [0, 1],
+         'tracks': [{'name': 'Riff', 'artist': 'A', 'tags': ['rock', 'guitar']},
+                    {'name': 'Solo', 'artist': 'B', 'tags': ['rock', 'hard rock']}]},
+        {'id': 1, 'genre': 'jazz', 'tags': ['jazz'], 'track_indices': [2, 3],
+         'tracks': [{'name': 'Swing', 'artist': 'C', 'tags': ['jazz', 'swing']},
+                    {'name': 'Blue', 'artist': 'D', 'tags': ['jazz', 'bebop']}]}
+    ]
+}
+
+
+def new_index():
+    index = TrackIndex('hashed-test', track_vectors([[]]).shape[1], capacity=1)
+    index.add_clustering_result(RESULT)
+    return index
+
+
+class TestTrackIndex(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch(f'{__package__}.track_index.TAG_EMBEDDING', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_similar_tracks_and_incremental_insert(self):
+        """Test neighbours come back best-first and inserts grow the index"""
+        index = new_index()
+        self.assertEqual(len(index), 4)
+
+        neighbours = index.query(index.vector_for({'name': 'Riff', 'artist': 'A'}), k=2,
+                                 exclude={'name': 'Riff', 'artist': 'A'})
+        self.assertEqual(neighbours[0]['track'], {'name': 'Solo', 'artist': 'B'})
+        self.assertEqual(neighbours[0]['cluster'], 0)
+
+        index.add({'name': 'Ballad', 'artist': 'E'}, track_vectors([['rock', 'guitar']])[0])
+        index.add({'name': 'Ballad', 'artist': 'E'}, track_vectors([['jazz', 'swing']])[0])  # Upsert
+        self.assertEqual(len(index), 5)
+        top = index.query(track_vectors([['jazz', 'swing']])[0], k=1)[0]
+        self.assertIn(top['track']['name'], ('Ballad', 'Swing'))
+        self.assertAlmostEqual(top['score'], 1.0, places=5)
+
+    def test_assign_uses_cluster_centroids(self):
+        """Test a new track joins the cluster whose tags it shares"""
+        index = new_index()
+        assignment = index.assign(track_vectors([['jazz', 'bebop', 'piano']])[0])
+        self.assertEqual((assignment['cluster'], assignment['genre']), (1, 'jazz'))
+        self.assertIsNone(index.assign(track_vectors([[]])[0]))
+
+    def test_query_is_sub_millisecond(self):
+        """Test a single query over 10k tracks is one cheap matrix-vector product"""
+        rng = np.random.RandomState(0)
+        index = TrackIndex('hashed-test', 64)
+        vectors = rng.rand(10_000, 64).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        for i, vector in enumerate(vectors):
+            index.add({'name': f"Track {i}", 'artist': 'A'}, vector, i % 8)
+        index.assign(vectors[0])  # Builds the centroids once
+
+        started = time.perf_counter()
+        for _ in range(100):
+            index.query(vectors[0], k=10)
+            index.assign(vectors[0])
+        self.assertLess((time.perf_counter() - started) / 100, 0.005)  # Generous for slow CI machines
+
+    def test_store_persists_and_tags_fill_unknown_tracks(self):
+        """Test indexes survive a reload and unindexed tracks are vectorized from their tags"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = TrackIndexStore(directory)
+            store.get('library', create=True).add_clustering_result(RESULT)
+            store.save('library')
+
+            index = TrackIndexStore(directory).get('library')
+            self.assertEqual(len(index), 4)
+            self.assertEqual(index.cluster_genres, {0: 'rock', 1: 'jazz'})
+
+        vector, source = lookup_track_vector(index, {'name': 'Blue', 'artist': 'D'})
+        self.assertEqual(source, 'index')
+        with mock.patch.dict(os.environ, {'LASTFM_API_KEY': 'key'}), \
+             mock.patch(f'{__package__}.matching.fetch_lastfm_tags', return_value=['rock', 'guitar']) as fetch:
+            vector, source = lookup_track_vector(index, {'name': 'New', 'artist': 'F'}, TagCache(':memory:'))
+        self.assertEqual((source, fetch.call_count), ('tags', 1))
+        self.assertEqual(index.assign(vector)['genre'], 'rock')
+
+    def test_looked_up_vectors_match_indexed_ones(self):
+        """Test a track looked up by its tags gets the same vector as when it was indexed"""
+        index = new_index()
+        with mock.patch.dict(os.environ, {'LASTFM_API_KEY': 'key'}), \
+             mock.patch(f'{__package__}.matching.fetch_lastfm_tags', return_value={'rock': 100, 'guitar': 5}):
+            vector, _ = lookup_track_vector(index, {'name': 'Riff again', 'artist': 'A'}, TagCache(':memory:'))
+        np.testing.assert_allclose(vector, index.vector_for({'name': 'Riff', 'artist': 'A'}), atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
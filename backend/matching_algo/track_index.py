@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+from sklearn.feature_extraction import FeatureHasher
+
+from .files import atomic_write
+from .matching import fetch_cached_lastfm_tags, get_lastfm_api_key
+from .tag_cache import TagCache, normalize_track_key
+from .tag_embedding import TAG_EMBEDDING, TagEmbedding, normalize_tag
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "track_indexes")
+# Tags are hashed into this many dimensions when no tag embedding is loaded
+HASHED_DIMENSIONS = 256
+DEFAULT_NEIGHBOURS = 10
+
+
+def vector_space(embedding: Optional[TagEmbedding] = None) -> str:
+    """Name of the space track vectors are built in; indexes only compare vectors from one space"""
+    embedding = embedding or TAG_EMBEDDING
+    if embedding is None:
+        return f"hashed-{HASHED_DIMENSIONS}"
+    return f"embedding-{embedding.version}"
+
+
+def track_vectors(all_track_tags: List[Any], embedding: Optional[TagEmbedding] = None) -> np.ndarray:
+    """Unit-length vectors for tracks, in the tag embedding or hashed from tag names"""
+    embedding = embedding or TAG_EMBEDDING
+    if embedding is not None:
+        return embedding.embed_tracks(all_track_tags)
+    hasher = FeatureHasher(n_features=HASHED_DIMENSIONS, input_type='dict', alternate_sign=False)
+    X = hasher.transform(
+        {normalize_tag(tag): float(weight) for tag, weight in
+         (tags.items() if isinstance(tags, Mapping) else ((tag, 1.0) for tag in tags))}
+        for tags in all_track_tags
+    ).toarray().astype(np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return np.divide(X, norms, out=np.zeros_like(X), where=norms > 0)
+
+
+class TrackIndex:
+    """Brute-force cosine index over unit-length track vectors.
+
+    Rows live in a preallocated array that doubles when full, so inserts are
+    amortized O(1); a query is one matrix-vector product. Each track may
+    carry the cluster it was assigned to, and per-cluster centroids answer
+    assign() without touching the tracks.
+    """
+
+    def __init__(self, space: str, dimensions: int, capacity: int = 64):
+        self.space = space
+        self.dimensions = dimensions
+        self.keys: List[str] = []
+        self.tracks: List[Dict[str, Any]] = []
+        self.clusters: List[Optional[int]] = []
+        self.cluster_genres: Dict[int, str] = {}
+        self._rows: Dict[str, int] = {}
+        self._vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        self._centroids: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:len(self.keys)]
+
+    def add(self, track: Dict[str, Any], vector: np.ndarray, cluster: Optional[int] = None):
+        """Insert a track, replacing its previous vector if it is already indexed"""
+        key = normalize_track_key(track.get('artist', ''), track.get('name', ''))
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                row = len(self.keys)
+                if row == self._vectors.shape[0]:
+                    grown = np.zeros((max(2 * row, 1), self.dimensions), dtype=np.float32)
+                    grown[:row] = self._vectors
+                    self._vectors = grown
+                self._rows[key] = row
+                self.keys.append(key)
+                self.tracks.append({})
+                self.clusters.append(None)
+            self._vectors[row] = vector
+            self.tracks[row] = {name: value for name, value in track.items() if name != 'tags'}
+            self.clusters[row] = cluster
+            self._centroids = None
+
+    def add_clustering_result(self, result: Dict[str, Any], embedding: Optional[TagEmbedding] = None):
+        """Index every track of a clustering result under its cluster, using the tracks' tags.
+
+        The result's clusters replace the previous ones; tracks it does not
+        mention stay searchable but lose their cluster.
+        """
+        clusters = [cluster for cluster in result['clusters'] if not cluster.get('pending')]  # No tags yet
+        members = [(int(cluster['id']), track) for cluster in clusters for track in cluster['tracks']]
+        vectors = track_vectors([track.get('tags') or [] for _, track in members], embedding)
+        with self._lock:
+            self.clusters = [None] * len(self.keys)
+            self.cluster_genres = {int(cluster['id']): cluster['genre'] for cluster in clusters}
+            for (cluster_id, track), vector in zip(members, vectors):
+                self.add(track, vector, cluster_id)
+
+    def vector_for(self, track: Dict[str, Any]) -> Optional[np.ndarray]:
+        row = self._rows.get(normalize_track_key(track.get('artist', ''), track.get('name', '')))
+        return None if row is None else self._vectors[row].copy()
+
+    def query(self, vector: np.ndarray, k: int = DEFAULT_NEIGHBOURS,
+              exclude: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """The k most cosine-similar indexed tracks, best first"""
+        with self._lock:
+            n = len(self.keys)
+            if n == 0 or not np.any(vector):
+                return []
+            scores = self.vectors @ np.asarray(vector, dtype=np.float32)
+            if exclude is not None:
+                row = self._rows.get(normalize_track_key(exclude.get('artist', ''), exclude.get('name', '')))
+                if row is not None:
+                    scores[row] = -np.inf
+            k = min(k, n)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                {'track': self.tracks[i], 'score': float(scores[i]), 'cluster': self.clusters[i]}
+                for i in top if np.isfinite(scores[i])
+            ]
+
+    def _cluster_centroids(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._centroids is None:
+            labels = np.array([-1 if c is None else c for c in self.clusters], dtype=int)
+            ids = np.unique(labels[labels >= 0])
+            centroids = np.zeros((len(ids), self.dimensions), dtype=np.float32)
+            for j, cluster_id in enumerate(ids):
+                centroid = self.vectors[labels == cluster_id].mean(axis=0)
+                norm = np.linalg.norm(centroid)
+                centroids[j] = centroid / norm if norm > 0 else centroid
+            self._centroids = (ids, centroids)
+        return self._centroids
+
+    def assign(self, vector: np.ndarray) -> Optional[Dict[str, Any]]:
+        """The existing cluster whose centroid is most cosine-similar, or None without clusters"""
+        with self._lock:
+            ids, centroids = self._cluster_centroids()
+            if len(ids) == 0 or not np.any(vector):
+                return None
+            scores = centroids @ np.asarray(vector, dtype=np.float32)
+            best = int(np.argmax(scores))
+            cluster_id = int(ids[best])
+            return {'cluster': cluster_id, 'genre': self.cluster_genres.get(cluster_id), 'score': float(scores[best])}
+
+    def save(self, path: str):
+        with self._lock:
+            meta = {
+                'space': self.space,
+                'keys': self.keys,
+                'tracks': self.tracks,
+                'clusters': self.clusters,
+                'cluster_genres': {str(k): v for k, v in self.cluster_genres.items()}
+            }
+            vectors = self.vectors.copy()
+        def write(tmp_path: str):
+            np.savez(tmp_path, vectors=vectors, meta=np.array(json.dumps(meta)))
+        atomic_write(path, write, suffix='.tmp.npz')  # np.savez appends .npz to paths without it
+
+    @classmethod
+    def load(cls, path: str) -> 'TrackIndex':
+        with np.load(path) as data:
+            vectors = data['vectors']
+            meta = json.loads(str(data['meta']))
+        index = cls(meta['space'], vectors.shape[1], capacity=max(len(vectors), 64))
+        index._vectors[:len(vectors)] = vectors
+        index.keys = meta['keys']
+        index.tracks = meta['tracks']
+        index.clusters = meta['clusters']
+        index.cluster_genres = {int(k): v for k, v in meta['cluster_genres'].items()}
+        index._rows = {key: row for row, key in enumerate(index.keys)}
+        return index
+
+
+def lookup_track_vector(index: TrackIndex, track: Dict[str, Any],
+                        tag_cache: Optional[TagCache] = None) -> Tuple[np.ndarray, str]:
+    """A track's vector from the index, or from its (cached) Last.fm tags when it is not indexed"""
+    vector = index.vector_for(track)
+    if vector is not None:
+        return vector, 'index'
+    if 'artist' not in track or 'name' not in track:
+        raise ValueError("Track needs an artist and a name")
+    api_key = get_lastfm_api_key()
+    # Tag names only, like the clustering results the index is built from, so both sides weight tags alike
+    tags = fetch_cached_lastfm_tags(track['artist'], track['name'], api_key, tag_cache)
+    return track_vectors([tags])[0], 'tags'
+
+
+class TrackIndexStore:
+    """One .npz file per index under a directory, kept loaded after first use"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.getenv('TRACK_INDEX_DIR', DEFAULT_INDEX_DIR)
+        os.makedirs(self.directory, exist_ok=True)
+        self._indexes: Dict[str, TrackIndex] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, index_id: str) -> str:
+        digest = hashlib.sha1(str(index_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.npz")
+
+    def get(self, index_id: str, create: bool = False) -> Optional[TrackIndex]:
+        """Return the index in the current vector space; a stale one is dropped when create is set"""
+        space = vector_space()
+        with self._lock:
+            index = self._indexes.get(index_id)
+            if index is None and os.path.exists(self._path(index_id)):
+                index = TrackIndex.load(self._path(index_id))
+            if index is not None and index.space != space:
+                index = None  # Built with another tag embedding; its vectors are not comparable
+            if index is None and create:
+                index = TrackIndex(space, track_vectors([[]]).shape[1])
+            if index is not None:
+                self._indexes[index_id] = index
+            return index
+
+    def save(self, index_id: str):
+        with self._lock:
+            index = self._indexes.get(index_id)
+        if index is not None:
+            index.save(self._path(index_id))
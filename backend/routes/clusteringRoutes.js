@@ -1,9 +1,10 @@
 const express = require('express');
-const { clusterPlaylistTracks } = require('../controllers/clusteringController');
+const { clusterPlaylistTracks, streamPlaylistTracks } = require('../controllers/clusteringController');
 const validateAccessToken = require('../middleware/authMiddleware');
 
 const router = express.Router();
 
 router.post('/clusterPlaylistTracks', validateAccessToken, clusterPlaylistTracks);
+router.post('/clusterPlaylistTracks/stream', validateAccessToken, streamPlaylistTracks);
 
 module.exports = router;